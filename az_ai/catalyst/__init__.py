@@ -1,4 +1,5 @@
 from .catalyst import Catalyst
+from .policies import HedgePolicy, RetryPolicy
 from .runner import OperationError
 from .schema import (
     Chunk,
@@ -20,6 +21,8 @@ __all__ = [
     "Fragment",
     "FragmentRelationships",
     "FragmentSelector",
+    "HedgePolicy",
     "ImageFragment",
     "OperationError",
+    "RetryPolicy",
 ]
@@ -1,40 +1,119 @@
-from azure.core.exceptions import ResourceNotFoundError
-from azure.storage.blob import BlobServiceClient
+import base64
+import hashlib
+import re
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import suppress
+from typing import Any
+from urllib.parse import quote, unquote
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.storage.blob import BlobProperties, BlobServiceClient
 
 from az_ai.catalyst.repository import (
     DuplicateFragmentError,
     FragmentContentNotFoundError,
-    FragmentIndex,
+    FragmentIndexEntry,
     FragmentNotFoundError,
     Repository,
 )
-from az_ai.catalyst.schema import Fragment, FragmentSelector, OperationsLog, OperationsLogEntry
+from az_ai.catalyst.schema import (
+    FailureLogEntry,
+    Fragment,
+    FragmentSelector,
+    Lease,
+    OperationsLog,
+    OperationsLogEntry,
+    ProgressLogEntry,
+)
+
+_TAG_VALUE_PATTERN = re.compile(r"[A-Za-z0-9 +\-./:=_]{0,256}")
+_ENCODED_TAG_PREFIXES = ("b64:", "sha256:")
+
+
+def _tag_value(value: str) -> str:
+    """
+    Blob index tag values are limited to 256 letters, digits, spaces and `+-./:=_` characters: other values are
+    replaced by their url-safe base64 encoding, or by their hash when that encoding is too long.
+    """
+    if _TAG_VALUE_PATTERN.fullmatch(value) and not value.startswith(_ENCODED_TAG_PREFIXES):
+        return value
+    encoded = "b64:" + base64.urlsafe_b64encode(value.encode("utf-8")).decode("ascii")
+    if len(encoded) <= 256:
+        return encoded
+    return "sha256:" + hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def _metadata_value(value: str) -> str:
+    """Blob metadata values are sent as HTTP headers and must be ASCII, so they are percent-encoded."""
+    return quote(value, safe="/:,")
 
 
 class AzureRepository(Repository):
+    """
+    Repository storing fragments in an Azure Storage Account blob container.
+
+    Fragment blobs carry blob index tags (id, type, label, source document, content hash) for server-side
+    filtering and a small header in their blob metadata, so that `find` and `find_headers` work from a blob
+    listing instead of a shared index blob.
+
+    Writes are conditional (create only if missing, update only if present) instead of being preceded by an
+    existence check, and the ids of known fragments are kept in memory to reject duplicates without a
+    round-trip. The operations log and the leases are updated only if their blob did not change since it was
+    read, so that workers on several machines can share the repository.
+
+    Writing and querying blob index tags requires the Tags and Filter permissions (`t` and `f` in a SAS), which
+    the "Storage Blob Data Owner" role grants but "Storage Blob Data Contributor" does not.
+    """
+
+    tag_index_lag: float = 300.0
+    """Seconds during which fragments stored by this instance may be missing from blob index tag queries."""
+
     def __init__(self, account_url: str, container_name: str, credential):
+        self._connect(account_url, container_name, credential)
+        with suppress(ResourceExistsError):
+            self.container_client.create_container()
+
+        with suppress(ResourceExistsError):
+            self.container_client.get_blob_client(self._operations_log_path).upload_blob(
+                OperationsLog().model_dump_json(indent=2), match_condition=MatchConditions.IfMissing
+            )
+
+    def _connect(self, account_url: str, container_name: str, credential):
+        self._account_url = account_url
+        self._container_name = container_name
+        self._credential = credential
         self.blob_service_client = BlobServiceClient(account_url=account_url, credential=credential)
         self.container_client = self.blob_service_client.get_container_client(container_name)
-        if not self.container_client.exists():
-            self.container_client.create_container()
 
         self._contents_prefix = "_content"
         self._fragments_prefix = "_fragments"
         self._operations_log_path = "_operations_log.json"
-        self._index_path = f"{self._fragments_prefix}/_index.json"
+        self._leases_prefix = "_leases"
+        self._progress_prefix = "_progress"
+        self._failures_prefix = "_failures"
+        self._known_ids: set[str] | None = None
+        self._recent_writes: dict[str, tuple[float, str | None]] = {}
+
+    def __getstate__(self) -> dict[str, Any]:
+        """
+        Only the connection settings are pickled, clients are recreated when unpickled (e.g. in worker processes).
+        """
+        return {
+            "account_url": self._account_url,
+            "container_name": self._container_name,
+            "credential": self._credential,
+        }
 
-        if not self._blob_exists(self._operations_log_path):
-            self._write_log(OperationsLog())
-        if not self._blob_exists(self._index_path):
-            self._write_index(FragmentIndex())
+    def __setstate__(self, state: dict[str, Any]):
+        self._connect(**state)
 
     def get(self, reference: str) -> Fragment:
         """Get the fragment for the given reference."""
         fragment_path = self._fragment_path(reference)
         try:
-            blob_client = self.container_client.get_blob_client(fragment_path)
-            fragment_data = blob_client.download_blob().readall().decode("utf-8")
-            fragment = Fragment.from_json(fragment_data)
+            fragment = self._download_fragment(fragment_path)
             if fragment.content_ref:
                 fragment.content = self._get_content_from_ref(fragment)
             return fragment
@@ -45,118 +124,428 @@ class AzureRepository(Repository):
         """Store the given fragment."""
         fragment_path = self._fragment_path(fragment)
 
-        if self._blob_exists(fragment_path):
+        if fragment.id in self._known_fragment_ids():
             raise DuplicateFragmentError(f"Fragment {fragment.id} already exists in Azure Blob Storage.")
 
         # Handle content from URL if available
         if not fragment.content and "content_url" in fragment.__class__.model_fields and fragment.content_url:
             fragment.content = self._load_content_from_url(fragment)
-
-        # Store content if available
         if fragment.content:
-            self._store_content(fragment)
+            self._prepare_content(fragment)
 
-        # Store fragment
-        blob_client = self.container_client.get_blob_client(fragment_path)
-        blob_client.upload_blob(fragment.model_dump_json(indent=2))
+        # Create the fragment only if it does not exist yet, the service detects duplicates
+        try:
+            self._upload_fragment(fragment_path, fragment, match_condition=MatchConditions.IfMissing)
+        except (ResourceExistsError, ResourceModifiedError) as exc:
+            self._known_fragment_ids().add(fragment.id)
+            raise DuplicateFragmentError(f"Fragment {fragment.id} already exists in Azure Blob Storage.") from exc
+        self._known_fragment_ids().add(fragment.id)
+        self._recent_writes[fragment_path] = (time.monotonic(), fragment.source_document_ref())
 
-        # Update index
-        self._write_index(self._read_index().add(fragment))
+        # Store content if available
+        if fragment.content:
+            try:
+                self._upload_content(fragment)
+            except Exception:
+                self.container_client.delete_blob(fragment_path)
+                self._known_fragment_ids().discard(fragment.id)
+                self._recent_writes.pop(fragment_path, None)
+                raise
 
         return fragment
 
-    def update(self, fragment: Fragment) -> Fragment:
+    def update(self, fragment: Fragment, content_changed: bool = None) -> Fragment:
         """Update the given fragment."""
         fragment_path = self._fragment_path(fragment)
 
-        if not self._blob_exists(fragment_path):
-            raise FragmentNotFoundError(f"Fragment {fragment.id} does not exist in Azure Blob Storage.")
+        changed = self._content_changed(fragment, content_changed)
+        if changed:
+            self._prepare_content(fragment)
 
-        # Update content if provided
-        if fragment.content:
-            self._store_content(fragment, update_link=False)
+        # Update the fragment only if it exists
+        try:
+            self._upload_fragment(fragment_path, fragment, match_condition=MatchConditions.IfPresent)
+        except (ResourceNotFoundError, ResourceModifiedError) as exc:
+            raise FragmentNotFoundError(f"Fragment {fragment.id} does not exist in Azure Blob Storage.") from exc
+        self._recent_writes[fragment_path] = (time.monotonic(), fragment.source_document_ref())
 
-        # Update fragment
-        blob_client = self.container_client.get_blob_client(fragment_path)
-        blob_client.upload_blob(fragment.model_dump_json(indent=2), overwrite=True)
+        # Update content only if it changed
+        if changed:
+            self._upload_content(fragment)
+
+        return fragment
 
-        # Update index
-        self._write_index(self._read_index().update(fragment))
+    def _known_fragment_ids(self) -> set[str]:
+        """
+        Ids of the fragments known to exist in the container, loaded from a blob listing on first use and
+        maintained by this instance afterwards. Used to reject duplicates without a round-trip.
+        """
+        if self._known_ids is None:
+            self._known_ids = {
+                blob.name.rsplit("/", 1)[-1].removesuffix(".json")
+                for blob in self.container_client.list_blobs(name_starts_with=f"{self._fragments_prefix}/")
+                if blob.name.endswith(".json") and blob.name.count("/") == 2
+            }
+        return self._known_ids
+
+    def update_metadata(self, reference: str, patch: dict[str, Any]) -> Fragment:
+        """Update the metadata of the given fragment without reading or rewriting its content."""
+        fragment_path = self._fragment_path(reference)
+        try:
+            fragment = self._download_fragment(fragment_path).patch_metadata(patch)
+        except ResourceNotFoundError as exc:
+            raise FragmentNotFoundError(f"Fragment {reference} not found in Azure Blob Storage.") from exc
+        self._upload_fragment(fragment_path, fragment, match_condition=MatchConditions.IfPresent)
 
         return fragment
 
+    def delete(self, reference: str) -> None:
+        """Delete the given fragment and its content."""
+        fragment_path = self._fragment_path(reference)
+        try:
+            fragment = self._download_fragment(fragment_path)
+        except ResourceNotFoundError as exc:
+            raise FragmentNotFoundError(f"Fragment {reference} not found in Azure Blob Storage.") from exc
+        if fragment.content_ref:
+            with suppress(ResourceNotFoundError):
+                self.container_client.delete_blob(self._content_path(fragment))
+        with suppress(ResourceNotFoundError):
+            self.container_client.delete_blob(fragment_path)
+        self._recent_writes.pop(fragment_path, None)
+        if self._known_ids is not None:
+            self._known_ids.discard(reference)
+
     def find(self, selector: FragmentSelector = None, with_content: bool = True) -> list[Fragment]:
         """Get all fragments matching the given spec."""
         fragments = []
-        index = self._read_index()
 
-        for fragment_ref in index.match(selector):
-            fragment_path = self._fragment_path(fragment_ref)
+        for blob, _ in self._list_fragment_blobs(selector):
             try:
-                blob_client = self.container_client.get_blob_client(fragment_path)
-                fragment_data = blob_client.download_blob().readall().decode("utf-8")
-                fragment = Fragment.from_json(fragment_data)
-                fragments.append(self.get(fragment.id) if with_content else fragment)
+                fragment = self._download_fragment(blob.name)
             except ResourceNotFoundError:
-                # Skip fragments that might be in the index but not in storage (inconsistent state)
-                pass
+                # Skip fragments deleted since the listing
+                continue
+            if with_content and fragment.content_ref:
+                fragment.content = self._get_content_from_ref(fragment)
+            fragments.append(fragment)
 
         return fragments
 
+    def find_headers(self, selector: FragmentSelector = None) -> list[FragmentIndexEntry]:
+        """Get lightweight headers of all fragments matching the given spec, from the blob listing only."""
+        return [header for _, header in self._list_fragment_blobs(selector)]
+
+    def find_content_hashes(self, selector: FragmentSelector = None) -> dict[str, str]:
+        """Get the content hashes of all fragments matching the given spec, mapped to the fragment references."""
+        return {header.content_hash: header.ref for header in self.find_headers(selector) if header.content_hash}
+
     def add_operations_log_entry(self, operations_log_entry: OperationsLogEntry) -> None:
         """Add an operation log entry to the repository."""
-        log = self._read_log()
-        log.entries.append(operations_log_entry)
-        self._write_log(log)
+        self._update_log(lambda log: log.add(operations_log_entry))
 
-    def find_operations_log_entry(self, operation_name: str = None, input_fragment_refs: set[str] = None):
+    def find_operations_log_entry(
+        self, operation_name: str = None, input_fragment_refs: set[str] = None, memo_key: str = None
+    ):
         """
-        Find an operation log entry by operation_name and/or input_fragment_ref
+        Find an operation log entry by operation_name and/or input_fragment_ref, or by memo_key
         """
-        return [
-            entry
-            for entry in self._read_log().entries
-            if (not operation_name or operation_name == entry.operation_name)
-            and (
-                not input_fragment_refs
-                or (
-                    len(input_fragment_refs) == len(entry.input_refs)
-                    and all(ref in entry.input_refs for ref in input_fragment_refs)
-                )
+        return self._read_log().find(
+            operation_name=operation_name, input_fragment_refs=input_fragment_refs, memo_key=memo_key
+        )
+
+    def find_operations_log_fingerprints(self, fingerprints: Iterable[str]) -> set[str]:
+        """Get the fingerprints, among the given ones, having an operations log entry."""
+        return self._read_log().find_fingerprints(fingerprints)
+
+    def delete_operations_log_entries(self, fingerprints: Iterable[str]) -> None:
+        """Delete the operations log entries with the given fingerprints."""
+        fingerprints = list(fingerprints)
+        self._update_log(lambda log: log.remove(fingerprints))
+
+    def add_failure_log_entry(self, failure_log_entry: FailureLogEntry) -> None:
+        """
+        Add a failed operation call to the failure log, replacing the previous failure of the same call.
+
+        The failure of each call is a blob of its own, so that looking failures up does not download the
+        operations log.
+        """
+        self._upload_record(self._failures_prefix, failure_log_entry)
+
+    def find_failure_log_entries(
+        self, operation_name: str = None, fingerprints: Iterable[str] = None
+    ) -> list[FailureLogEntry]:
+        """Find failed operation calls by operation_name and/or fingerprints."""
+        return self._find_records(self._failures_prefix, FailureLogEntry, operation_name, fingerprints)
+
+    def delete_failure_log_entries(self, fingerprints: Iterable[str]) -> None:
+        """Delete the failure log entries with the given fingerprints."""
+        self._delete_records(self._failures_prefix, fingerprints)
+
+    def add_progress_log_entry(self, progress_log_entry: ProgressLogEntry) -> None:
+        """
+        Record the outputs stored so far by a call of a generator operation, replacing its previous progress.
+
+        The progress of each call is a blob of its own, overwritten by the worker running the call, instead of an
+        update of the operations log.
+        """
+        self._upload_record(self._progress_prefix, progress_log_entry)
+
+    def find_progress_log_entries(
+        self, operation_name: str = None, fingerprints: Iterable[str] = None
+    ) -> list[ProgressLogEntry]:
+        """Find the progress of unfinished calls by operation_name and/or fingerprints."""
+        return self._find_records(self._progress_prefix, ProgressLogEntry, operation_name, fingerprints)
+
+    def delete_progress_log_entries(self, fingerprints: Iterable[str]) -> None:
+        """Delete the progress log entries with the given fingerprints."""
+        self._delete_records(self._progress_prefix, fingerprints)
+
+    @staticmethod
+    def _record_path(prefix: str, fingerprint: str) -> str:
+        return f"{prefix}/{fingerprint}.json"
+
+    def _upload_record(self, prefix: str, record: FailureLogEntry | ProgressLogEntry) -> None:
+        self.container_client.get_blob_client(self._record_path(prefix, record.fingerprint)).upload_blob(
+            record.model_dump_json(), overwrite=True
+        )
+
+    def _find_records[T: FailureLogEntry | ProgressLogEntry](
+        self, prefix: str, record_class: type[T], operation_name: str = None, fingerprints: Iterable[str] = None
+    ) -> list[T]:
+        """Download the records of calls stored under a prefix, one blob per call fingerprint."""
+        if fingerprints is not None:
+            paths = [self._record_path(prefix, fingerprint) for fingerprint in fingerprints]
+        else:
+            paths = [blob.name for blob in self.container_client.list_blobs(name_starts_with=f"{prefix}/")]
+        records = []
+        for path in paths:
+            with suppress(ResourceNotFoundError):
+                data = self.container_client.get_blob_client(path).download_blob().readall()
+                records.append(record_class.model_validate_json(data))
+        return [record for record in records if not operation_name or operation_name == record.operation_name]
+
+    def _delete_records(self, prefix: str, fingerprints: Iterable[str]) -> None:
+        for fingerprint in fingerprints:
+            with suppress(ResourceNotFoundError):
+                self.container_client.get_blob_client(self._record_path(prefix, fingerprint)).delete_blob()
+
+    def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """Claim the lease with the given key for `ttl` seconds, unless another owner holds an unexpired one."""
+        blob_client = self.container_client.get_blob_client(self._lease_path(key))
+        lease = Lease(key=key, owner=owner, expires_at=time.time() + ttl).model_dump_json()
+        try:
+            blob_client.upload_blob(lease, match_condition=MatchConditions.IfMissing)
+            return True
+        except ResourceExistsError:
+            pass
+        try:
+            downloader = blob_client.download_blob()
+        except ResourceNotFoundError:
+            return False
+        current = Lease.model_validate_json(downloader.readall())
+        if current.owner != owner and not current.expired():
+            return False
+        try:
+            blob_client.upload_blob(
+                lease, overwrite=True, etag=downloader.properties.etag, match_condition=MatchConditions.IfNotModified
             )
-        ]
+        except (ResourceModifiedError, ResourceNotFoundError):
+            # claimed or released by another worker in the meantime
+            return False
+        return True
+
+    def renew_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """Extend the lease with the given key held by `owner` for `ttl` seconds from now."""
+        blob_client = self.container_client.get_blob_client(self._lease_path(key))
+        try:
+            downloader = blob_client.download_blob()
+            if Lease.model_validate_json(downloader.readall()).owner != owner:
+                return False
+            blob_client.upload_blob(
+                Lease(key=key, owner=owner, expires_at=time.time() + ttl).model_dump_json(),
+                overwrite=True,
+                etag=downloader.properties.etag,
+                match_condition=MatchConditions.IfNotModified,
+            )
+        except (ResourceModifiedError, ResourceNotFoundError):
+            return False
+        return True
+
+    def release_lease(self, key: str, owner: str) -> None:
+        """Release the lease with the given key if it is held by `owner`."""
+        blob_client = self.container_client.get_blob_client(self._lease_path(key))
+        with suppress(ResourceModifiedError, ResourceNotFoundError):
+            downloader = blob_client.download_blob()
+            if Lease.model_validate_json(downloader.readall()).owner == owner:
+                blob_client.delete_blob(etag=downloader.properties.etag, match_condition=MatchConditions.IfNotModified)
+
+    def _lease_path(self, key: str) -> str:
+        return f"{self._leases_prefix}/{key}.json"
 
     def _read_log(self) -> OperationsLog:
         """Read the operations log from blob storage."""
+        return self._read_log_with_etag()[0]
+
+    def _read_log_with_etag(self) -> tuple[OperationsLog, str | None]:
         try:
             blob_client = self.container_client.get_blob_client(self._operations_log_path)
-            log_data = blob_client.download_blob().readall().decode("utf-8")
-            return OperationsLog.model_validate_json(log_data)
+            downloader = blob_client.download_blob()
+            log_data = downloader.readall().decode("utf-8")
+            return OperationsLog.model_validate_json(log_data), downloader.properties.etag
         except ResourceNotFoundError:
-            return OperationsLog()
+            return OperationsLog(), None
 
-    def _write_log(self, log: OperationsLog):
-        """Write the operations log to blob storage."""
+    def _update_log(self, update: Callable[[OperationsLog], None]):
+        """Read, update and write the operations log, again if another writer changed it in the meantime."""
         blob_client = self.container_client.get_blob_client(self._operations_log_path)
-        blob_client.upload_blob(log.model_dump_json(indent=2), overwrite=True)
+        while True:
+            log, etag = self._read_log_with_etag()
+            update(log)
+            try:
+                if etag is None:
+                    blob_client.upload_blob(log.model_dump_json(indent=2), match_condition=MatchConditions.IfMissing)
+                else:
+                    blob_client.upload_blob(
+                        log.model_dump_json(indent=2),
+                        overwrite=True,
+                        etag=etag,
+                        match_condition=MatchConditions.IfNotModified,
+                    )
+                return
+            except (ResourceExistsError, ResourceModifiedError):
+                continue
+
+    def _download_fragment(self, fragment_path: str) -> Fragment:
+        blob_client = self.container_client.get_blob_client(fragment_path)
+        return Fragment.from_json(blob_client.download_blob().readall().decode("utf-8"))
 
-    def _read_index(self) -> FragmentIndex:
-        """Read the fragment index from blob storage."""
-        try:
-            blob_client = self.container_client.get_blob_client(self._index_path)
-            index_data = blob_client.download_blob().readall().decode("utf-8")
-            return FragmentIndex.model_validate_json(index_data)
-        except ResourceNotFoundError:
-            return FragmentIndex()
+    def _upload_fragment(self, fragment_path: str, fragment: Fragment, match_condition: MatchConditions) -> None:
+        """Upload the fragment JSON with its blob index tags and header metadata, under the given condition."""
+        blob_client = self.container_client.get_blob_client(fragment_path)
+        blob_client.upload_blob(
+            fragment.model_dump_json(indent=2),
+            overwrite=match_condition != MatchConditions.IfMissing,
+            match_condition=match_condition,
+            metadata=self._header_metadata(fragment),
+            tags=self._tags(fragment),
+        )
+
+    @staticmethod
+    def _tags(fragment: Fragment) -> dict[str, str]:
+        """
+        Blob index tags of a fragment, queryable server-side with `find_blobs_by_tags` for the values returned by
+        `_tag_value`.
+        """
+        tags = {
+            "id": fragment.id,
+            "type": fragment.class_name(),
+            "label": fragment.label,
+        }
+        if fragment.source_document_ref():
+            tags["source_document"] = fragment.source_document_ref()
+        if fragment.content_hash:
+            tags["content_hash"] = fragment.content_hash
+        return {key: _tag_value(value) for key, value in tags.items()}
+
+    @staticmethod
+    def _header_metadata(fragment: Fragment) -> dict[str, str]:
+        """Blob metadata of a fragment: the fields of its FragmentIndexEntry, returned by blob listings."""
+        entry = FragmentIndexEntry.from_fragment(fragment)
+        metadata = {
+            "fragment_id": entry.ref,
+            "label": entry.label,
+            "types": ",".join(sorted(entry.types)),
+        }
+        if entry.content_hash:
+            metadata["content_hash"] = entry.content_hash
+        if entry.source_document_ref:
+            metadata["source_document_ref"] = entry.source_document_ref
+        return {key: _metadata_value(value) for key, value in metadata.items()}
+
+    def _header(self, blob: BlobProperties) -> FragmentIndexEntry:
+        metadata = {key: unquote(value) for key, value in (blob.metadata or {}).items()}
+        if "fragment_id" not in metadata:
+            # Fragment written before headers were introduced
+            return FragmentIndexEntry.from_fragment(self._download_fragment(blob.name))
+        return FragmentIndexEntry(
+            ref=metadata["fragment_id"],
+            label=metadata["label"],
+            types=set(metadata["types"].split(",")),
+            content_hash=metadata.get("content_hash"),
+            source_document_ref=metadata.get("source_document_ref"),
+        )
+
+    def _list_fragment_blobs(
+        self, selector: FragmentSelector = None
+    ) -> Iterator[tuple[BlobProperties, FragmentIndexEntry]]:
+        """
+        List fragment blobs matching the selector with their headers.
+
+        Fragments of the selected source documents are looked up by their "source_document" blob index tag.
+        Otherwise the fragment blobs are listed, listings being strongly consistent.
+        """
+        if selector is not None and selector.source_document_refs is not None:
+            yield from self._find_fragment_blobs_by_source_documents(selector)
+            return
+        for prefix in self._fragment_prefixes(selector):
+            for blob in self.container_client.list_blobs(name_starts_with=prefix, include=["metadata"]):
+                if not blob.name.endswith(".json") or blob.name.count("/") != 2:
+                    # not a {prefix}/{type}/{id}.json fragment blob (e.g. legacy _fragments/_index.json)
+                    continue
+                header = self._header(blob)
+                if header.match(selector):
+                    yield blob, header
+
+    def _find_fragment_blobs_by_source_documents(
+        self, selector: FragmentSelector
+    ) -> Iterator[tuple[BlobProperties, FragmentIndexEntry]]:
+        """
+        Find the fragment blobs of the selected source documents with a blob index tag query per document.
 
-    def _write_index(self, index: FragmentIndex):
-        blob_client = self.container_client.get_blob_client(self._index_path)
-        blob_client.upload_blob(index.model_dump_json(indent=2), overwrite=True)
+        The blob index can lag behind recent writes, so the fragments stored or updated by this instance in the
+        last `tag_index_lag` seconds are added to the query results. Fragments just stored by another instance
+        may still be missing.
+        """
+        names = set()
+        for ref in selector.source_document_refs:
+            query = f"\"source_document\"='{_tag_value(ref)}'"
+            names.update(blob.name for blob in self.container_client.find_blobs_by_tags(query))
+        names.update(self._recently_written(selector.source_document_refs))
+
+        prefixes = tuple(self._fragment_prefixes(selector))
+        for name in sorted(names):
+            if not name.startswith(prefixes):
+                continue
+            try:
+                blob = self.container_client.get_blob_client(name).get_blob_properties()
+            except ResourceNotFoundError:
+                # Skip fragments deleted since they were indexed
+                continue
+            header = self._header(blob)
+            if header.match(selector):
+                yield blob, header
+
+    def _recently_written(self, source_document_refs: list[str]) -> list[str]:
+        """Paths of the fragment blobs of the given source documents written less than `tag_index_lag` ago."""
+        deadline = time.monotonic() - self.tag_index_lag
+        self._recent_writes = {path: write for path, write in self._recent_writes.items() if write[0] >= deadline}
+        return [path for path, (_, ref) in self._recent_writes.items() if ref in source_document_refs]
+
+    def _fragment_prefixes(self, selector: FragmentSelector = None) -> list[str]:
+        if selector is None or selector.fragment_type == Fragment.class_name():
+            return [f"{self._fragments_prefix}/"]
+        fragment_cls = Fragment.get_subclass(selector.fragment_type)
+        return [
+            f"{self._fragments_prefix}/{cls.class_name()}/" for cls in [fragment_cls, *fragment_cls.all_subclasses()]
+        ]
 
-    def _store_content(self, fragment: Fragment, update_link: bool = True) -> None:
+    def _prepare_content(self, fragment: Fragment) -> None:
         if fragment.content_ref is None:
             fragment.content_ref = fragment.id
+        fragment.content_hash = fragment.compute_content_hash()
+        fragment.content_size = len(fragment.content)
 
+    def _upload_content(self, fragment: Fragment) -> None:
         content_path = self._content_path(fragment)
         blob_client = self.container_client.get_blob_client(content_path)
         blob_client.upload_blob(fragment.content, overwrite=True)
@@ -173,11 +562,12 @@ class AzureRepository(Repository):
         if isinstance(fragment_or_ref, Fragment):
             return f"{self._fragments_prefix}/{fragment_or_ref.__class__.class_name()}/{fragment_or_ref.id}.json"
         else:
-            # Need to find the right path by listing fragments
-            prefix = f"{self._fragments_prefix}"
-            blobs = list(self.container_client.list_blobs(name_starts_with=prefix))
+            # Server-side lookup by the "id" blob index tag
+            for blob in self.container_client.find_blobs_by_tags(f"\"id\"='{_tag_value(fragment_or_ref)}'"):
+                return blob.name
 
-            for blob in blobs:
+            # The blob index can lag behind recent writes, fall back to listing fragments
+            for blob in self.container_client.list_blobs(name_starts_with=f"{self._fragments_prefix}/"):
                 # Looking for blobs ending with /{fragment_or_ref}.json
                 if blob.name.endswith(f"/{fragment_or_ref}.json"):
                     return blob.name
@@ -188,11 +578,3 @@ class AzureRepository(Repository):
         if not fragment.content_ref:
             raise FragmentContentNotFoundError(f"Fragment {fragment.id} does not have a content reference.")
         return f"{self._contents_prefix}/{fragment.content_ref}"
-
-    def _blob_exists(self, blob_path: str) -> bool:
-        blob_client = self.container_client.get_blob_client(blob_path)
-        try:
-            blob_client.get_blob_properties()
-            return True
-        except ResourceNotFoundError:
-            return False
@@ -0,0 +1,71 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+
+
+class MicroBatcher[T, R]:
+    """
+    Coalesce items submitted concurrently into batches of up to `batch_size` items, processed together once the
+    batch is full or `batch_wait_ms` milliseconds after its first item was submitted.
+    """
+
+    def __init__(self, process: Callable[[list[T]], Awaitable[list[R]]], batch_size: int, batch_wait_ms: float = 0):
+        """
+        Args:
+            process (Callable): The coroutine function processing a batch of items, returning one result per item,
+                in the same order.
+            batch_size (int): The maximum number of items in a batch.
+            batch_wait_ms (float): The maximum time in milliseconds an item waits for the batch to fill. With 0,
+                the items submitted in the same event loop iteration are batched together.
+        """
+        self.process = process
+        self.batch_size = batch_size
+        self.batch_wait_ms = batch_wait_ms
+        self._pending: list[tuple[T, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, item: T) -> R:
+        """
+        Add an item to the next batch and wait for its result. If processing the batch fails, the error is raised
+        for all its items.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.batch_wait_ms / 1000, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # items whose submitter was cancelled are dropped
+        pending = [(item, future) for item, future in self._pending if not future.done()]
+        batch, self._pending = pending[: self.batch_size], pending[self.batch_size :]
+        if batch:
+            task = asyncio.create_task(self._process(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.batch_wait_ms / 1000, self._flush)
+
+    async def _process(self, batch: list[tuple[T, asyncio.Future]]):
+        try:
+            results = await self.process([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except BaseException:
+            for _, future in batch:
+                future.cancel()
+            raise
+        for (_, future), result in zip(batch, results, strict=True):
+            if not future.done():
+                future.set_result(result)
@@ -1,8 +1,17 @@
-import functools
+import hashlib
 import inspect
 import logging
 import mimetypes
-from collections.abc import Callable
+from collections.abc import (
+    AsyncGenerator,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Generator,
+    Iterable,
+    Iterator,
+)
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import (
     Annotated,
@@ -23,7 +32,8 @@ from semantic_kernel import Kernel
 
 from az_ai.catalyst.azure_repository import AzureRepository
 from az_ai.catalyst.helpers.content_understanding_client import AzureContentUnderstandingClient
-from az_ai.catalyst.repository import LocalRepository, Repository
+from az_ai.catalyst.policies import HedgePolicy, RateLimiter, RetryPolicy
+from az_ai.catalyst.repository import InMemoryRepository, LocalRepository, Repository
 from az_ai.catalyst.runner import CatalystRunner, OperationError
 from az_ai.catalyst.schema import (
     CommandFunctionType,
@@ -50,6 +60,16 @@ class CatalystInitializationError(RuntimeError):
         super().__init__("\n".join(message))
 
 
+# Settings holding the requests and tokens per minute quotas of each client
+CLIENT_RATE_LIMIT_SETTINGS = {
+    "azure_openai_client": ("azure_openai_requests_per_minute", "azure_openai_tokens_per_minute"),
+    "document_intelligence_client": ("azure_ai_document_intelligence_requests_per_minute", None),
+    "content_understanding_client": ("azure_content_understanding_requests_per_minute", None),
+}
+# Return types of the generator operation functions, yielding their outputs
+ITERATOR_TYPES = (Iterator, Iterable, Generator, AsyncIterator, AsyncIterable, AsyncGenerator)
+
+
 class Catalyst:
     def __init__(
         self,
@@ -73,44 +93,129 @@ class Catalyst:
             match parsed_url.scheme:
                 case "" | "file":
                     self.repository = LocalRepository(path=parsed_url.path)
+                case "memory":
+                    self.repository = InMemoryRepository()
                 case "https":
                     if not self.settings.repository_container_name:
                         raise ValueError(
                             "repository_container_name setting is mandatory for an Azure Storage repository"
                         )
                     self.repository = AzureRepository(
-                        url=self.settings.repository_url,
+                        account_url=self.settings.repository_url,
                         container_name=self.settings.repository_container_name,
                         credential=self.credential,
                     )
                 case _:
                     raise OperationError(f"Unsupported repository URL : '{repository_url}'")
         self._operations: dict[str, OperationSpec] = {}
+        self._rate_limiters: dict[str, RateLimiter | None] = {}
 
-    def __call__(self, *args, **kwargs):
-        CatalystRunner(self, self.repository).run(*args, **kwargs)
+    def __call__(self, **kwargs):
+        """
+        Run the pipeline, see `CatalystRunner.arun` for the options.
+        """
+        CatalystRunner(self, self.repository).run(**kwargs)
+
+    async def arun(self, **kwargs):
+        """
+        Run the pipeline from a running event loop.
 
-    def operation(self, scope="same") -> Callable[[CommandFunctionType], CommandFunctionType]:
+        Asynchronous operations are awaited on that event loop.
+        """
+        await CatalystRunner(self, self.repository).arun(**kwargs)
+
+    def operation(
+        self,
+        scope: str | Callable[[Fragment], Any] = "same",
+        max_concurrency: int = 1,
+        executor: str = "thread",
+        workers: int = None,
+        memoize: bool | list[str] = False,
+        version: str = None,
+        client: str = None,
+        estimated_tokens: int = 0,
+        retry: RetryPolicy = None,
+        batch_size: int = None,
+        batch_wait_ms: float = 0,
+        hedge: HedgePolicy = None,
+    ) -> Callable[[CommandFunctionType], CommandFunctionType]:
         """
         Decorator to register an operation function.
 
+        An operation function returning a list of fragments can instead yield them, annotated as returning
+        `Annotated[Iterator[Fragment], "label"]` (or `AsyncIterator` for `async def` functions). Each yielded
+        fragment is stored right away and recorded in the progress of the call: if the call fails or the run is
+        interrupted, the next attempt skips the fragments already stored, so the function must yield the same
+        fragments in the same order.
+
         Args:
-            scope (str): The scope of the operation. Can be "same" or "all". Default is "same".
+            scope (str | Callable): The scope of the operation. Can be "same", "all", "metadata:<key>" or
+                a function. Default is "same".
                 "same" means the operation will be executed once for each batch of fragments with
-                the same source document.
+                the same source document. "metadata:<key>" (e.g. "metadata:page_number") further partitions
+                the fragments of a source document by the value of this metadata. A function gets a fragment
+                and returns the key of its partition, fragments of different source documents can share
+                a partition.
+            max_concurrency (int): The maximum number of calls of the operation function running
+                concurrently. Default is 1 (calls are sequential). Synchronous functions run in worker
+                threads, `async def` functions are awaited on the event loop.
+            executor (str): Where calls of a synchronous operation function run, "thread" (default) or
+                "process". Use "process" for CPU-bound operations: the function must be defined at module
+                level and receives its fragments loaded from the repository by the worker process.
+            workers (int): The number of worker processes when executor is "process". Default is the
+                number of CPUs.
+            memoize (bool | list[str]): If True, a call whose inputs have the same type, label and content
+                as the inputs of a previous call of the same operation code reuses (clones) its outputs
+                instead of calling the function. If a list of metadata keys, these metadata of the inputs
+                must be equal too. Default is False.
+            version (str): The version of the operation. Calls made by another version are invalidated on the
+                next run: they are run again and the fragments computed from their outputs are deleted.
+                Default is a fingerprint of the function source code.
+            client (str): The Catalyst client used by the operation function: "azure_openai_client",
+                "document_intelligence_client" or "content_understanding_client". Calls are only started
+                when they fit in the requests (and tokens) per minute quotas configured for this client.
+            estimated_tokens (int): The estimated number of tokens used by a call, counted against the
+                tokens per minute quota of the client. Default is 0.
+            retry (RetryPolicy): How failed calls are retried. Default retries transient errors (connection
+                errors, timeouts, throttling and 5xx responses) up to 5 attempts, with exponential backoff and
+                jitter or after the delay requested by the service. Calls to an endpoint failing repeatedly are
+                paused for a while, for all the operations using the same client.
+            batch_size (int): For an operation function taking a single list parameter and returning a list, the
+                maximum number of input fragments per call. The runner then collects the input fragments, across
+                source documents, into batches of up to `batch_size` fragments: each output must have one of them
+                as source, outputs are logged per input fragment so that calls are skipped and resumed per input
+                fragment. `max_concurrency` applies to batches and `estimated_tokens` to input fragments.
+                Default is None (no batching, calls get all the fragments of their scope).
+            batch_wait_ms (float): The maximum time in milliseconds an input fragment waits for its batch to
+                fill. Default is 0: the input fragments available at the same time are batched together.
+            hedge (HedgePolicy): If set, a call running longer than a quantile (default p95) of the durations of
+                the previous calls of the operation is duplicated. The first successful result is stored and
+                logged, the other calls are cancelled (synchronous functions already running in a thread or a
+                process run to completion, their result is discarded). Use it for calls with a long latency
+                tail, such as LLM completions. Default is None (no hedging).
         """
 
         def decorator(func: CommandFunctionType) -> CommandFunctionType:
             logger.debug("Registering operation function %s...", func.__name__)
-            operation_spec = self._parse_operator_function_signature(func, scope)
-            operation_spec.scope = scope
+            operation_spec = self._parse_operator_function_signature(
+                func,
+                scope=scope,
+                max_concurrency=max_concurrency,
+                executor=executor,
+                workers=workers,
+                memoize=memoize,
+                version=version,
+                client=client,
+                estimated_tokens=estimated_tokens,
+                retry=retry or RetryPolicy(),
+                batch_size=batch_size,
+                batch_wait_ms=batch_wait_ms,
+                hedge=hedge,
+            )
             self._operations[func.__name__] = operation_spec
 
-            @functools.wraps(func)
-            def wrapper(*args, **kwargs):
-                return func(*args, **kwargs)
-
-            return wrapper  # type: ignore
+            # the function itself is returned (not a wrapper) so that it can be pickled to worker processes
+            return func
 
         return decorator
 
@@ -120,6 +225,22 @@ class Catalyst:
         """
         return self._operations
 
+    def rate_limiter(self, client: str) -> RateLimiter | None:
+        """
+        Get the rate limiter enforcing the quotas configured for the given client, shared by all the operations
+        using the client. None if no quota is configured.
+        """
+        if client not in self._rate_limiters:
+            requests_setting, tokens_setting = CLIENT_RATE_LIMIT_SETTINGS[client]
+            requests_per_minute = getattr(self.settings, requests_setting)
+            tokens_per_minute = getattr(self.settings, tokens_setting) if tokens_setting else None
+            self._rate_limiters[client] = (
+                RateLimiter(requests_per_minute, tokens_per_minute)
+                if requests_per_minute or tokens_per_minute
+                else None
+            )
+        return self._rate_limiters[client]
+
     def update_index(self):
         """
         Update the index with the new fragments.
@@ -141,6 +262,8 @@ class Catalyst:
     def add_document_from_file(self, file: str | Path, mime_type: str = None) -> Document:
         """
         Create a Document fragment from a file.
+
+        If a Document with the same content already exists in the repository, it is returned instead.
         """
         logger.debug("Creating document from file %s...", file)
         if isinstance(file, str):
@@ -149,30 +272,96 @@ class Catalyst:
         if not file.exists():
             raise OperationError(f"File {file} does not exist.")
 
-        for document in self.repository.find(FragmentSelector(fragment_type="Document"), with_content=False):
-            if document.metadata.get("file_name") == file.name:
-                print(f"File {file.name} already added. Ignoring.")
-                return
+        content_hash = _file_content_hash(file)
+        known_hashes = self.repository.find_content_hashes(FragmentSelector(fragment_type="Document"))
+        if content_hash in known_hashes:
+            logger.info("File %s already added. Ignoring.", file.name)
+            return self.repository.get(known_hashes[content_hash])
+
+        document = self._document_from_file(file, Path(file.name), content_hash, mime_type)
+        self.repository.store(document)
+
+        return document
+
+    def add_documents_from_directory(
+        self,
+        directory: str | Path,
+        pattern: str = "**/*",
+        workers: int = None,
+        batch_size: int = 1000,
+    ) -> list[Document]:
+        """
+        Create Document fragments for all the files of a directory matching a glob pattern.
 
+        Files are hashed in parallel and deduplicated by content, against the Documents already in the
+        repository and against each other. New Documents are stored in batches of `batch_size` so that the
+        repository index is written once per batch instead of once per file.
+
+        Args:
+            directory (str | Path): The directory to scan.
+            pattern (str): Glob pattern of the files to add, relative to the directory. Default is "**/*".
+            workers (int): Number of threads used to hash the files. Default is the ThreadPoolExecutor default.
+            batch_size (int): Number of Documents stored per batch. Default is 1000.
+
+        Returns:
+            list[Document]: The newly added documents (without their content).
+        """
+        directory = Path(directory).resolve()
+        if not directory.is_dir():
+            raise OperationError(f"Directory {directory} does not exist.")
+
+        files = sorted(path for path in directory.glob(pattern) if path.is_file())
+        logger.debug("Hashing %d files from %s...", len(files), directory)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            content_hashes = list(executor.map(_file_content_hash, files))
+
+        known_hashes = set(self.repository.find_content_hashes(FragmentSelector(fragment_type="Document")))
+        documents = []
+        for file, content_hash in zip(files, content_hashes, strict=True):
+            if content_hash in known_hashes:
+                logger.debug("File %s already added. Ignoring.", file)
+                continue
+            known_hashes.add(content_hash)
+            documents.append(self._document_from_file(file, file.relative_to(directory), content_hash))
+
+        for start in range(0, len(documents), batch_size):
+            # the repository copies or loads the contents from content_url, and releases them once stored
+            self.repository.store_many(documents[start : start + batch_size])
+
+        logger.info(
+            "Added %d documents from %s (%d already added).", len(documents), directory, len(files) - len(documents)
+        )
+        return documents
+
+    def _document_from_file(self, file: Path, name: Path, content_hash: str, mime_type: str = None) -> Document:
+        """
+        Create (but do not store) a Document fragment for a file.
+
+        Args:
+            file (Path): The absolute path of the file.
+            name (Path): The name of the document, used for human-readable file names.
+            content_hash (str): The SHA-256 hash of the file content.
+            mime_type (str): The MIME type of the file. Guessed from the file name if not provided.
+        """
         if mime_type is None:
             mime_type, _ = mimetypes.guess_type(str(file))
             if mime_type is None:
                 mime_type = "application/octet-stream"
-        document = Document(
+        file_size = file.stat().st_size
+        return Document(
             label="start",
             content_url=file.as_uri(),
+            content_hash=content_hash,
+            content_size=file_size,
             mime_type=mime_type,  # this is the fragment mime type
-            parent_names=[file.stem],
+            parent_names=list(name.with_suffix("").parts),
             metadata={
-                "file_name": file.name,
+                "file_name": name.as_posix(),
                 "file_path": str(file),
-                "file_size": file.stat().st_size,
+                "file_size": file_size,
                 "file_type": mime_type,  # this is the original file mime type
             },
         )
-        self.repository.store(document)
-
-        return document
 
     @property
     def credential(self):
@@ -273,7 +462,7 @@ class Catalyst:
             self._kernel = Kernel()
         return self._kernel
 
-    def _parse_operator_function_signature(self, func: CommandFunctionType, scope: str) -> OperationSpec:
+    def _parse_operator_function_signature(self, func: CommandFunctionType, **options) -> OperationSpec:
         logger.debug("Parsing function signature for %s...", func.__name__)
         type_hints = get_type_hints(func)
         signature = inspect.signature(func)
@@ -283,6 +472,7 @@ class Catalyst:
             func=func,
             input_specs=self._parse_operator_function_parameters(func, type_hints, signature),
             output_spec=self._parse_operator_function_return_type(func, type_hints, signature),
+            **options,
         )
 
     def _parse_operator_function_parameters(
@@ -372,13 +562,13 @@ class Catalyst:
         base_type = self._get_base_type(return_annotation)
         multiple = False
         if hasattr(base_type, "__origin__"):
-            if base_type.__origin__ is list:
+            if base_type.__origin__ is list or base_type.__origin__ in ITERATOR_TYPES:
                 multiple = True
                 base_type = get_args(base_type)[0]
             else:
                 raise OperationError(
-                    f"Operation function {func.__name__} must have a return type of list[Fragment] or "
-                    f"Fragment not {base_type}"
+                    f"Operation function {func.__name__} must have a return type of list[Fragment], "
+                    f"Iterator[Fragment] or Fragment not {base_type}"
                 )
         else:
             if not issubclass(base_type, Fragment):
@@ -400,3 +590,9 @@ class Catalyst:
             # For Annotated types, the first argument is the actual type
             return get_args(type_hint)[0]
         return type_hint
+
+
+def _file_content_hash(file: Path) -> str:
+    """Compute the SHA-256 hash of a file's content, without loading it in memory at once."""
+    with open(file, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
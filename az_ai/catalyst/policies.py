@@ -0,0 +1,513 @@
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from collections.abc import Callable, Iterable
+from email.utils import parsedate_to_datetime
+
+import openai
+from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+from pydantic import BaseModel, ConfigDict, Field
+
+# HTTP status codes of the responses asking clients to slow down
+THROTTLING_STATUS_CODES = frozenset({429, 503})
+# HTTP status codes of the responses to requests that may succeed if sent again
+TRANSIENT_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+# Errors raised when a request could not be sent or its response could not be received
+TRANSIENT_ERROR_TYPES = (
+    ConnectionError,
+    TimeoutError,
+    openai.APIConnectionError,
+    ServiceRequestError,
+    ServiceResponseError,
+)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate_per_minute` tokens per minute, holding at most `capacity` tokens.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            rate_per_minute (float): The number of tokens added to the bucket per minute.
+            capacity (float): The maximum number of tokens in the bucket, i.e. the largest burst. Default is the
+                tokens added in 10 seconds, the window over which Azure AI services enforce per-minute quotas.
+            clock (Callable): The clock, in seconds. Default is time.monotonic.
+        """
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute must be positive")
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_minute / 6)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+
+    @property
+    def tokens(self) -> float:
+        """
+        The number of tokens currently available.
+        """
+        self._refill()
+        return self._tokens
+
+    def try_acquire(self, amount: float = 1) -> float:
+        """
+        Take `amount` tokens if they are available.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the time in seconds before they are available.
+        """
+        amount = min(amount, self.capacity)
+        self._refill()
+        if self._tokens >= amount:
+            self._tokens -= amount
+            return 0
+        return (amount - self._tokens) / self.rate
+
+    async def acquire(self, amount: float = 1) -> None:
+        """
+        Wait until `amount` tokens are available and take them. Requests larger than the capacity wait for a
+        full bucket.
+        """
+        while (delay := self.try_acquire(amount)) > 0:
+            await asyncio.sleep(delay)
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class RateLimiter:
+    """
+    Requests per minute and tokens per minute limits of an endpoint.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = None,
+        tokens_per_minute: float = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.requests = TokenBucket(requests_per_minute, clock=clock) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, clock=clock) if tokens_per_minute else None
+
+    def try_acquire(self, tokens: int = 0) -> bool:
+        """
+        Take a request using `tokens` tokens if it fits in the limits now.
+        """
+        if self.requests and self.requests.tokens < 1:
+            return False
+        if self.tokens and tokens and self.tokens.tokens < min(tokens, self.tokens.capacity):
+            return False
+        if self.requests:
+            self.requests.try_acquire()
+        if self.tokens and tokens:
+            self.tokens.try_acquire(tokens)
+        return True
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """
+        Wait until a request using `tokens` tokens fits in the limits.
+        """
+        if self.requests:
+            await self.requests.acquire()
+        if self.tokens and tokens:
+            await self.tokens.acquire(tokens)
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit adjusted with additive increase, multiplicative decrease (AIMD): the limit grows by one
+    for every `limit` successful calls, up to `max_concurrency`, and is halved, down to `min_concurrency`, when
+    a call is throttled.
+
+    It has the `acquire`/`release` interface of `asyncio.Semaphore`.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+        cooldown: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            max_concurrency (int): The initial and maximum limit.
+            min_concurrency (int): The minimum limit. Default is 1.
+            cooldown (float): The time in seconds during which further throttled calls do not decrease the limit
+                again, as calls in flight when the limit decreased were started under the previous limit.
+                Default is 1 second.
+            clock (Callable): The clock, in seconds. Default is time.monotonic.
+        """
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.in_flight = 0
+        self.throttle_count = 0
+        self._limit = float(max_concurrency)
+        self._cooldown = cooldown
+        self._clock = clock
+        self._decreased_at: float | None = None
+        self._waiters: list[asyncio.Future] = []
+
+    @property
+    def limit(self) -> int:
+        """
+        The current number of calls allowed at the same time.
+        """
+        return max(self.min_concurrency, int(self._limit))
+
+    async def acquire(self) -> bool:
+        while self.in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake_up()
+
+    async def pause(self, delay: float) -> None:
+        """
+        Give the slot of the calling task back for `delay` seconds, then wait for a slot again. If cancelled, the
+        slot is taken back anyway, so that the caller can release it.
+        """
+        self.release()
+        try:
+            await asyncio.sleep(delay)
+            await self.acquire()
+        except asyncio.CancelledError:
+            self.in_flight += 1
+            raise
+
+    def on_success(self) -> None:
+        """
+        Record a successful call.
+        """
+        self._limit = min(float(self.max_concurrency), self._limit + 1 / self._limit)
+        self._wake_up()
+
+    def on_throttle(self) -> None:
+        """
+        Record a throttled call.
+        """
+        self.throttle_count += 1
+        now = self._clock()
+        if self._decreased_at is None or now - self._decreased_at >= self._cooldown:
+            self._limit = max(float(self.min_concurrency), self._limit / 2)
+            self._decreased_at = now
+
+    def _wake_up(self) -> None:
+        # waiters check the limit again when woken up
+        if self.in_flight >= self.limit:
+            return
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+class MemoryBudget:
+    """
+    Memory budget, in bytes, shared by the operation calls running at the same time. A call is admitted once the
+    calls in flight leave room for its estimated size, in the order calls asked for it. A call larger than the
+    whole budget is admitted when no other call is in flight.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Args:
+            max_bytes (int): The budget in bytes.
+        """
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self.in_flight = 0
+        self._waiters: deque[tuple[int, asyncio.Future]] = deque()
+
+    async def acquire(self, size: int) -> None:
+        """
+        Wait until a call of `size` bytes fits in the budget, then count it in.
+        """
+        if not self._waiters and self._fits(size):
+            self._admit(size)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((size, waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                if (size, waiter) in self._waiters:
+                    self._waiters.remove((size, waiter))
+                self._wake_up()
+            else:
+                # admitted while being cancelled
+                self.release(size)
+            raise
+
+    def release(self, size: int) -> None:
+        """
+        Count out a call of `size` bytes.
+        """
+        self.in_use -= size
+        self.in_flight -= 1
+        self._wake_up()
+
+    def _fits(self, size: int) -> bool:
+        return self.in_flight == 0 or self.in_use + size <= self.max_bytes
+
+    def _admit(self, size: int) -> None:
+        self.in_use += size
+        self.in_flight += 1
+
+    def _wake_up(self) -> None:
+        # waiters are admitted in order, a large call is not overtaken by smaller ones
+        while self._waiters:
+            size, waiter = self._waiters[0]
+            if waiter.done():
+                # cancelled waiters are dropped
+                self._waiters.popleft()
+                continue
+            if not self._fits(size):
+                return
+            self._waiters.popleft()
+            self._admit(size)
+            waiter.set_result(None)
+
+
+def throttling_error(error: BaseException) -> BaseException | None:
+    """
+    Find, in the chain of causes of an error, an error of the OpenAI (`openai.APIStatusError`) or azure-core
+    (`azure.core.exceptions.HttpResponseError`) SDKs for a throttling response (429 or 503).
+
+    Returns:
+        BaseException | None: The throttling error, or None if the error is not caused by throttling.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if getattr(error, "status_code", None) in THROTTLING_STATUS_CODES:
+            return error
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def transient_error(error: BaseException) -> BaseException | None:
+    """
+    Find, in the chain of causes of an error, a connection error, a timeout or an error of the OpenAI or azure-core
+    SDKs for a response to a request that may succeed if sent again (408, 429 or 5xx).
+
+    Returns:
+        BaseException | None: The transient error, or None if the error is not caused by a transient one.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, TRANSIENT_ERROR_TYPES) or getattr(error, "status_code", None) in TRANSIENT_STATUS_CODES:
+            return error
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def retry_after(error: BaseException) -> float | None:
+    """
+    Get the delay, in seconds, requested by the `retry-after-ms`, `x-ms-retry-after-ms` or `Retry-After` header
+    of the HTTP response of an SDK error.
+
+    Returns:
+        float | None: The delay, or None if the response does not request one.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    for header in ("retry-after-ms", "x-ms-retry-after-ms"):
+        try:
+            return max(0.0, float(headers.get(header)) / 1000)
+        except (TypeError, ValueError):
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+class RetryPolicy(BaseModel):
+    """
+    How failed calls of an operation are retried: with exponential backoff and jitter, or after the delay requested
+    by the service.
+    """
+
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
+    max_attempts: int = Field(default=5, ge=1, description="Maximum number of attempts of a call, 1 to never retry.")
+    initial_delay: float = Field(default=1.0, ge=0, description="Delay in seconds before the first retry.")
+    max_delay: float = Field(default=60.0, ge=0, description="Maximum delay in seconds between attempts.")
+    multiplier: float = Field(default=2.0, ge=1, description="Factor applied to the delay after each attempt.")
+    jitter: float = Field(
+        default=1.0,
+        ge=0,
+        le=1,
+        description=(
+            "Fraction of the delay drawn at random so that calls failing together are not retried together, "
+            "1 for a delay drawn between 0 and the backoff delay, 0 for no jitter."
+        ),
+    )
+    retry_on: tuple[type[BaseException], ...] | None = Field(
+        default=None,
+        description="Errors that are retried. Default is the transient errors, see `transient_error`.",
+    )
+
+    def should_retry(self, error: BaseException, attempt: int) -> bool:
+        """
+        Whether a call that failed with `error` at its `attempt`-th attempt is attempted again.
+        """
+        if attempt >= self.max_attempts:
+            return False
+        if self.retry_on is None:
+            return transient_error(error) is not None
+        return isinstance(error, self.retry_on)
+
+    def delay(self, error: BaseException, attempt: int) -> float:
+        """
+        Get the delay in seconds before the next attempt of a call that failed with `error` at its `attempt`-th
+        attempt: the delay requested by the service if any, otherwise the backoff delay.
+        """
+        transient = transient_error(error)
+        requested = retry_after(transient) if transient is not None else None
+        if requested is not None:
+            return requested
+        backoff = min(self.max_delay, self.initial_delay * self.multiplier ** (attempt - 1))
+        return backoff * (1 - self.jitter * random.random())
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of an endpoint. After `failure_threshold` consecutive failures the circuit opens and calls wait
+    for `reset_timeout` seconds. Then a single trial call is let through: the circuit closes if it succeeds and
+    opens again if it fails.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._clock = clock
+        self._opened_at: float | None = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        """
+        The state of the circuit: "closed", "open" or "half_open".
+        """
+        if self._opened_at is None:
+            return "closed"
+        if self._clock() - self._opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def try_acquire(self) -> float:
+        """
+        Let a call through if the circuit allows it.
+
+        Returns:
+            float: 0 if the call can be issued, otherwise the time in seconds before trying again.
+        """
+        state = self.state
+        if state == "closed":
+            return 0
+        if state == "open":
+            return self.reset_timeout - (self._clock() - self._opened_at)
+        if self._trial:
+            # polls until the trial call completes
+            return max(0.01, min(1.0, self.reset_timeout))
+        self._trial = True
+        return 0
+
+    async def acquire(self) -> None:
+        """
+        Wait until the circuit lets a call through.
+        """
+        while (delay := self.try_acquire()) > 0:
+            await asyncio.sleep(delay)
+
+    def on_success(self) -> None:
+        """
+        Record a call answered by the endpoint.
+        """
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def on_failure(self) -> None:
+        """
+        Record a call that failed because the endpoint is unavailable.
+        """
+        self.failures += 1
+        if self._trial or self.failures >= self.failure_threshold:
+            self._opened_at = self._clock()
+            self._trial = False
+
+
+class HedgePolicy(BaseModel):
+    """
+    When calls of an operation are hedged: a duplicate call is issued when a call takes longer than the `quantile`
+    of the recent call durations, the first successful result is kept and the other calls are cancelled.
+    """
+
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
+    quantile: float = Field(
+        default=0.95, gt=0, lt=1, description="Quantile of the call durations after which a call is hedged."
+    )
+    min_samples: int = Field(default=20, ge=1, description="Number of call durations known before calls are hedged.")
+    max_hedges: int = Field(default=1, ge=1, description="Maximum number of duplicate calls per call.")
+
+
+class LatencyHistory:
+    """
+    Durations of the most recent calls of an operation.
+    """
+
+    def __init__(self, durations_ns: Iterable[int] = (), window: int = 1000):
+        self._durations: deque[int] = deque(durations_ns, maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._durations)
+
+    def add(self, duration_ns: int) -> None:
+        self._durations.append(duration_ns)
+
+    def quantile(self, quantile: float) -> float | None:
+        """
+        Get the quantile of the durations, in seconds, or None if there is no duration.
+        """
+        if not self._durations:
+            return None
+        durations = sorted(self._durations)
+        return durations[min(len(durations) - 1, math.ceil(quantile * len(durations)) - 1)] / 1e9
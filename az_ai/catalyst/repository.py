@@ -1,18 +1,33 @@
+import os
+import shutil
+import tempfile
+import time
+import uuid
 from abc import ABC, abstractmethod
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager, suppress
 from pathlib import Path
-from urllib import request
+from typing import Any
+from urllib import parse, request
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 from az_ai.catalyst.schema import (
+    FailureLogEntry,
     Fragment,
     FragmentSelector,
+    Lease,
     OperationsLog,
     OperationsLogEntry,
+    ProgressLogEntry,
 )
 
 
 class Repository(ABC):
+    # Whether a pickled copy of the repository accesses the same fragments, so that worker processes can
+    # receive fragment references instead of fragments.
+    shared_across_processes: bool = True
+
     @abstractmethod
     def get(self, reference: str) -> str:
         """Get the value for the given key."""
@@ -23,9 +38,39 @@ class Repository(ABC):
         """Store the given fragment."""
         pass
 
+    def store_many(self, fragments: list[Fragment]) -> list[Fragment]:
+        """
+        Store the given fragments as one batch. The contents loaded from their `content_url` are released as each
+        fragment is stored, so that a batch does not hold all of them at once.
+        """
+        for fragment in fragments:
+            loaded = not fragment.content
+            self.store(fragment)
+            if loaded:
+                fragment.content = None
+        return fragments
+
     @abstractmethod
-    def update(self, fragment: Fragment) -> Fragment:
-        """Update the given fragment."""
+    def update(self, fragment: Fragment, content_changed: bool = None) -> Fragment:
+        """
+        Update the given fragment.
+
+        Args:
+            fragment (Fragment): The fragment to update.
+            content_changed (bool): Whether the content has to be rewritten. If None (default), the content is
+                rewritten only if its hash differs from the fragment's content_hash.
+        """
+        pass
+
+    @abstractmethod
+    def update_metadata(self, reference: str, patch: dict[str, Any]) -> Fragment:
+        """
+        Update the metadata of the given fragment without reading or rewriting its content.
+        Keys with a None value in the patch are removed from the metadata.
+
+        Returns:
+            Fragment: The updated fragment, without its content.
+        """
         pass
 
     @abstractmethod
@@ -35,6 +80,36 @@ class Repository(ABC):
         """
         pass
 
+    @abstractmethod
+    def find_headers(self, selector: FragmentSelector = None) -> list["FragmentIndexEntry"]:
+        """
+        Get lightweight headers (references, label, types, content hash and source document) of all fragments
+        matching the given spec, without loading the fragments themselves.
+        """
+        pass
+
+    @abstractmethod
+    def find_content_hashes(self, selector: FragmentSelector = None) -> dict[str, str]:
+        """
+        Get the content hashes of all fragments matching the given spec, mapped to the fragment references.
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, reference: str) -> None:
+        """
+        Delete the given fragment and its content.
+        """
+        pass
+
+    def delete_many(self, references: Iterable[str]) -> None:
+        """
+        Delete the given fragments and their contents, ignoring the ones that do not exist.
+        """
+        for reference in references:
+            with suppress(FragmentNotFoundError):
+                self.delete(reference)
+
     @abstractmethod
     def add_operations_log_entry(self, operations_log_entry: OperationsLogEntry) -> None:
         """
@@ -42,6 +117,103 @@ class Repository(ABC):
         """
         pass
 
+    @abstractmethod
+    def delete_operations_log_entries(self, fingerprints: Iterable[str]) -> None:
+        """
+        Delete the operations log entries with the given fingerprints.
+        """
+        pass
+
+    @abstractmethod
+    def find_operations_log_fingerprints(self, fingerprints: Iterable[str]) -> set[str]:
+        """
+        Get the fingerprints (see `OperationsLogEntry.compute_fingerprint`), among the given ones, having an
+        operations log entry. Lets callers check many operation calls with a single query.
+        """
+        pass
+
+    @abstractmethod
+    def add_failure_log_entry(self, failure_log_entry: FailureLogEntry) -> None:
+        """
+        Add a failed operation call to the failure log, replacing the previous failure of the same call.
+        """
+        pass
+
+    @abstractmethod
+    def find_failure_log_entries(
+        self, operation_name: str = None, fingerprints: Iterable[str] = None
+    ) -> list[FailureLogEntry]:
+        """
+        Find failed operation calls by operation_name and/or fingerprints.
+        """
+        pass
+
+    @abstractmethod
+    def delete_failure_log_entries(self, fingerprints: Iterable[str]) -> None:
+        """
+        Delete the failure log entries with the given fingerprints.
+        """
+        pass
+
+    @abstractmethod
+    def add_progress_log_entry(self, progress_log_entry: ProgressLogEntry) -> None:
+        """
+        Record the outputs stored so far by a call of a generator operation, replacing its previous progress.
+        """
+        pass
+
+    @abstractmethod
+    def find_progress_log_entries(
+        self, operation_name: str = None, fingerprints: Iterable[str] = None
+    ) -> list[ProgressLogEntry]:
+        """
+        Find the progress of unfinished calls by operation_name and/or fingerprints.
+        """
+        pass
+
+    @abstractmethod
+    def delete_progress_log_entries(self, fingerprints: Iterable[str]) -> None:
+        """
+        Delete the progress log entries with the given fingerprints.
+        """
+        pass
+
+    @abstractmethod
+    def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """
+        Claim the lease with the given key for `ttl` seconds, unless another owner holds it and it has not expired.
+        Leases let the workers sharing a repository claim operation calls.
+
+        Returns:
+            bool: Whether the lease was acquired.
+        """
+        pass
+
+    @abstractmethod
+    def renew_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """
+        Extend the lease with the given key held by `owner` for `ttl` seconds from now.
+
+        Returns:
+            bool: Whether the lease was still held by `owner`.
+        """
+        pass
+
+    @abstractmethod
+    def release_lease(self, key: str, owner: str) -> None:
+        """
+        Release the lease with the given key if it is held by `owner`.
+        """
+        pass
+
+    def _content_changed(self, fragment: Fragment, content_changed: bool = None) -> bool:
+        """Check if the content of the fragment has to be (re)written."""
+        if not fragment.content:
+            return False
+        if content_changed is None:
+            return fragment.content_ref is None or fragment.compute_content_hash() != fragment.content_hash
+        return content_changed
+
     def _load_content_from_url(self, fragment: Fragment) -> bytes:
         """Load the content from the URL in the fragment's content_url field"""
         if not fragment.content_url:
@@ -75,6 +247,21 @@ class FragmentIndexEntry(BaseModel):
     ref: str
     label: str
     types: set[str] = []
+    content_hash: str | None = None
+    source_document_ref: str | None = None
+
+    @classmethod
+    def from_fragment(cls, fragment: Fragment) -> "FragmentIndexEntry":
+        """
+        Create an index entry for the given fragment.
+        """
+        return cls(
+            ref=fragment.id,
+            label=fragment.label,
+            types={klass.class_name() for klass in fragment.__class__.mro() if issubclass(klass, Fragment)},
+            content_hash=fragment.content_hash,
+            source_document_ref=fragment.source_document_ref(),
+        )
 
     def match(self, selector: FragmentSelector = None) -> bool:
         """
@@ -84,17 +271,37 @@ class FragmentIndexEntry(BaseModel):
             return True
         if selector.fragment_type not in self.types:
             return False
+        if selector.source_document_refs is not None and self.source_document_ref not in selector.source_document_refs:
+            return False
         return not (selector.labels and self.label not in selector.labels)
 
 
 class FragmentIndex(BaseModel):
     fragments: list[FragmentIndexEntry] = []
+    _entries: dict[str, FragmentIndexEntry] = PrivateAttr(default_factory=dict)
+
+    def model_post_init(self, context) -> None:
+        self._entries = {entry.ref: entry for entry in self.fragments}
 
     def match(self, selector: FragmentSelector = None) -> list[str]:
         """
         Get all fragments matching the given selector.
         """
-        return [entry.ref for entry in self.fragments if entry.match(selector)]
+        return [entry.ref for entry in self.match_entries(selector)]
+
+    def match_entries(self, selector: FragmentSelector = None) -> list[FragmentIndexEntry]:
+        """
+        Get the entries of all fragments matching the given selector.
+        """
+        return [entry for entry in self.fragments if entry.match(selector)]
+
+    def content_hashes(self, selector: FragmentSelector = None) -> dict[str, str]:
+        """
+        Get the content hashes of all fragments matching the given selector, mapped to their references.
+        """
+        return {
+            entry.content_hash: entry.ref for entry in self.fragments if entry.content_hash and entry.match(selector)
+        }
 
     def add(self, fragment: Fragment) -> None:
         """
@@ -103,17 +310,31 @@ class FragmentIndex(BaseModel):
         Returns:
             self: The updated FragmentIndex instance.
         """
-        if any(e.ref == fragment.id for e in self.fragments):
+        if fragment.id in self._entries:
             raise DuplicateFragmentError(f"Fragment {fragment.id} already exists in the index.")
-        self.fragments.append(
-            FragmentIndexEntry(
-                ref=fragment.id,
-                label=fragment.label,
-                types={cls.class_name() for cls in fragment.__class__.mro() if issubclass(cls, Fragment)},
-            )
-        )
+        entry = FragmentIndexEntry.from_fragment(fragment)
+        self.fragments.append(entry)
+        self._entries[entry.ref] = entry
         return self
 
+    def remove(self, reference: str) -> None:
+        """
+        Remove the entry of the given fragment from the index.
+        """
+        entry = self._entries.pop(reference, None)
+        if entry is None:
+            raise FragmentNotFoundError(f"Fragment {reference} not found in the index.")
+        self.fragments.remove(entry)
+
+    def differs(self, fragment: Fragment) -> bool:
+        """
+        Check if the entry of the fragment in the index has to be updated.
+        """
+        entry = self._entries.get(fragment.id)
+        if entry is None:
+            raise FragmentNotFoundError(f"Fragment {fragment.id} not found in the index.")
+        return entry.label != fragment.label or entry.content_hash != fragment.content_hash
+
     def update(self, fragment: Fragment) -> None:
         """
         Update an existing entry in the index.
@@ -121,18 +342,22 @@ class FragmentIndex(BaseModel):
         Returns:
             self: The updated FragmentIndex instance.
         """
-        for entry in self.fragments:
-            if entry.ref == fragment.id:
-                entry.label = fragment.label
-                # type and ref are not supposed to change
-                return self
-        raise FragmentNotFoundError(f"Fragment {fragment.id} not found in the index.")
+        entry = self._entries.get(fragment.id)
+        if entry is None:
+            raise FragmentNotFoundError(f"Fragment {fragment.id} not found in the index.")
+        entry.label = fragment.label
+        entry.content_hash = fragment.content_hash
+        # type and ref are not supposed to change
+        return self
 
 
 class LocalRepository(Repository):
     CONTENT_PREFIX = "_content"
     FRAGMENTS_PREFIX = "_fragments"
     HUMAN_PREFIX = "_human"
+    LEASES_PREFIX = "_leases"
+    PROGRESS_PREFIX = "_progress"
+    FAILURES_PREFIX = "_failures"
 
     def __init__(self, path: Path | str = None):
         if path is None:
@@ -141,15 +366,30 @@ class LocalRepository(Repository):
         self._contents_path = self._path / self.CONTENT_PREFIX
         self._fragments_path = self._path / self.FRAGMENTS_PREFIX
         self._human_path = self._path / self.HUMAN_PREFIX
+        self._leases_path = self._path / self.LEASES_PREFIX
+        self._progress_path = self._path / self.PROGRESS_PREFIX
+        self._failures_path = self._path / self.FAILURES_PREFIX
         self._operations_log_path = self._path / "_operations_log.json"
+        self._fingerprints_path = self._path / "_operations_log_fingerprints"
         self._index_path = self._fragments_path / "_index.json"
+        self._lock_path = self._path / "_lock"
         self._contents_path.mkdir(parents=True, exist_ok=True)
         self._fragments_path.mkdir(parents=True, exist_ok=True)
         self._human_path.mkdir(parents=True, exist_ok=True)
-        if not self._operations_log_path.exists():
-            self._write_log(OperationsLog())
-        if not self._index_path.exists():
-            self._write_index(FragmentIndex())
+        self._leases_path.mkdir(parents=True, exist_ok=True)
+        self._progress_path.mkdir(parents=True, exist_ok=True)
+        self._failures_path.mkdir(parents=True, exist_ok=True)
+        with self._lock():
+            if not self._operations_log_path.exists():
+                self._write_log(OperationsLog())
+            if not self._index_path.exists():
+                self._write_index(FragmentIndex())
+            else:
+                self._backfill_index()
+        # fingerprints read from the fingerprints file so far, with the header of that file and the offset read up to
+        self._fingerprints: set[str] = set()
+        self._fingerprints_header = None
+        self._fingerprints_offset = 0
 
     def human_path(self) -> Path:
         return self._human_path
@@ -169,35 +409,78 @@ class LocalRepository(Repository):
     def store(self, fragment: Fragment) -> Fragment:
         """Store the given fragment."""
 
-        fragment_path = self._fragment_path(fragment)
-        if fragment_path.exists():
-            raise DuplicateFragmentError(f"Fragment {fragment.id} already exists.")
-        if not fragment.content and "content_url" in fragment.__class__.model_fields and fragment.content_url:
-            fragment.content = self._load_content_from_url(fragment)
-        if fragment.content:
-            self._store_content(fragment)
-
-        if not fragment_path.parent.exists():
-            fragment_path.parent.mkdir()
-        fragment_path.write_text(fragment.model_dump_json(indent=2))
-        self._create_human_fragment_link(fragment, fragment_path)
-        self._write_index(self._read_index().add(fragment))
+        with self._lock():
+            index = self._read_index()
+            self._store_fragment(fragment, index)
+            self._write_index(index)
 
         return fragment
 
-    def update(self, fragment: Fragment) -> Fragment:
+    def store_many(self, fragments: list[Fragment]) -> list[Fragment]:
+        """
+        Store the given fragments, writing the index only once. The contents loaded from their `content_url` are
+        released as each fragment is stored.
+        """
+
+        with self._lock():
+            index = self._read_index()
+            try:
+                for fragment in fragments:
+                    loaded = not fragment.content
+                    self._store_fragment(fragment, index)
+                    if loaded:
+                        fragment.content = None
+            finally:
+                self._write_index(index)
+
+        return fragments
+
+    def update(self, fragment: Fragment, content_changed: bool = None) -> Fragment:
         """Update the given fragment."""
 
         fragment_path = self._fragment_path(fragment)
-        if not fragment_path.exists():
-            raise FragmentNotFoundError(f"Fragment {fragment.id} does not exist.")
-        if fragment.content:
-            self._store_content(fragment, update_link=False)
-        fragment_path.write_text(fragment.model_dump_json(indent=2))
-        self._write_index(self._read_index().update(fragment))
+        with self._lock():
+            if not fragment_path.exists():
+                raise FragmentNotFoundError(f"Fragment {fragment.id} does not exist.")
+            if self._content_changed(fragment, content_changed):
+                self._store_content(fragment, update_link=False)
+            _write_atomically(fragment_path, fragment.model_dump_json(indent=2))
+            index = self._read_index()
+            if index.differs(fragment):
+                self._write_index(index.update(fragment))
+
+        return fragment
+
+    def update_metadata(self, reference: str, patch: dict[str, Any]) -> Fragment:
+        """Update the metadata of the given fragment without reading or rewriting its content."""
+
+        fragment_path = self._fragment_path(reference)
+        with self._lock():
+            fragment = Fragment.from_json(fragment_path.read_text()).patch_metadata(patch)
+            _write_atomically(fragment_path, fragment.model_dump_json(indent=2))
 
         return fragment
 
+    def delete(self, reference: str) -> None:
+        """Delete the given fragment, its content and their human-readable links."""
+
+        with self._lock():
+            index = self._read_index()
+            self._delete_fragment(reference, index)
+            self._write_index(index)
+
+    def delete_many(self, references: Iterable[str]) -> None:
+        """Delete the given fragments, ignoring the ones that do not exist, writing the index only once."""
+
+        with self._lock():
+            index = self._read_index()
+            try:
+                for reference in references:
+                    with suppress(FragmentNotFoundError):
+                        self._delete_fragment(reference, index)
+            finally:
+                self._write_index(index)
+
     def find(self, selector: FragmentSelector = None, with_content: bool = True) -> list[Fragment]:
         """
         Get all fragments matching the given spec.
@@ -212,6 +495,18 @@ class LocalRepository(Repository):
 
         return fragments
 
+    def find_headers(self, selector: FragmentSelector = None) -> list[FragmentIndexEntry]:
+        """
+        Get lightweight headers of all fragments matching the given spec.
+        """
+        return self._read_index().match_entries(selector)
+
+    def find_content_hashes(self, selector: FragmentSelector = None) -> dict[str, str]:
+        """
+        Get the content hashes of all fragments matching the given spec, mapped to the fragment references.
+        """
+        return self._read_index().content_hashes(selector)
+
     def get_human_path(self, fragment: Fragment) -> Path:
         """
         Get the human-readable path for the given fragment.
@@ -222,48 +517,280 @@ class LocalRepository(Repository):
         """
         Add an operation log entry to the repository.
         """
-        log = self._read_log()
-        log.entries.append(operations_log_entry)
-        self._write_log(log)
+        with self._lock():
+            log = self._read_log()
+            log.add(operations_log_entry)
+            self._write_log(log)
+            if self._fingerprints_path.exists():
+                with open(self._fingerprints_path, "a") as file:
+                    file.write(f"{operations_log_entry.fingerprint}\n")
+            else:
+                self._write_fingerprints(log)
 
-    def find_operations_log_entry(self, operation_name: str = None, input_fragment_refs: set[str] = None):
+    def find_operations_log_entry(
+        self, operation_name: str = None, input_fragment_refs: set[str] = None, memo_key: str = None
+    ):
         """
-        Find an operation log entry by operation_name and/or input_fragment_ref
+        Find an operation log entry by operation_name and/or input_fragment_ref, or by memo_key
         """
-        return [
-            entry
-            for entry in self._read_log().entries
-            if (not operation_name or operation_name == entry.operation_name)
-            and (
-                not input_fragment_refs
-                or (
-                    len(input_fragment_refs) == len(entry.input_refs)
-                    and all(ref in entry.input_refs for ref in input_fragment_refs)
-                )
-            )
-        ]
+        return self._read_log().find(
+            operation_name=operation_name, input_fragment_refs=input_fragment_refs, memo_key=memo_key
+        )
+
+    def find_operations_log_fingerprints(self, fingerprints: Iterable[str]) -> set[str]:
+        """
+        Get the fingerprints, among the given ones, having an operations log entry.
+
+        The fingerprints are read from an append-only file next to the operations log, parsing only the lines
+        appended since the previous call, rather than from the whole operations log.
+        """
+        if not self._fingerprints_path.exists():
+            with self._lock():
+                if not self._fingerprints_path.exists():
+                    self._write_fingerprints(self._read_log())
+        self._read_fingerprints()
+        return {fingerprint for fingerprint in fingerprints if fingerprint in self._fingerprints}
+
+    def delete_operations_log_entries(self, fingerprints: Iterable[str]) -> None:
+        """
+        Delete the operations log entries with the given fingerprints.
+        """
+        with self._lock():
+            log = self._read_log()
+            log.remove(fingerprints)
+            self._write_log(log)
+            self._write_fingerprints(log)
+
+    def add_failure_log_entry(self, failure_log_entry: FailureLogEntry) -> None:
+        """
+        Add a failed operation call to the failure log, replacing the previous failure of the same call.
+
+        The failure of each call is a file of its own, so that looking failures up does not read the operations
+        log.
+        """
+        _write_atomically(
+            self._record_path(self._failures_path, failure_log_entry.fingerprint), failure_log_entry.model_dump_json()
+        )
+
+    def find_failure_log_entries(
+        self, operation_name: str = None, fingerprints: Iterable[str] = None
+    ) -> list[FailureLogEntry]:
+        """
+        Find failed operation calls by operation_name and/or fingerprints.
+        """
+        return self._find_records(self._failures_path, FailureLogEntry, operation_name, fingerprints)
+
+    def delete_failure_log_entries(self, fingerprints: Iterable[str]) -> None:
+        """
+        Delete the failure log entries with the given fingerprints.
+        """
+        self._delete_records(self._failures_path, fingerprints)
+
+    def add_progress_log_entry(self, progress_log_entry: ProgressLogEntry) -> None:
+        """
+        Record the outputs stored so far by a call of a generator operation, replacing its previous progress.
+
+        The progress of each call is a file of its own: a call is run by one worker at a time, which rewrites it
+        without locking the repository.
+        """
+        _write_atomically(
+            self._record_path(self._progress_path, progress_log_entry.fingerprint), progress_log_entry.model_dump_json()
+        )
+
+    def find_progress_log_entries(
+        self, operation_name: str = None, fingerprints: Iterable[str] = None
+    ) -> list[ProgressLogEntry]:
+        """
+        Find the progress of unfinished calls by operation_name and/or fingerprints.
+        """
+        return self._find_records(self._progress_path, ProgressLogEntry, operation_name, fingerprints)
+
+    def delete_progress_log_entries(self, fingerprints: Iterable[str]) -> None:
+        """
+        Delete the progress log entries with the given fingerprints.
+        """
+        self._delete_records(self._progress_path, fingerprints)
+
+    @staticmethod
+    def _record_path(directory: Path, fingerprint: str) -> Path:
+        return directory / f"{fingerprint}.json"
+
+    def _find_records[T: FailureLogEntry | ProgressLogEntry](
+        self, directory: Path, record_class: type[T], operation_name: str = None, fingerprints: Iterable[str] = None
+    ) -> list[T]:
+        """
+        Read the records of calls stored in a directory, one file per call fingerprint.
+        """
+        if fingerprints is not None:
+            paths = [self._record_path(directory, fingerprint) for fingerprint in fingerprints]
+        else:
+            paths = sorted(directory.glob("*.json"))
+        records = []
+        for path in paths:
+            with suppress(FileNotFoundError):
+                records.append(record_class.model_validate_json(path.read_bytes()))
+        return [record for record in records if not operation_name or operation_name == record.operation_name]
+
+    def _delete_records(self, directory: Path, fingerprints: Iterable[str]) -> None:
+        for fingerprint in fingerprints:
+            self._record_path(directory, fingerprint).unlink(missing_ok=True)
+
+    def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """
+        Claim the lease with the given key for `ttl` seconds, unless another owner holds it and it has not expired.
+        """
+        lease_path = self._leases_path / f"{key}.json"
+        with self._lock():
+            if lease_path.exists():
+                lease = Lease.model_validate_json(lease_path.read_bytes())
+                if lease.owner != owner and not lease.expired():
+                    return False
+            _write_atomically(lease_path, Lease(key=key, owner=owner, expires_at=time.time() + ttl).model_dump_json())
+        return True
+
+    def renew_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """
+        Extend the lease with the given key held by `owner` for `ttl` seconds from now.
+        """
+        lease_path = self._leases_path / f"{key}.json"
+        with self._lock():
+            if not lease_path.exists() or Lease.model_validate_json(lease_path.read_bytes()).owner != owner:
+                return False
+            _write_atomically(lease_path, Lease(key=key, owner=owner, expires_at=time.time() + ttl).model_dump_json())
+        return True
+
+    def release_lease(self, key: str, owner: str) -> None:
+        """
+        Release the lease with the given key if it is held by `owner`.
+        """
+        lease_path = self._leases_path / f"{key}.json"
+        with self._lock():
+            if lease_path.exists() and Lease.model_validate_json(lease_path.read_bytes()).owner == owner:
+                lease_path.unlink()
+
+    @contextmanager
+    def _lock(self) -> Iterator[None]:
+        """
+        Lock the repository for a read-modify-write of a fragment, the index, the operations log or a lease,
+        against the other threads and processes using it. Not reentrant.
+        """
+        with open(self._lock_path, "a+b") as lock_file:
+            _lock_file(lock_file)
+            try:
+                yield
+            finally:
+                _unlock_file(lock_file)
 
     def _read_log(self) -> OperationsLog:
         return OperationsLog.model_validate_json(self._operations_log_path.read_bytes())
 
     def _write_log(self, log: OperationsLog):
-        self._operations_log_path.write_text(log.model_dump_json(indent=2))
+        _write_atomically(self._operations_log_path, log.model_dump_json(indent=2))
+
+    def _write_fingerprints(self, log: OperationsLog):
+        """
+        Rewrite the fingerprints file from the operations log, under a new header so that readers having cached
+        the previous file read it again from the start.
+        """
+        lines = [f"# {uuid.uuid4().hex}", *dict.fromkeys(entry.fingerprint for entry in log.entries)]
+        _write_atomically(self._fingerprints_path, "".join(f"{line}\n" for line in lines))
+
+    def _read_fingerprints(self):
+        """
+        Bring the cached fingerprints up to date with the fingerprints file.
+        """
+        with open(self._fingerprints_path, "rb") as file:
+            header = file.readline()
+            if header != self._fingerprints_header:
+                self._fingerprints = set()
+                self._fingerprints_header = header
+                self._fingerprints_offset = len(header)
+            file.seek(self._fingerprints_offset)
+            data = file.read()
+        # a line being appended is read once complete
+        end = data.rfind(b"\n") + 1
+        self._fingerprints.update(data[:end].decode().split())
+        self._fingerprints_offset += end
+
+    def _backfill_index(self):
+        """
+        Fill in the entries of an index written before content hashes and source documents were indexed, from
+        their fragments, so that selectors on source documents match them.
+        """
+        index = self._read_index()
+        if all({"content_hash", "source_document_ref"} <= entry.model_fields_set for entry in index.fragments):
+            return
+        entries = []
+        for entry in index.fragments:
+            if {"content_hash", "source_document_ref"} <= entry.model_fields_set:
+                entries.append(entry)
+                continue
+            fragment = self.get(entry.ref)
+            if fragment.content_hash is None and fragment.content is not None:
+                fragment.content_hash = fragment.compute_content_hash()
+            entries.append(FragmentIndexEntry.from_fragment(fragment))
+        self._write_index(FragmentIndex(fragments=entries))
 
     def _read_index(self) -> FragmentIndex:
         return FragmentIndex.model_validate_json(self._index_path.read_bytes())
 
     def _write_index(self, index: FragmentIndex):
-        self._index_path.write_text(index.model_dump_json(indent=2))
+        _write_atomically(self._index_path, index.model_dump_json(indent=2))
+
+    def _store_fragment(self, fragment: Fragment, index: FragmentIndex) -> None:
+        """
+        Store the fragment and its content, and add it to the given index.
+        """
 
-    def _store_content(self, fragment: Fragment, update_link: bool = True) -> None:
+        fragment_path = self._fragment_path(fragment)
+        if fragment_path.exists():
+            raise DuplicateFragmentError(f"Fragment {fragment.id} already exists.")
+        content_file = None
+        if not fragment.content and "content_url" in fragment.__class__.model_fields and fragment.content_url:
+            content_file = _local_file(fragment.content_url)
+            if content_file is None or fragment.content_hash is None or fragment.content_size is None:
+                content_file = None
+                fragment.content = self._load_content_from_url(fragment)
+        if fragment.content or content_file:
+            self._store_content(fragment, source=content_file)
+
+        if not fragment_path.parent.exists():
+            fragment_path.parent.mkdir()
+        _write_atomically(fragment_path, fragment.model_dump_json(indent=2))
+        self._create_human_fragment_link(fragment, fragment_path)
+        index.add(fragment)
+
+    def _delete_fragment(self, reference: str, index: FragmentIndex) -> None:
+        """
+        Delete the fragment, its content and their human-readable links, and remove it from the given index.
+        """
+
+        fragment_path = self._fragment_path(reference)
+        fragment = Fragment.from_json(fragment_path.read_text())
+        if fragment.content_ref:
+            self.human_content_path(fragment).unlink(missing_ok=True)
+            self._content_path(fragment).unlink(missing_ok=True)
+        human_fragment_path = self._human_path / self.FRAGMENTS_PREFIX / fragment.human_file_name()
+        human_fragment_path.with_suffix(".json").unlink(missing_ok=True)
+        fragment_path.unlink()
+        with suppress(FragmentNotFoundError):
+            index.remove(reference)
+
+    def _store_content(self, fragment: Fragment, update_link: bool = True, source: Path = None) -> None:
         """
-        Store the content of the fragment.
+        Store the content of the fragment, or copy it from the `source` file without loading it, the content hash
+        and size of the fragment being the ones of the file.
         """
 
         if fragment.content_ref is None:
             fragment.content_ref = fragment.id
         content_path = self._content_path(fragment)
-        content_path.write_bytes(fragment.content)
+        if source is None:
+            fragment.content_hash = fragment.compute_content_hash()
+            fragment.content_size = len(fragment.content)
+            _write_atomically(content_path, fragment.content)
+        else:
+            _copy_atomically(source, content_path)
         if update_link:
             self._create_human_content_link(fragment, content_path)
 
@@ -334,3 +861,293 @@ class LocalRepository(Repository):
         if not fragment.content_ref:
             raise FragmentContentNotFoundError(f"Fragment {fragment.id} does not have a content reference.")
         return self._contents_path / fragment.content_ref
+
+
+class InMemoryRepository(Repository):
+    """
+    Repository keeping fragments, contents, index and operations log in process memory.
+
+    Useful for tests and benchmarks: it has the same semantics as the other repositories (index, operations
+    log, duplicate detection) without any I/O. Stored and retrieved fragments are copies, so mutating a
+    fragment after storing it does not change the repository.
+    """
+
+    shared_across_processes = False
+
+    def __init__(self, track_size: bool = False):
+        """
+        Args:
+            track_size (bool): If True, account the size in bytes of the stored fragments (serialized) and
+                contents in `size_bytes`. Default is False as serializing each fragment has a cost.
+        """
+        self._fragments: dict[str, Fragment] = {}
+        self._contents: dict[str, bytes] = {}
+        self._index = FragmentIndex()
+        self._log = OperationsLog()
+        self._leases: dict[str, Lease] = {}
+        self._failures: dict[str, FailureLogEntry] = {}
+        self._progress: dict[str, ProgressLogEntry] = {}
+        self._track_size = track_size
+        self._fragment_sizes: dict[str, int] = {}
+        self.size_bytes = 0
+
+    def get(self, reference: str) -> Fragment:
+        """Get the value for the given key."""
+        return self._copy(self._get_stored(reference), with_content=True)
+
+    def store(self, fragment: Fragment) -> Fragment:
+        """Store the given fragment."""
+        if fragment.id in self._fragments:
+            raise DuplicateFragmentError(f"Fragment {fragment.id} already exists.")
+        if not fragment.content and "content_url" in fragment.__class__.model_fields and fragment.content_url:
+            fragment.content = self._load_content_from_url(fragment)
+        if fragment.content:
+            self._store_content(fragment)
+
+        self._index.add(fragment)
+        self._store_fragment(fragment)
+
+        return fragment
+
+    def update(self, fragment: Fragment, content_changed: bool = None) -> Fragment:
+        """Update the given fragment."""
+        self._get_stored(fragment.id)
+        if self._content_changed(fragment, content_changed):
+            self._store_content(fragment)
+        if self._index.differs(fragment):
+            self._index.update(fragment)
+        self._store_fragment(fragment)
+
+        return fragment
+
+    def update_metadata(self, reference: str, patch: dict[str, Any]) -> Fragment:
+        """Update the metadata of the given fragment without reading or rewriting its content."""
+        fragment = self._copy(self._get_stored(reference), with_content=False).patch_metadata(patch)
+        self._store_fragment(fragment)
+
+        return self._copy(fragment, with_content=False)
+
+    def delete(self, reference: str) -> None:
+        """Delete the given fragment and its content."""
+        fragment = self._get_stored(reference)
+        del self._fragments[reference]
+        self._index.remove(reference)
+        content = self._contents.pop(fragment.content_ref, None) if fragment.content_ref else None
+        if self._track_size:
+            self.size_bytes -= self._fragment_sizes.pop(reference, 0) + (len(content) if content is not None else 0)
+
+    def find(self, selector: FragmentSelector = None, with_content: bool = True) -> list[Fragment]:
+        """
+        Get all fragments matching the given spec.
+        """
+        return [self._copy(self._fragments[ref], with_content=with_content) for ref in self._index.match(selector)]
+
+    def find_headers(self, selector: FragmentSelector = None) -> list[FragmentIndexEntry]:
+        """
+        Get lightweight headers of all fragments matching the given spec.
+        """
+        return [entry.model_copy(deep=True) for entry in self._index.match_entries(selector)]
+
+    def find_content_hashes(self, selector: FragmentSelector = None) -> dict[str, str]:
+        """
+        Get the content hashes of all fragments matching the given spec, mapped to the fragment references.
+        """
+        return self._index.content_hashes(selector)
+
+    def add_operations_log_entry(self, operations_log_entry: OperationsLogEntry) -> None:
+        """
+        Add an operation log entry to the repository.
+        """
+        self._log.add(operations_log_entry.model_copy(deep=True))
+
+    def find_operations_log_entry(
+        self, operation_name: str = None, input_fragment_refs: set[str] = None, memo_key: str = None
+    ):
+        """
+        Find an operation log entry by operation_name and/or input_fragment_ref, or by memo_key
+        """
+        return [
+            entry.model_copy(deep=True)
+            for entry in self._log.find(
+                operation_name=operation_name, input_fragment_refs=input_fragment_refs, memo_key=memo_key
+            )
+        ]
+
+    def find_operations_log_fingerprints(self, fingerprints: Iterable[str]) -> set[str]:
+        """
+        Get the fingerprints, among the given ones, having an operations log entry.
+        """
+        return self._log.find_fingerprints(fingerprints)
+
+    def delete_operations_log_entries(self, fingerprints: Iterable[str]) -> None:
+        """
+        Delete the operations log entries with the given fingerprints.
+        """
+        self._log.remove(fingerprints)
+
+    def add_failure_log_entry(self, failure_log_entry: FailureLogEntry) -> None:
+        """
+        Add a failed operation call to the failure log, replacing the previous failure of the same call.
+        """
+        self._failures[failure_log_entry.fingerprint] = failure_log_entry.model_copy(deep=True)
+
+    def find_failure_log_entries(
+        self, operation_name: str = None, fingerprints: Iterable[str] = None
+    ) -> list[FailureLogEntry]:
+        """
+        Find failed operation calls by operation_name and/or fingerprints.
+        """
+        if fingerprints is not None:
+            failures = [self._failures[fingerprint] for fingerprint in fingerprints if fingerprint in self._failures]
+        else:
+            failures = list(self._failures.values())
+        return [
+            failure.model_copy(deep=True)
+            for failure in failures
+            if not operation_name or operation_name == failure.operation_name
+        ]
+
+    def delete_failure_log_entries(self, fingerprints: Iterable[str]) -> None:
+        """
+        Delete the failure log entries with the given fingerprints.
+        """
+        for fingerprint in fingerprints:
+            self._failures.pop(fingerprint, None)
+
+    def add_progress_log_entry(self, progress_log_entry: ProgressLogEntry) -> None:
+        """
+        Record the outputs stored so far by a call of a generator operation, replacing its previous progress.
+        """
+        self._progress[progress_log_entry.fingerprint] = progress_log_entry.model_copy(deep=True)
+
+    def find_progress_log_entries(
+        self, operation_name: str = None, fingerprints: Iterable[str] = None
+    ) -> list[ProgressLogEntry]:
+        """
+        Find the progress of unfinished calls by operation_name and/or fingerprints.
+        """
+        if fingerprints is not None:
+            progress = [self._progress[fingerprint] for fingerprint in fingerprints if fingerprint in self._progress]
+        else:
+            progress = list(self._progress.values())
+        return [
+            entry.model_copy(deep=True)
+            for entry in progress
+            if not operation_name or operation_name == entry.operation_name
+        ]
+
+    def delete_progress_log_entries(self, fingerprints: Iterable[str]) -> None:
+        """
+        Delete the progress log entries with the given fingerprints.
+        """
+        for fingerprint in fingerprints:
+            self._progress.pop(fingerprint, None)
+
+    def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """
+        Claim the lease with the given key for `ttl` seconds, unless another owner holds it and it has not expired.
+        """
+        lease = self._leases.get(key)
+        if lease and lease.owner != owner and not lease.expired():
+            return False
+        self._leases[key] = Lease(key=key, owner=owner, expires_at=time.time() + ttl)
+        return True
+
+    def renew_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """
+        Extend the lease with the given key held by `owner` for `ttl` seconds from now.
+        """
+        lease = self._leases.get(key)
+        if not lease or lease.owner != owner:
+            return False
+        lease.expires_at = time.time() + ttl
+        return True
+
+    def release_lease(self, key: str, owner: str) -> None:
+        """
+        Release the lease with the given key if it is held by `owner`.
+        """
+        if key in self._leases and self._leases[key].owner == owner:
+            del self._leases[key]
+
+    def _get_stored(self, reference: str) -> Fragment:
+        fragment = self._fragments.get(reference)
+        if fragment is None:
+            raise FragmentNotFoundError(f"Fragment {reference} not found.")
+        return fragment
+
+    def _store_fragment(self, fragment: Fragment) -> None:
+        self._fragments[fragment.id] = fragment.model_copy(update={"content": None}, deep=True)
+        if self._track_size:
+            size = len(fragment.model_dump_json())
+            self.size_bytes += size - self._fragment_sizes.get(fragment.id, 0)
+            self._fragment_sizes[fragment.id] = size
+
+    def _store_content(self, fragment: Fragment) -> None:
+        if fragment.content_ref is None:
+            fragment.content_ref = fragment.id
+        fragment.content_hash = fragment.compute_content_hash()
+        fragment.content_size = len(fragment.content)
+        if self._track_size:
+            previous = self._contents.get(fragment.content_ref)
+            self.size_bytes += len(fragment.content) - (len(previous) if previous is not None else 0)
+        self._contents[fragment.content_ref] = fragment.content
+
+    def _copy(self, fragment: Fragment, with_content: bool) -> Fragment:
+        copy = fragment.model_copy(deep=True)
+        if with_content and copy.content_ref:
+            copy.content = self._contents.get(copy.content_ref)
+        return copy
+
+
+def _write_atomically(path: Path, data: str | bytes) -> None:
+    """
+    Write a file through a temporary file renamed over it, so that readers never see a partially written file.
+    """
+    mode = "wb" if isinstance(data, bytes) else "w"
+    with tempfile.NamedTemporaryFile(mode, dir=path.parent, prefix=f".{path.name}.", delete=False) as file:
+        file.write(data)
+    os.replace(file.name, path)
+
+
+def _copy_atomically(source: Path, path: Path) -> None:
+    """
+    Copy a file through a temporary file renamed over the destination, see `_write_atomically`.
+    """
+    with (
+        open(source, "rb") as source_file,
+        tempfile.NamedTemporaryFile("wb", dir=path.parent, prefix=f".{path.name}.", delete=False) as file,
+    ):
+        shutil.copyfileobj(source_file, file)
+    os.replace(file.name, path)
+
+
+def _local_file(url: str) -> Path | None:
+    """
+    Get the path of a `file:` URL, or None for other URLs.
+    """
+    parsed = parse.urlparse(url)
+    if parsed.scheme != "file":
+        return None
+    return Path(request.url2pathname(parsed.path))
+
+
+if os.name == "nt":
+    import msvcrt
+
+    def _lock_file(file) -> None:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+
+    def _unlock_file(file) -> None:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+else:
+    import fcntl
+
+    def _lock_file(file) -> None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(file) -> None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
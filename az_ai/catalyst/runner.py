@@ -1,122 +1,885 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import itertools
+import json
+import multiprocessing
+import os
+import socket
 import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Coroutine, Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any
+from uuid import uuid4
 
 from rich.console import Console
 from rich.markup import escape
+from rich.status import Status
 
+from az_ai.catalyst.batching import MicroBatcher
 from az_ai.catalyst.helpers.rich import fragment_as_table
-from az_ai.catalyst.repository import Repository
+from az_ai.catalyst.policies import (
+    AdaptiveConcurrency,
+    CircuitBreaker,
+    LatencyHistory,
+    MemoryBudget,
+    throttling_error,
+    transient_error,
+)
+from az_ai.catalyst.repository import FragmentNotFoundError, Repository
 from az_ai.catalyst.schema import (
+    FailureLogEntry,
     Fragment,
+    FragmentRelationships,
+    FragmentSelector,
     OperationsLogEntry,
     OperationSpec,
+    ProgressLogEntry,
 )
 
+# Number of call argument lists checked against the operations log at once
+CALL_ARGUMENTS_BATCH_SIZE = 1000
+# Number of consecutive transient failures of the calls to an endpoint after which calls to it are paused
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+# Time in seconds calls to an endpoint are paused before a trial call
+CIRCUIT_BREAKER_RESET_TIMEOUT = 30.0
+# Number of failed calls detailed in the error raised at the end of a run
+MAX_REPORTED_FAILURES = 10
+# Maximum time in seconds between two checks of the calls claimed by other workers in distributed mode
+LEASE_POLL_INTERVAL = 5.0
+# Returned by next() when a synchronous generator operation function is exhausted
+_END_OF_OUTPUTS = object()
+
+
 class OperationError(Exception):
     pass
 
 
+class _CallFailedError(Exception):
+    """
+    Raised from the error of the last attempt of an operation call, with the number of attempts made.
+    """
+
+    def __init__(self, attempts: int):
+        super().__init__(attempts)
+        self.attempts = attempts
+
+
 class CatalystRunner:
     def __init__(self, catalyst, repository: Repository = None):
         self.catalyst = catalyst
         self.repository = catalyst.repository
         self._console = Console()
 
-    def run(self, *args, **kwargs):
+    def run(self, **kwargs):
+        _run_coroutine(self.arun(**kwargs))
+
+    async def arun(
+        self,
+        streaming: bool = False,
+        max_documents_in_flight: int = 8,
+        retry_failed: bool = False,
+        quarantine_after: int = 3,
+        distributed: bool = False,
+        lease_ttl: float = 60.0,
+        memory_budget: int = None,
+        operations: list[str] = None,
+        documents: list[str] = None,
+        sample: float = None,
+        max_calls_per_operation: int = None,
+    ):
+        """
+        Run the pipeline.
+
+        A failed operation call does not stop the run: it is recorded in the failure log of the repository and the
+        other calls go on. Once the run is over, an `OperationError` listing the failed calls is raised. Failed
+        calls are attempted again by the next runs, until they have failed in `quarantine_after` runs. The
+        quarantined calls skipped by a run are listed in a summary once it is over.
+
+        Args:
+            streaming (bool): If True, each document goes through the operations of scope "same" on its own,
+                up to `max_documents_in_flight` documents at a time, so the first documents reach the last
+                operations while the next ones are still processed by the first operations. Operations of scope
+                "all", and the operations depending on them, run once all documents went through.
+            max_documents_in_flight (int): The maximum number of documents processed at the same time in
+                streaming mode.
+            retry_failed (bool): If True, only the calls in the failure log run, including the quarantined ones.
+            quarantine_after (int): The number of runs in which a call failed after which it is quarantined:
+                it is skipped by the next runs, unless `retry_failed` is True. The retries of a call within a run
+                count as one failure. Default is 3.
+            distributed (bool): If True, several workers can run the pipeline on the same repository at the same
+                time: each operation call is claimed with a lease in the repository before running, the calls
+                claimed by other workers are skipped, then run if their lease expires without the call being
+                logged (e.g. the worker crashed).
+            lease_ttl (float): The time in seconds a claimed call stays claimed without being renewed in
+                distributed mode. Leases are renewed every third of it while their call runs. Default is 60.
+            memory_budget (int): The maximum size in bytes of the input contents of the calls running at the same
+                time, estimated from the content sizes of the fragments. If set, inputs are found without their
+                content and each call loads it once admitted within the budget; it is released once the results
+                are stored, with the content of the results. A call larger than the budget runs alone.
+            operations (list[str]): If set, only the operations with these names run, on the fragments already in
+                the repository for their inputs.
+            documents (list[str]): If set, operations only run on the fragments of the source documents with
+                these references.
+            sample (float): If set, operations only run on the fragments of this fraction of the source documents
+                (of `documents` if set), selected from the hash of their reference: successive runs select the
+                same documents, and a larger sample includes the documents of a smaller one.
+            max_calls_per_operation (int): If set, the maximum number of calls of each operation in this run.
+        """
+        if sample is not None and not 0 < sample <= 1:
+            raise ValueError("sample must be in (0, 1]")
+        if max_calls_per_operation is not None and max_calls_per_operation < 1:
+            raise ValueError("max_calls_per_operation must be positive")
+        args = {
+            "streaming": streaming,
+            "max_documents_in_flight": max_documents_in_flight,
+            "retry_failed": retry_failed,
+            "quarantine_after": quarantine_after,
+            "distributed": distributed,
+            "lease_ttl": lease_ttl,
+            "memory_budget": memory_budget,
+            "operations": operations,
+            "documents": documents,
+            "sample": sample,
+            "max_calls_per_operation": max_calls_per_operation,
+        }
         self._console.log(
-            f"Run catalyst pipeline with args: {kwargs}",
+            f"Run catalyst pipeline with args: {args}",
         )
+        self._retry_failed = retry_failed
+        self._quarantine_after = quarantine_after
+        self._failures: list[tuple[FailureLogEntry, Exception]] = []
+        self._failed_fingerprints: set[str] = set()
+        self._skipped_quarantined: dict[str, FailureLogEntry] = {}
+        self._distributed = distributed
+        self._lease_ttl = lease_ttl
+        self._worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+        self._leases: set[str] = set()
+        self._memory_budget = MemoryBudget(memory_budget) if memory_budget else None
+        self._max_calls_per_operation = max_calls_per_operation
+        self._call_counts: dict[str, int] = {}
+        self._memo_index: dict[str, dict[str, OperationsLogEntry]] = {}
         with self._console.status("Running catalyst pipeline...") as status:
             try:
-                for operation in self.catalyst.operations().values():
-                    status.update(
-                        f"Running {escape(str(operation))}...",
-                        spinner="dots",
-                    )
-                    self._run_operation(operation)
+                operation_specs = list(self.catalyst.operations().values())
+                self._has_generators = any(operation.is_generator for operation in operation_specs)
+                dependencies = self._operation_dependencies(operation_specs)
+                operation_specs = self._select_operations(
+                    self._sort_operations(operation_specs, dependencies), operations
+                )
+                self._document_refs = self._select_documents(documents, sample)
+                self._invalidate_outdated_calls(operation_specs, self._document_refs)
+                # the failure log is read once, the failures of this run are tracked in memory
+                self._previous_failures = {
+                    failure.fingerprint: failure for failure in self.repository.find_failure_log_entries()
+                }
+                self._start_executors(operation_specs)
+                heartbeat = asyncio.create_task(self._heartbeat()) if distributed else None
+                try:
+                    if streaming:
+                        await self._stream_documents(status, operation_specs, dependencies, max_documents_in_flight)
+                    # In streaming mode, this runs the remaining operations, calls already done are skipped
+                    await self._run_operations(status, operation_specs, dependencies)
+                finally:
+                    if heartbeat:
+                        heartbeat.cancel()
+                    for key in self._leases:
+                        self.repository.release_lease(key, self._worker_id)
+                    self._leases.clear()
+                    self._shutdown_executors()
+                if self._skipped_quarantined:
+                    self._console.log(escape(self._skipped_quarantined_message()))
+                if self._failures:
+                    raise OperationError(self._failures_message()) from self._failures[0][1]
             except Exception as e:
                 self._console.log(f"Error running catalyst pipeline: {e}")
                 raise e
 
-    def _run_operation(self, operation: OperationSpec):
-        self._console.log(f"Running {escape(str(operation))}: ")
+    def _select_operations(self, operations: list[OperationSpec], names: list[str] | None) -> list[OperationSpec]:
+        """
+        Get the operations with the given names, in the order of `operations`, or all of them if `names` is None.
+        """
+        if names is None:
+            return operations
+        unknown = set(names) - {operation.name for operation in operations}
+        if unknown:
+            raise OperationError(f"Unknown operations: {', '.join(sorted(unknown))}")
+        return [operation for operation in operations if operation.name in names]
+
+    def _select_documents(self, documents: list[str] | None, sample: float | None) -> list[str] | None:
+        """
+        Get the references of the source documents the run is restricted to, or None if it is not.
+
+        Sampled documents are the ones whose reference hash falls in the first `sample` fraction of the hash
+        range, so the selection does not depend on the order or the number of documents in the repository.
+        """
+        if documents is None and sample is None:
+            return None
+        if documents is None:
+            documents = [
+                header.ref for header in self.repository.find_headers(FragmentSelector(fragment_type="Document"))
+            ]
+        if sample is not None:
+            documents = [document_ref for document_ref in documents if _in_sample(document_ref, sample)]
+        self._console.log(f"Running on {len(documents)} source documents")
+        return list(documents)
+
+    def _start_executors(self, operations: list[OperationSpec]):
+        """
+        Create the executors, the concurrency limits and the circuit breakers of the operations for a run.
+
+        Operations using the same client share the circuit breaker of its endpoint. Batched operations get a
+        batcher collecting their input fragments and hedged operations the durations of their logged calls.
+        """
+        thread_pool = ThreadPoolExecutor(
+            max_workers=max(
+                1,
+                sum(
+                    # hedged calls need threads for their duplicates
+                    operation.max_concurrency * (1 + (operation.hedge.max_hedges if operation.hedge else 0))
+                    for operation in operations
+                    if operation.executor == "thread" and not operation.is_async
+                ),
+            ),
+            thread_name_prefix="catalyst-operation",
+        )
+        self._executors: dict[str, Executor] = {operation.name: thread_pool for operation in operations}
+        for operation in operations:
+            if operation.executor == "process":
+                self._executors[operation.name] = ProcessPoolExecutor(
+                    max_workers=operation.concurrency,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker_process,
+                    initargs=(self.repository if self.repository.shared_across_processes else None,),
+                )
+        self._slots = {operation.name: AdaptiveConcurrency(operation.concurrency) for operation in operations}
+        self._circuit_breakers: dict[str, CircuitBreaker] = {}
+        for operation in operations:
+            self._circuit_breakers.setdefault(
+                operation.client or operation.name,
+                CircuitBreaker(CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RESET_TIMEOUT),
+            )
+        self._batchers: dict[str, MicroBatcher[Fragment, tuple[list[Fragment], int, int]]] = {
+            operation.name: MicroBatcher(
+                functools.partial(self._call_batch, operation), operation.batch_size, operation.batch_wait_ms
+            )
+            for operation in operations
+            if operation.batch_size
+        }
+        self._latencies: dict[str, LatencyHistory] = {
+            operation.name: LatencyHistory(
+                entry.duration_ns for entry in self.repository.find_operations_log_entry(operation_name=operation.name)
+            )
+            for operation in operations
+            if operation.hedge
+        }
+
+    def _shutdown_executors(self):
+        for executor in set(self._executors.values()):
+            executor.shutdown(wait=True)
+
+    def _claim(self, fingerprint: str) -> bool:
+        """
+        Claim an operation call for this worker in distributed mode.
+
+        Returns:
+            bool: Whether the call was claimed: False if another worker holds its lease, or has run it since it
+                was checked against the operations log.
+        """
+        if not self.repository.acquire_lease(fingerprint, self._worker_id, self._lease_ttl):
+            return False
+        if self.repository.find_operations_log_fingerprints([fingerprint]):
+            self.repository.release_lease(fingerprint, self._worker_id)
+            return False
+        self._leases.add(fingerprint)
+        return True
 
-        inputs = [self.repository.find(input.selector()) for input in operation.input_specs]
+    def _release(self, fingerprint: str):
+        if fingerprint in self._leases:
+            self._leases.discard(fingerprint)
+            self.repository.release_lease(fingerprint, self._worker_id)
+
+    async def _heartbeat(self):
+        """
+        Renew the leases of the calls running in distributed mode, every third of their time to live.
+        """
+        while True:
+            await asyncio.sleep(self._lease_ttl / 3)
+            for key in list(self._leases):
+                if not self.repository.renew_lease(key, self._worker_id, self._lease_ttl):
+                    self._console.log(f"  Lease {key} was lost, the call may run on another worker")
+                    self._leases.discard(key)
+
+    async def _run_operations(
+        self,
+        status: Status | None,
+        operations: list[OperationSpec],
+        dependencies: dict[str, list[str]],
+        source_document_ref: str = None,
+    ):
+        """
+        Run the operations following their dependencies, optionally for a single source document.
+
+        Each operation starts as soon as the operations producing its inputs are done, so independent
+        branches of the graph run concurrently. Repository accesses happen on the event loop thread,
+        synchronous operation functions are called in worker threads (or worker processes) and asynchronous
+        ones are awaited on the event loop.
+        """
+        running = []
+
+        async def run_when_ready(operation: OperationSpec, upstream_tasks: list[asyncio.Task]):
+            for task in upstream_tasks:
+                await task
+            running.append(operation.name)
+            if status:
+                status.update(f"Running {escape(', '.join(running))}...", spinner="dots")
+            try:
+                await self._run_operation(operation, source_document_ref)
+            finally:
+                running.remove(operation.name)
+
+        tasks: dict[str, asyncio.Task] = {}
+        for operation in operations:
+            tasks[operation.name] = asyncio.create_task(
+                run_when_ready(operation, [tasks[name] for name in dependencies[operation.name] if name in tasks])
+            )
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+    async def _stream_documents(
+        self,
+        status: Status,
+        operations: list[OperationSpec],
+        dependencies: dict[str, list[str]],
+        max_documents_in_flight: int,
+    ):
+        """
+        Run, document by document, the operations that only need fragments of the same source document.
+        """
+        streamed_operations = self._streamable_operations(operations, dependencies)
+        if not streamed_operations:
+            return
+        document_refs = self._document_refs
+        if document_refs is None:
+            document_refs = [
+                header.ref for header in self.repository.find_headers(FragmentSelector(fragment_type="Document"))
+            ]
+        done = 0
 
-        call_arguments = self._create_call_arguments(operation, inputs, operation.scope == "same")
-        #self._console.log(f"Call arguments for {operation.name}: {escape(str(call_arguments))}")
-        for arguments in call_arguments:
-            input_fragment_ids = self._input_fragment_ids_set(arguments)
-            if self._skip_operation(input_fragment_ids, operation):
-                self._console.log(f"  Skip for {escape(str(input_fragment_ids))}...")
+        async def run_pipeline(document_ref: str):
+            nonlocal done
+            await self._run_operations(None, streamed_operations, dependencies, document_ref)
+            done += 1
+            status.update(f"Streaming documents ({done}/{len(document_refs)} done)...", spinner="dots")
+
+        await _run_concurrently(
+            (functools.partial(run_pipeline, document_ref) for document_ref in document_refs),
+            asyncio.Semaphore(max_documents_in_flight),
+        )
+
+    def _streamable_operations(
+        self, operations: list[OperationSpec], dependencies: dict[str, list[str]]
+    ) -> list[OperationSpec]:
+        """
+        Get the operations combining fragments of the same source document only that do not depend, even
+        transitively, on another kind of operation.
+        """
+        excluded = set()
+        for operation in operations:
+            if not operation.per_document or excluded.intersection(dependencies[operation.name]):
+                excluded.add(operation.name)
+        return [operation for operation in operations if operation.name not in excluded]
+
+    def _operation_dependencies(self, operations: list[OperationSpec]) -> dict[str, list[str]]:
+        """
+        Get, for each operation, the names of the operations producing fragments matching its inputs.
+        """
+        return {
+            operation.name: [
+                other.name
+                for other in operations
+                if other is not operation
+                and any(
+                    input_spec.selector().matches(other.output_spec.selector()) for input_spec in operation.input_specs
+                )
+            ]
+            for operation in operations
+        }
+
+    def _sort_operations(
+        self, operations: list[OperationSpec], dependencies: dict[str, list[str]]
+    ) -> list[OperationSpec]:
+        """
+        Sort operations topologically, independent operations keep their registration order.
+        """
+        sorted_operations = []
+        done = set()
+        remaining = list(operations)
+        while remaining:
+            ready = [operation for operation in remaining if done.issuperset(dependencies[operation.name])]
+            if not ready:
+                raise OperationError(
+                    f"Circular dependency between operations: {', '.join(op.name for op in remaining)}"
+                )
+            for operation in ready:
+                sorted_operations.append(operation)
+                done.add(operation.name)
+                remaining.remove(operation)
+        return sorted_operations
+
+    async def _run_operation(self, operation: OperationSpec, source_document_ref: str = None):
+        """
+        Run the operation function for all the argument sets not already processed, optionally only with the
+        fragments of one source document.
+
+        Up to `operation.concurrency` calls run at the same time, in the executor for synchronous
+        functions or as event loop tasks for asynchronous ones. This limit is lowered when calls are
+        throttled, then raised back as calls succeed. Failed calls are retried following `operation.retry`,
+        giving their slot back while they wait, and calls are paused while the circuit breaker of the endpoint
+        is open. Calls sent to worker processes receive
+        fragment references, resolved from the repository by the worker. Results are stored on
+        the event loop thread as each call completes. Failed calls are recorded in the failure log, calls
+        quarantined by previous runs are skipped (see `arun`). In distributed mode, calls are claimed before
+        running and the calls claimed by other workers are checked again until they are logged.
+        """
+        if source_document_ref:
+            self._console.log(f"Running {escape(str(operation))} for {source_document_ref}: ")
+        else:
+            self._console.log(f"Running {escape(str(operation))}: ")
+
+        selectors = [input.selector() for input in operation.input_specs]
+        # the selection of source documents is pushed down to the repository queries
+        document_refs = [source_document_ref] if source_document_ref else self._document_refs
+        if document_refs is not None:
+            selectors = [selector.model_copy(update={"source_document_refs": document_refs}) for selector in selectors]
+        by_reference = self._by_reference(operation)
+        # with a memory budget, the contents of the inputs are loaded by each call once admitted
+        with_content = not by_reference and not self._memory_budget
+        inputs = [self.repository.find(selector, with_content=with_content) for selector in selectors]
+        # the outputs of unfinished calls of generator operations are hidden, with the other fragments of their
+        # partition, until the calls are over
+        unfinished_outputs = self._unfinished_outputs()
+        incomplete_partitions = {
+            operation.partition_key(fragment)
+            for fragments in inputs
+            for fragment in fragments
+            if fragment.id in unfinished_outputs
+        }
+        if incomplete_partitions:
+            self._console.log(
+                f"  Skip {len(incomplete_partitions)} partitions with outputs of unfinished generator calls..."
+            )
+            inputs = [
+                [fragment for fragment in fragments if fragment.id not in unfinished_outputs] for fragments in inputs
+            ]
+
+        call_arguments = self._create_call_arguments(operation, inputs, incomplete_partitions)
+        # self._console.log(f"Call arguments for {operation.name}: {escape(str(call_arguments))}")
+        slots = self._slots[operation.name]
+
+        async def execute(
+            fingerprint: str,
+            input_fragment_ids: set[str],
+            arguments: list[list[Fragment] | Fragment],
+            previous_failure: FailureLogEntry | None,
+        ):
+            start_time = time.time_ns()
+            memo_key = self._memo_key(operation, arguments) if operation.memoize else None
+            admitted_size = None
+            try:
+                if self._memory_budget:
+                    size = _content_size(arguments)
+                    await self._memory_budget.acquire(size)
+                    admitted_size = size
+                results = self._memoized_results(operation, memo_key, arguments) if memo_key else None
+                throttle_count = 0
+                stored = False
+                if results is not None:
+                    self._console.log(f"  Reuse memoized results for {escape(str(input_fragment_ids))}...")
+                    duration_ns = time.time_ns() - start_time
+                else:
+                    if self._memory_budget and not by_reference:
+                        # contents are loaded just in time, and released with the arguments once the call is over
+                        arguments = self._with_contents(arguments)
+                    if operation.batch_size:
+                        results, duration_ns, throttle_count = await self._batchers[operation.name].submit(
+                            arguments[0][0]
+                        )
+                    elif operation.is_generator:
+                        results, duration_ns, throttle_count = await self._call_with_retries(
+                            operation,
+                            input_fragment_ids,
+                            arguments,
+                            by_reference,
+                            progress=self._call_progress(operation, fingerprint, input_fragment_ids),
+                        )
+                        stored = True
+                    else:
+                        results, duration_ns, throttle_count = await self._call_with_retries(
+                            operation, input_fragment_ids, arguments, by_reference
+                        )
+                self._process_operation_result(
+                    operation,
+                    input_fragment_ids,
+                    results,
+                    duration_ns,
+                    memo_key=memo_key,
+                    concurrency=slots.limit,
+                    throttle_count=throttle_count,
+                    stored=stored,
+                )
+                if stored:
+                    self.repository.delete_progress_log_entries([fingerprint])
+            except _CallFailedError as e:
+                self._record_failure(operation, input_fragment_ids, e.__cause__, e.attempts, previous_failure)
+            except Exception as e:
+                self._record_failure(operation, input_fragment_ids, e, 1, previous_failure)
             else:
-                self._console.log(f"  Execute with {escape(str(input_fragment_ids))}...")
-                start_time = time.time_ns()
-                results = operation.func(*arguments)
-                end_time = time.time_ns()
-                self._process_operation_result(operation, input_fragment_ids, results, end_time - start_time)
+                if previous_failure:
+                    self.repository.delete_failure_log_entries([previous_failure.fingerprint])
+                    self._previous_failures.pop(previous_failure.fingerprint, None)
+            finally:
+                if admitted_size is not None:
+                    self._memory_budget.release(admitted_size)
+                if self._distributed:
+                    self._release(fingerprint)
 
-    def _skip_operation(self, input_fragment_ids: set[str], operation: OperationSpec) -> bool:
-        return (
-            len(
-                self.repository.find_operations_log_entry(
-                    operation_name=operation.name,
-                    input_fragment_refs=input_fragment_ids,
+        # calls claimed by other workers in distributed mode
+        deferred: list[list[list[Fragment] | Fragment]] = []
+
+        def calls(call_arguments: Iterable[list[list[Fragment] | Fragment]]):
+            # processed calls are looked up in bulk, one batch of argument lists at a time
+            for batch in itertools.batched(call_arguments, CALL_ARGUMENTS_BATCH_SIZE):
+                call_inputs = [(arguments, self._input_fragment_ids_set(arguments)) for arguments in batch]
+                fingerprints = [
+                    OperationsLogEntry.compute_fingerprint(operation.name, input_fragment_ids)
+                    for _, input_fragment_ids in call_inputs
+                ]
+                processed = self.repository.find_operations_log_fingerprints(fingerprints)
+                for (arguments, input_fragment_ids), fingerprint in zip(call_inputs, fingerprints, strict=True):
+                    failure = self._previous_failures.get(fingerprint)
+                    if fingerprint in processed:
+                        self._console.log(f"  Skip for {escape(str(input_fragment_ids))}...")
+                        continue
+                    if fingerprint in self._failed_fingerprints:
+                        self._console.log(f"  Skip failed call for {escape(str(input_fragment_ids))}...")
+                        continue
+                    if failure and failure.quarantined and not self._retry_failed:
+                        self._console.log(f"  Skip quarantined call for {escape(str(input_fragment_ids))}...")
+                        self._skipped_quarantined[fingerprint] = failure
+                        continue
+                    if self._retry_failed and not failure:
+                        continue
+                    call_count = self._call_counts.get(operation.name, 0)
+                    if self._max_calls_per_operation is not None and call_count >= self._max_calls_per_operation:
+                        self._console.log(f"  Reached the maximum of {call_count} calls of {operation.name}")
+                        return
+                    if self._distributed and not self._claim(fingerprint):
+                        self._console.log(
+                            f"  Skip call claimed by another worker for {escape(str(input_fragment_ids))}..."
+                        )
+                        deferred.append(arguments)
+                        continue
+                    self._console.log(f"  Execute with {escape(str(input_fragment_ids))}...")
+                    self._call_counts[operation.name] = call_count + 1
+                    yield functools.partial(execute, fingerprint, input_fragment_ids, arguments, failure)
+
+        # the concurrency limit of batched operations applies to batches, enough input fragments are let through
+        # to fill them
+        call_slots = asyncio.Semaphore(operation.batch_size * operation.concurrency) if operation.batch_size else slots
+        await _run_concurrently(calls(call_arguments), call_slots)
+        # the calls claimed by other workers are checked again until they are logged, or run here once their
+        # lease expired
+        while deferred:
+            await asyncio.sleep(min(LEASE_POLL_INTERVAL, self._lease_ttl / 4))
+            requeued = list(deferred)
+            deferred.clear()
+            await _run_concurrently(calls(requeued), call_slots)
+
+    async def _call_with_retries(
+        self,
+        operation: OperationSpec,
+        input_fragment_ids: set[str],
+        arguments: list[list[Fragment] | Fragment],
+        by_reference: bool,
+        estimated_tokens: int = None,
+        progress: ProgressLogEntry = None,
+    ) -> tuple[Fragment | list[Fragment] | list[str], int, int]:
+        """
+        Call the operation function within the rate limits of its client and the circuit breaker of its endpoint,
+        retrying failed calls following `operation.retry`. `estimated_tokens` defaults to the estimate of the
+        operation. Generator operations are called with the `progress` of the call (see `_call_generator`), their
+        result is the list of references of their outputs.
+
+        Returns:
+            tuple: The result, the duration of the successful attempt in nanoseconds and the number of throttled
+                attempts.
+        """
+        rate_limiter = self.catalyst.rate_limiter(operation.client) if operation.client else None
+        slots = self._slots[operation.name]
+        circuit_breaker = self._circuit_breakers[operation.client or operation.name]
+        throttle_count = 0
+        attempt = 0
+        while True:
+            attempt += 1
+            await circuit_breaker.acquire()
+            if rate_limiter:
+                await rate_limiter.acquire(operation.estimated_tokens if estimated_tokens is None else estimated_tokens)
+            start_time = time.time_ns()
+            try:
+                if progress is not None:
+                    result = await self._call_generator(operation, arguments, progress)
+                else:
+                    result = await self._hedge_operation(operation, arguments, by_reference)
+            except Exception as e:
+                if throttling_error(e) is not None:
+                    throttle_count += 1
+                    slots.on_throttle()
+                    circuit_breaker.on_success()
+                elif transient_error(e) is not None:
+                    circuit_breaker.on_failure()
+                else:
+                    # the endpoint answered
+                    circuit_breaker.on_success()
+                if not operation.retry.should_retry(e, attempt):
+                    raise _CallFailedError(attempt) from e
+                delay = operation.retry.delay(e, attempt)
+                self._console.log(
+                    f"  Attempt {attempt} with {escape(str(input_fragment_ids))} failed: {escape(str(e))}, "
+                    f"concurrency is {slots.limit}, retrying in {delay:.1f}s..."
+                )
+                # the call resumes within the concurrency limit, lowered if throttled
+                await slots.pause(delay)
+                continue
+            circuit_breaker.on_success()
+            slots.on_success()
+            duration_ns = time.time_ns() - start_time
+            if operation.hedge:
+                self._latencies[operation.name].add(duration_ns)
+            return result, duration_ns, throttle_count
+
+    async def _hedge_operation(
+        self, operation: OperationSpec, arguments: list[list[Fragment] | Fragment], by_reference: bool
+    ) -> Fragment | list[Fragment]:
+        """
+        Call the operation function, duplicating the call following `operation.hedge` if it is slow.
+
+        A duplicate call is issued each time the calls in flight have run for the hedge delay, the quantile of
+        the recent call durations, provided the rate limits of the client allow it right away. The first successful
+        result is returned and the other calls are cancelled. If all the calls fail, the first error is raised.
+        """
+        latencies = self._latencies.get(operation.name)
+        if not operation.hedge or len(latencies) < operation.hedge.min_samples:
+            return await self._call_operation(operation, arguments, by_reference)
+        delay = latencies.quantile(operation.hedge.quantile)
+        rate_limiter = self.catalyst.rate_limiter(operation.client) if operation.client else None
+        pending = {asyncio.ensure_future(self._call_operation(operation, arguments, by_reference))}
+        hedges = 0
+        error = None
+        try:
+            while pending:
+                can_hedge = hedges < operation.hedge.max_hedges
+                done, pending = await asyncio.wait(
+                    pending, timeout=delay if can_hedge else None, return_when=asyncio.FIRST_COMPLETED
                 )
+                for call in done:
+                    if call.exception() is None:
+                        return call.result()
+                    error = error or call.exception()
+                if not done and (not rate_limiter or rate_limiter.try_acquire(operation.estimated_tokens)):
+                    hedges += 1
+                    self._console.log(f"  Hedging call of {operation.name} slower than {delay:.1f}s...")
+                    pending.add(asyncio.ensure_future(self._call_operation(operation, arguments, by_reference)))
+                elif not done:
+                    # hedges are not worth waiting for the rate limits
+                    hedges = operation.hedge.max_hedges
+            raise error
+        finally:
+            for call in pending:
+                call.cancel()
+
+    def _unfinished_outputs(self) -> set[str]:
+        """
+        Get the references of the outputs stored so far by the unfinished calls of generator operations.
+        """
+        if not self._has_generators:
+            return set()
+        return {ref for progress in self.repository.find_progress_log_entries() for ref in progress.output_refs}
+
+    def _call_progress(
+        self, operation: OperationSpec, fingerprint: str, input_fragment_ids: set[str]
+    ) -> ProgressLogEntry:
+        """
+        Get the progress of a call of a generator operation recorded by a previous run, or a new one.
+        """
+        previous = self.repository.find_progress_log_entries(fingerprints=[fingerprint])
+        if previous:
+            self._console.log(
+                f"  Resume after {len(previous[0].output_refs)} stored outputs for {escape(str(input_fragment_ids))}..."
             )
-            > 0
+            return previous[0]
+        return ProgressLogEntry(
+            operation_name=operation.name, input_refs=input_fragment_ids, operation_version=operation.version
         )
 
+    async def _call_generator(
+        self, operation: OperationSpec, arguments: list[list[Fragment] | Fragment], progress: ProgressLogEntry
+    ) -> list[str]:
+        """
+        Call a generator operation function, storing its outputs as they are yielded and recording them in the
+        progress of the call, so that their content is not held until the call is over and an interrupted call
+        resumes where it stopped. The outputs stored by previous attempts are skipped: the function has to yield
+        the same outputs in the same order.
+
+        Returns:
+            list: The references of all the outputs of the call.
+        """
+        skipped = len(progress.output_refs)
+        position = 0
+        async for output in self._iterate_outputs(operation, arguments):
+            position += 1
+            if position <= skipped:
+                continue
+            self._store_output(operation, output)
+            output.content = None
+            progress.output_refs.append(output.id)
+            self.repository.add_progress_log_entry(progress)
+        return list(progress.output_refs)
+
+    async def _iterate_outputs(
+        self, operation: OperationSpec, arguments: list[list[Fragment] | Fragment]
+    ) -> AsyncIterator[Fragment]:
+        """
+        Iterate over the outputs of a generator operation function, advancing synchronous generators in the
+        operation executor.
+        """
+        if inspect.isasyncgenfunction(operation.func):
+            async for output in operation.func(*arguments):
+                yield output
+            return
+        loop = asyncio.get_running_loop()
+        executor = self._executors[operation.name]
+        outputs = iter(operation.func(*arguments))
+        while (output := await loop.run_in_executor(executor, next, outputs, _END_OF_OUTPUTS)) is not _END_OF_OUTPUTS:
+            yield output
+
+    async def _call_batch(
+        self, operation: OperationSpec, fragments: list[Fragment]
+    ) -> list[tuple[list[Fragment], int, int]]:
+        """
+        Call a batched operation function with a batch of input fragments, within the concurrency limit of the
+        operation, and split its outputs by source fragment.
+
+        Returns:
+            list: For each input fragment, its outputs, the duration of the call in nanoseconds and the number of
+                throttled attempts.
+        """
+        slots = self._slots[operation.name]
+        await slots.acquire()
+        try:
+            results, duration_ns, throttle_count = await self._call_with_retries(
+                operation,
+                {fragment.id for fragment in fragments},
+                [fragments],
+                self._by_reference(operation),
+                estimated_tokens=operation.estimated_tokens * len(fragments),
+            )
+        finally:
+            slots.release()
+        if not isinstance(results, list):
+            raise OperationError(f"Batched operation {operation.name} returned {type(results).__name__}, not a list")
+        outputs: dict[str, list[Fragment]] = {fragment.id: [] for fragment in fragments}
+        for result in results:
+            source_ref = result.relationships.get(FragmentRelationships.SOURCE)
+            if source_ref not in outputs:
+                raise OperationError(
+                    f"Batched operation {operation.name} returned a fragment whose source is not in the batch"
+                )
+            outputs[source_ref].append(result)
+        self._console.log(f"  Called {operation.name} with a batch of {len(fragments)} fragments")
+        return [(outputs[fragment.id], duration_ns, throttle_count) for fragment in fragments]
+
+    def _by_reference(self, operation: OperationSpec) -> bool:
+        """
+        Whether the operation function receives fragment references, resolved by worker processes.
+        """
+        return operation.executor == "process" and self.repository.shared_across_processes
+
+    async def _call_operation(
+        self, operation: OperationSpec, arguments: list[list[Fragment] | Fragment], by_reference: bool
+    ) -> Fragment | list[Fragment]:
+        """
+        Call the operation function: await it if asynchronous, otherwise run it in the operation executor.
+        """
+        if operation.is_async:
+            return await operation.func(*arguments)
+        loop = asyncio.get_running_loop()
+        executor = self._executors[operation.name]
+        if operation.executor == "process":
+            if by_reference:
+                arguments = _fragment_references(arguments)
+            return await loop.run_in_executor(executor, _call_in_worker_process, operation.func, arguments)
+        return await loop.run_in_executor(executor, lambda: operation.func(*arguments))
+
     def _create_call_arguments(
-        self, operation: OperationSpec, inputs: list[list[Fragment]], same_scope
-    ) -> list[list[list[Fragment] | Fragment]]:
+        self, operation: OperationSpec, inputs: list[list[Fragment]], excluded_partitions: set = frozenset()
+    ) -> Iterator[list[list[Fragment] | Fragment]]:
         """
-        Create argument lists for operation function calls based on input fragments.
+        Generate argument lists for operation function calls based on input fragments.
 
-        When same_scope is True, arguments are grouped by source document reference,
-        ensuring that operation functions only receive fragments from the same source.
-        Otherwise, all input combinations are considered.
+        Arguments are grouped by partition (see `OperationSpec.partition_key`), ensuring that operation
+        functions only receive fragments from the same partition, e.g. from the same source document for
+        the "same" scope. For the "all" scope, all input combinations are considered.
 
         For each input specification:
         - Single inputs: Each matching fragment generates a separate argument set.
         - Multiple inputs (input_spec.multiple=True): The entire list of matching fragments
           is passed as a single argument.
 
+        Fragments are grouped in a single pass over the inputs and argument lists are generated lazily, so
+        memory does not grow with the number of combinations.
+
+        Batched operations (see `OperationSpec.batch_size`) get one argument list per input fragment, whatever
+        their scope: the runner batches them when calling the operation function.
+
         Args:
             operation: The operation specification containing input requirements.
             inputs: Lists of fragments matching each input specification.
-            same_scope: If True, only combine fragments from the same source document.
+            excluded_partitions: Keys of the partitions not to generate argument lists for.
 
         Returns:
-            A list of argument lists ready to be passed to the operation function.
+            An iterator of argument lists ready to be passed to the operation function.
         """
-        source_refs = set()
-        if same_scope:
-            for input_list in inputs:
-                fragments = input_list if isinstance(input_list, list) else [input_list]
-                source_refs.update(fragment.source_document_ref() for fragment in fragments)
-        else:
-            source_refs = {"placeholder"}
+        if operation.batch_size:
+            yield from ([[fragment]] for fragment in inputs[0])
+            return
 
-        call_arguments_by_source = {source_ref: [[]] for source_ref in source_refs}
+        groups: dict[Any, list[list[Fragment]]] = {}
+        if operation.scope == "all":
+            groups[None] = [[] for _ in inputs]
+        for position, fragments in enumerate(inputs):
+            for fragment in fragments:
+                partition_key = operation.partition_key(fragment)
+                group = groups.get(partition_key)
+                if group is None:
+                    group = groups[partition_key] = [[] for _ in inputs]
+                group[position].append(fragment)
 
-        for input_spec, fragments in zip(operation.input_specs, inputs, strict=True):
-            for source_ref in source_refs:
-                current_args = call_arguments_by_source[source_ref]
-                if same_scope:
-                    matching_fragments = [f for f in fragments if f.source_document_ref() == source_ref]
-                else:
-                    matching_fragments = fragments
-
-                if input_spec.multiple:
-                    # For multiple inputs, append the list of matching fragments to each argument set
-                    for args in current_args:
-                        args.append(matching_fragments)
-                else:
-                    # For single inputs, create a new argument set for each matching fragment
-                    call_arguments_by_source[source_ref] = [
-                        args + [fragment] for args in current_args for fragment in matching_fragments
-                    ]
-        return [arg for args_list in call_arguments_by_source.values() for arg in args_list]
+        for partition_key, group in groups.items():
+            if partition_key in excluded_partitions:
+                continue
+            choices = [
+                [fragments] if input_spec.multiple else fragments
+                for input_spec, fragments in zip(operation.input_specs, group, strict=True)
+            ]
+            for arguments in itertools.product(*choices):
+                yield list(arguments)
 
     def _process_operation_result(
         self,
@@ -124,32 +887,289 @@ class CatalystRunner:
         input_fragment_ids: set[str],
         result: Fragment | list[Fragment],
         duration_ns: int,
+        memo_key: str = None,
+        concurrency: int = None,
+        throttle_count: int = None,
+        stored: bool = False,
     ):
+        """
+        Store the outputs of a call and log it. If `stored` is True, the outputs were stored as they were yielded
+        by a generator operation and `result` is the list of their references.
+        """
         if result is None:
             raise OperationError(
                 f"Operation {operation.name} returned None"  # TODO: better document for which run
             )
-        results = result if operation.output_spec.multiple else [result]
+        if stored:
+            output_refs = result
+        else:
+            results = result if operation.output_spec.multiple else [result]
+            for result in results:
+                self._store_output(operation, result)
+                if self._memory_budget:
+                    # the stored content is read back from the repository when needed
+                    result.content = None
+            output_refs = [fragment.id for fragment in results]
 
-        for result in results:
-            output_spec = operation.output_spec.selector()
-            if not output_spec.matches(result):
-                self._console.log(f"Result {result} does not match output spec {escape(str(output_spec))}")
-                raise OperationError(
-                    f"Non compliant Fragment returned for operation {operation.name}"  # TODO: better document wich run
-                )
-            self._console.log(f"    -> Storing {escape(str(result))}...")
-            self.repository.store(result)
-            self._console.log(fragment_as_table(result))
-
-        self.repository.add_operations_log_entry(
-            OperationsLogEntry(
-                operation_name=operation.name,
-                input_refs=input_fragment_ids,
-                output_refs=[fragment.id for fragment in results],
-                duration_ns=duration_ns,
+        entry = OperationsLogEntry(
+            operation_name=operation.name,
+            input_refs=input_fragment_ids,
+            output_refs=output_refs,
+            duration_ns=duration_ns,
+            memo_key=memo_key,
+            operation_version=operation.version,
+            concurrency=concurrency,
+            throttle_count=throttle_count,
+        )
+        self.repository.add_operations_log_entry(entry)
+        if memo_key and operation.name in self._memo_index:
+            self._memo_index[operation.name].setdefault(memo_key, entry)
+
+    def _store_output(self, operation: OperationSpec, result: Fragment):
+        output_spec = operation.output_spec.selector()
+        if not output_spec.matches(result):
+            self._console.log(f"Result {result} does not match output spec {escape(str(output_spec))}")
+            raise OperationError(
+                f"Non compliant Fragment returned for operation {operation.name}"  # TODO: better document wich run
             )
+        self._console.log(f"    -> Storing {escape(str(result))}...")
+        self.repository.store(result)
+        self._console.log(fragment_as_table(result))
+
+    def _record_failure(
+        self,
+        operation: OperationSpec,
+        input_fragment_ids: set[str],
+        error: Exception,
+        attempts: int,
+        previous_failure: FailureLogEntry | None,
+    ):
+        """
+        Record a failed call in the failure log, quarantining it once it has failed in `quarantine_after` runs.
+        """
+        runs = 1
+        if previous_failure:
+            attempts += previous_failure.attempts
+            runs += previous_failure.runs
+        failure = FailureLogEntry(
+            operation_name=operation.name,
+            input_refs=input_fragment_ids,
+            error=f"{type(error).__name__}: {error}",
+            attempts=attempts,
+            runs=runs,
+            quarantined=runs >= self._quarantine_after,
+        )
+        self._console.log(
+            f"  Failed with {escape(str(input_fragment_ids))} after {attempts} attempts in {runs} runs: "
+            f"{escape(failure.error)}" + (", quarantined" if failure.quarantined else "")
+        )
+        self.repository.add_failure_log_entry(failure)
+        self._failures.append((failure, error))
+        self._failed_fingerprints.add(failure.fingerprint)
+
+    def _failures_message(self) -> str:
+        lines = [
+            f"  {failure.operation_name} with {sorted(failure.input_refs)}: {failure.error}"
+            for failure, _ in self._failures[:MAX_REPORTED_FAILURES]
+        ]
+        if len(self._failures) > MAX_REPORTED_FAILURES:
+            lines.append(f"  ... and {len(self._failures) - MAX_REPORTED_FAILURES} more")
+        return f"{len(self._failures)} operation calls failed, recorded in the failure log:\n" + "\n".join(lines)
+
+    def _skipped_quarantined_message(self) -> str:
+        skipped = list(self._skipped_quarantined.values())
+        lines = [
+            f"  {failure.operation_name} with {sorted(failure.input_refs)}: {failure.error}"
+            for failure in skipped[:MAX_REPORTED_FAILURES]
+        ]
+        if len(skipped) > MAX_REPORTED_FAILURES:
+            lines.append(f"  ... and {len(skipped) - MAX_REPORTED_FAILURES} more")
+        return (
+            f"{len(skipped)} quarantined operation calls skipped, run with retry_failed=True to run them again:\n"
+            + "\n".join(lines)
+        )
+
+    def _invalidate_outdated_calls(self, operations: list[OperationSpec], document_refs: list[str] = None):
+        """
+        Delete the calls made by another version of their operation from the operations log, with their outputs
+        and, transitively, the calls using them and their outputs, so that all of them run again.
+
+        Calls logged without version are considered up to date. If `document_refs` is set, only the calls on
+        fragments of these source documents are invalidated. Unfinished calls of generator operations are
+        invalidated the same way, with the outputs they already stored.
+        """
+        versions = {operation.name: operation.version for operation in operations}
+        entries = self.repository.find_operations_log_entry()
+        progress = self.repository.find_progress_log_entries()
+        outdated = [
+            entry
+            for entry in [*entries, *progress]
+            if entry.operation_version is not None
+            and entry.operation_name in versions
+            and entry.operation_version != versions[entry.operation_name]
+        ]
+        if outdated and document_refs is not None:
+            selected_refs = {
+                header.ref
+                for header in self.repository.find_headers(
+                    FragmentSelector(fragment_type="Fragment", source_document_refs=document_refs)
+                )
+            }
+            outdated = [entry for entry in outdated if selected_refs.issuperset(entry.input_refs)]
+        if not outdated:
+            return
+        entries_by_input: dict[str, list[OperationsLogEntry]] = {}
+        for entry in entries:
+            for ref in entry.input_refs:
+                entries_by_input.setdefault(ref, []).append(entry)
+
+        invalid_fingerprints = set()
+        invalid_refs = set()
+        pending = list(outdated)
+        while pending:
+            entry = pending.pop()
+            if entry.fingerprint in invalid_fingerprints:
+                continue
+            invalid_fingerprints.add(entry.fingerprint)
+            for ref in entry.output_refs:
+                if ref not in invalid_refs:
+                    invalid_refs.add(ref)
+                    pending.extend(entries_by_input.get(ref, []))
+
+        self._console.log(
+            f"Invalidating {len(outdated)} outdated calls: deleting {len(invalid_fingerprints)} calls "
+            f"and {len(invalid_refs)} fragments..."
         )
+        # Fragments first: if interrupted, the outdated calls are still logged and invalidated on the next run
+        self.repository.delete_many(invalid_refs)
+        self.repository.delete_operations_log_entries(invalid_fingerprints)
+        self.repository.delete_progress_log_entries(invalid_fingerprints)
+
+    def _memo_input_key(self, operation: OperationSpec, fragment: Fragment) -> str:
+        """
+        Get the key of an input fragment for memoization: its type, label, content hash and the metadata listed
+        in `operation.memoize`. Fragments without content are only equal to themselves.
+        """
+        metadata_keys = operation.memoize if isinstance(operation.memoize, list) else []
+        return json.dumps(
+            [
+                fragment.class_name(),
+                fragment.label,
+                fragment.content_hash or fragment.id,
+                {key: fragment.metadata.get(key) for key in metadata_keys},
+            ],
+            sort_keys=True,
+            default=str,
+        )
+
+    def _memo_key(self, operation: OperationSpec, arguments: list[list[Fragment] | Fragment]) -> str:
+        """
+        Get the memoization key of an operation call, from the operation code and the keys of its inputs.
+        """
+        digest = hashlib.sha256(f"{operation.name}\0{operation.code_fingerprint}".encode())
+        for arg in arguments:
+            fragments = arg if isinstance(arg, list) else [arg]
+            for input_key in sorted(self._memo_input_key(operation, fragment) for fragment in fragments):
+                digest.update(b"\0")
+                digest.update(input_key.encode("utf-8"))
+            digest.update(b"\1")
+        return digest.hexdigest()
+
+    def _memo_entries(self, operation: OperationSpec) -> dict[str, OperationsLogEntry]:
+        """
+        Get the first logged call of the operation for each memoization key, read from the operations log the
+        first time the operation looks one up in the run, then completed with the calls of the run.
+        """
+        entries = self._memo_index.get(operation.name)
+        if entries is None:
+            entries = self._memo_index[operation.name] = {}
+            for entry in self.repository.find_operations_log_entry(operation_name=operation.name):
+                if entry.memo_key:
+                    entries.setdefault(entry.memo_key, entry)
+        return entries
+
+    def _memoized_results(
+        self, operation: OperationSpec, memo_key: str, arguments: list[list[Fragment] | Fragment]
+    ) -> Fragment | list[Fragment] | None:
+        """
+        Clone the outputs of a previous call with the same memoization key for the new inputs.
+
+        Clones get new ids. Their relationships to the previous inputs, to the previous source documents and to
+        each other are remapped to the new ones, and the metadata and parent names they inherited from their
+        previous source are replaced by the ones of the new source.
+        """
+        entry = self._memo_entries(operation).get(memo_key)
+        if entry is None:
+            return None
+        new_inputs = {
+            self._memo_input_key(operation, fragment): fragment
+            for arg in arguments
+            for fragment in (arg if isinstance(arg, list) else [arg])
+        }
+        try:
+            old_inputs = {ref: self.repository.get(ref) for ref in entry.input_refs}
+            old_outputs = [self.repository.get(ref) for ref in entry.output_refs]
+        except FragmentNotFoundError:
+            return None
+
+        sources: dict[str, Fragment] = {}
+        ref_map: dict[str, str] = {}
+        for old_ref, old_input in old_inputs.items():
+            new_input = new_inputs.get(self._memo_input_key(operation, old_input))
+            if new_input is None:
+                return None
+            sources[old_ref] = new_input
+            ref_map[old_ref] = new_input.id
+            if old_input.source_document_ref() and new_input.source_document_ref():
+                ref_map[old_input.source_document_ref()] = new_input.source_document_ref()
+        for old_output in old_outputs:
+            ref_map[old_output.id] = str(uuid4())
+
+        def remap(value: str | list[str]) -> str | list[str]:
+            if isinstance(value, list):
+                return [ref_map.get(ref, ref) for ref in value]
+            return ref_map.get(value, value)
+
+        results = []
+        for old_output in old_outputs:
+            metadata = dict(old_output.metadata)
+            parent_names = old_output.parent_names
+            old_source = old_inputs.get(old_output.relationships.get(FragmentRelationships.SOURCE))
+            if old_source is not None:
+                new_source = sources[old_source.id]
+                for key, value in old_source.metadata.items():
+                    if metadata.get(key) == value:
+                        if key in new_source.metadata:
+                            metadata[key] = new_source.metadata[key]
+                        else:
+                            metadata.pop(key)
+                if parent_names[: len(old_source.parent_names)] == old_source.parent_names:
+                    parent_names = new_source.parent_names + parent_names[len(old_source.parent_names) :]
+            results.append(
+                old_output.model_copy(
+                    update={
+                        "id": ref_map[old_output.id],
+                        "metadata": metadata,
+                        "parent_names": parent_names,
+                        "relationships": {key: remap(value) for key, value in old_output.relationships.items()},
+                        "content_ref": None,
+                        "content_hash": None,
+                    },
+                    deep=True,
+                )
+            )
+        return results if operation.output_spec.multiple else results[0]
+
+    def _with_contents(self, arguments: list[list[Fragment] | Fragment]) -> list[list[Fragment] | Fragment]:
+        """
+        Get the argument list with its fragments loaded from the repository with their content.
+        """
+        return [
+            [self.repository.get(fragment.id) for fragment in arg]
+            if isinstance(arg, list)
+            else self.repository.get(arg.id)
+            for arg in arguments
+        ]
 
     def _input_fragment_ids_set(self, arguments: list[list[Fragment] | Fragment]) -> set[str]:
         """
@@ -163,3 +1183,100 @@ class CatalystRunner:
                 input_fragments.append(arg)
 
         return set(fragment.id for fragment in input_fragments)
+
+
+_worker_repository: Repository | None = None
+
+
+def _init_worker_process(repository: Repository | None):
+    global _worker_repository
+    _worker_repository = repository
+
+
+def _fragment_references(arguments: list[list[Fragment] | Fragment]) -> list[list[str] | str]:
+    return [[fragment.id for fragment in arg] if isinstance(arg, list) else arg.id for arg in arguments]
+
+
+def _content_size(arguments: list[list[Fragment] | Fragment]) -> int:
+    """
+    Estimate the memory taken by the contents of the fragments of an argument list, from their content sizes.
+    """
+    return sum(
+        fragment.content_size or 0 for arg in arguments for fragment in (arg if isinstance(arg, list) else [arg])
+    )
+
+
+def _in_sample(key: str, sample: float) -> bool:
+    """
+    Whether a key belongs to the sample of the given fraction, from its hash.
+    """
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8]) < sample * 2**64
+
+
+def _call_in_worker_process(func: Callable, arguments: list[list[Fragment | str] | Fragment | str]) -> Any:
+    """
+    Call the operation function in a worker process, fragment references are resolved from the repository.
+    """
+
+    def resolve(arg):
+        if isinstance(arg, list):
+            return [resolve(item) for item in arg]
+        return _worker_repository.get(arg) if isinstance(arg, str) else arg
+
+    return func(*[resolve(arg) for arg in arguments])
+
+
+async def _run_concurrently(calls: Iterable[Callable[[], Awaitable]], slots: asyncio.Semaphore | AdaptiveConcurrency):
+    """
+    Run the calls as tasks, as many at a time as the semaphore allows.
+
+    After a failure no new call is started: the calls in flight are awaited, then the first error is raised.
+    """
+    tasks: set[asyncio.Task] = set()
+    errors: list[Exception] = []
+
+    async def run(call: Callable[[], Awaitable]):
+        try:
+            await call()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            slots.release()
+
+    calls = iter(calls)
+    try:
+        while not errors:
+            await slots.acquire()
+            try:
+                call = None if errors else next(calls, None)
+            except BaseException:
+                slots.release()
+                raise
+            if call is None:
+                slots.release()
+                break
+            task = asyncio.create_task(run(call))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    if errors:
+        raise errors[0]
+
+
+def _run_coroutine(coroutine: Coroutine) -> Any:
+    """
+    Run the coroutine to completion from synchronous code.
+
+    If an event loop is already running in this thread (e.g. in a notebook), the coroutine is run in its own
+    event loop in a separate thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
@@ -1,7 +1,15 @@
+import ast
 import base64
+import functools
+import hashlib
+import inspect
 import json
 import mimetypes
-from collections.abc import Callable
+import os
+import textwrap
+import time
+import types
+from collections.abc import Callable, Iterable
 from enum import Enum, auto
 from io import BytesIO
 from pathlib import Path
@@ -22,13 +30,17 @@ from pydantic import (
     ConfigDict,
     Field,
     GetJsonSchemaHandler,
+    PrivateAttr,
     SerializationInfo,
     SerializerFunctionWrapHandler,
     model_serializer,
+    model_validator,
 )
 from pydantic.json_schema import JsonSchemaValue
 from pydantic_core import CoreSchema
 
+from az_ai.catalyst.policies import HedgePolicy, RetryPolicy
+
 
 class FragmentRelationships(str, Enum):
     """
@@ -65,6 +77,14 @@ class Fragment(BaseModel):
         default=None,
         description="Reference to the content of the fragment.",
     )
+    content_hash: str | None = Field(
+        default=None,
+        description="SHA-256 hash of the content of the fragment (set by the repository when storing content).",
+    )
+    content_size: int | None = Field(
+        default=None,
+        description="Size in bytes of the content of the fragment (set by the repository when storing content).",
+    )
     parent_names: list[str] = Field(
         default_factory=list,
         description="List of human-readable parent names for the fragment.",
@@ -113,6 +133,31 @@ class Fragment(BaseModel):
         Get the image data URL for the fragment.
         """
         return f"data:{self.mime_type};base64,{self.content_as_base64()}"
+
+    def patch_metadata(self, patch: dict[str, Any]) -> Self:
+        """
+        Update Fragment.metadata with the given patch.
+        Keys with a None value in the patch are removed from the metadata.
+        Returns:
+            Self: The fragment.
+        """
+        for key, value in patch.items():
+            if value is None:
+                self.metadata.pop(key, None)
+            else:
+                self.metadata[key] = value
+        return self
+
+    def compute_content_hash(self) -> str | None:
+        """
+        Compute the SHA-256 hash of Fragment.content.
+        If the content is None, None is returned.
+        Returns:
+            str: The hex encoded hash of the content.
+        """
+        if self.content is None:
+            return None
+        return hashlib.sha256(self.content).hexdigest()
     
     def __str__(self):
         return f"{self.id}:{self.__class__.__name__}[{self.label}, {self.human_file_name()}]"
@@ -123,6 +168,8 @@ class Fragment(BaseModel):
         # Do not copy those  fields
         data.pop("id", None)
         data.pop("content_ref", None)
+        data.pop("content_hash", None)
+        data.pop("content_size", None)
 
         for key in set(data.keys()):
             if key not in cls.model_fields:
@@ -317,6 +364,10 @@ class FragmentSelector(BaseModel, frozen=True):
         default=list(),
         description="Labels for the output parameter.",
     )
+    source_document_refs: list[str] | None = Field(
+        default=None,
+        description="If set, only fragments of these source documents are selected.",
+    )
 
     def matches(self, fragment_or_selector: Union[Fragment, "FragmentSelector"]) -> bool:
         """
@@ -326,6 +377,11 @@ class FragmentSelector(BaseModel, frozen=True):
             return self.matches_selector(fragment_or_selector)
         if not isinstance(fragment_or_selector, Fragment.get_subclass(self.fragment_type)):
             return False
+        if (
+            self.source_document_refs is not None
+            and fragment_or_selector.source_document_ref() not in self.source_document_refs
+        ):
+            return False
         if len(self.labels) == 0:
             return True
         return fragment_or_selector.label in self.labels
@@ -351,7 +407,7 @@ class FragmentSelector(BaseModel, frozen=True):
         return result + "}"
 
     def __hash__(self):
-        return hash((self.fragment_type, tuple(self.labels)))
+        return hash((self.fragment_type, tuple(self.labels), tuple(self.source_document_refs or ())))
 
 
 class OperationInputSpec(BaseModel):
@@ -432,11 +488,169 @@ class OperationSpec(BaseModel):
     input_specs: list[OperationInputSpec]
     output_spec: OperationOutputSpec
     func: CommandFunctionType = Field(..., description="The operation function.")
-    scope: str = Field(
+    scope: str | Callable[[Fragment], Any] = Field(
         default="same",
-        description="Scope of the operation function. Can be 'same' or 'all'.",
-        pattern="^(same|all)$",
+        description=(
+            "Scope of the operation function. Can be 'same' (fragments of the same source document), 'all', "
+            "'metadata:<key>' (fragments of the same source document with the same value for this metadata key) or "
+            "a function returning the partition key of a fragment."
+        ),
+    )
+    max_concurrency: int = Field(
+        default=1,
+        ge=1,
+        description="Maximum number of calls of the operation function running at the same time.",
+    )
+    executor: str = Field(
+        default="thread",
+        description="Where synchronous calls of the operation function run. Can be 'thread' or 'process'.",
+        pattern="^(thread|process)$",
+    )
+    workers: int | None = Field(
+        default=None,
+        ge=1,
+        description="Number of worker processes when executor is 'process'. Defaults to the number of CPUs.",
+    )
+    version: str | None = Field(
+        default=None,
+        description="Version of the operation. Defaults to the fingerprint of the operation function source code.",
     )
+    client: str | None = Field(
+        default=None,
+        description="Name of the Catalyst client used by the operation function, whose rate limits apply to calls.",
+        pattern="^(azure_openai_client|document_intelligence_client|content_understanding_client)$",
+    )
+    estimated_tokens: int = Field(
+        default=0,
+        ge=0,
+        description="Estimated number of tokens used by a call, counted against the client tokens per minute quota.",
+    )
+    batch_size: int | None = Field(
+        default=None,
+        ge=1,
+        description=(
+            "Maximum number of input fragments per call of an operation function taking a single list parameter. "
+            "If set, the runner batches the fragments itself and logs the calls per input fragment."
+        ),
+    )
+    batch_wait_ms: float = Field(
+        default=0,
+        ge=0,
+        description="Maximum time in milliseconds an input fragment waits for its batch to fill.",
+    )
+    retry: RetryPolicy = Field(
+        default_factory=RetryPolicy,
+        description="How failed calls of the operation function are retried. Default retries transient errors.",
+    )
+    hedge: HedgePolicy | None = Field(
+        default=None,
+        description="When slow calls of the operation function are duplicated. Default is no hedging.",
+    )
+    memoize: bool | list[str] = Field(
+        default=False,
+        description=(
+            "Reuse the outputs of a previous call with the same input contents. If a list, the metadata keys of "
+            "the inputs that must also be equal."
+        ),
+    )
+
+    @model_validator(mode="after")
+    def check_scope(self) -> "OperationSpec":
+        if isinstance(self.scope, str) and self.scope not in ("same", "all") and not self._scope_metadata_key:
+            raise ValueError(
+                f"Invalid scope {self.scope!r} of operation {self.name}: expected 'same', 'all', "
+                "'metadata:<key>' or a function."
+            )
+        return self
+
+    @model_validator(mode="after")
+    def check_executor(self) -> "OperationSpec":
+        if self.executor == "process" and self.is_async:
+            raise ValueError(f"Asynchronous operation {self.name} cannot run in a process pool.")
+        return self
+
+    @model_validator(mode="after")
+    def check_batch_size(self) -> "OperationSpec":
+        if self.batch_size and (
+            len(self.input_specs) != 1 or not self.input_specs[0].multiple or not self.output_spec.multiple
+        ):
+            raise ValueError(
+                f"Batched operation {self.name} must take a single list parameter and return a list of fragments."
+            )
+        return self
+
+    @model_validator(mode="after")
+    def check_generator(self) -> "OperationSpec":
+        if self.is_generator and not self.output_spec.multiple:
+            raise ValueError(f"Generator operation {self.name} must be annotated as yielding fragments.")
+        if self.is_generator and (self.executor == "process" or self.batch_size or self.hedge):
+            raise ValueError(f"Generator operation {self.name} cannot run in a process pool, be batched or hedged.")
+        return self
+
+    @model_validator(mode="after")
+    def set_version(self) -> "OperationSpec":
+        if self.version is None:
+            self.version = self.code_fingerprint
+        return self
+
+    @functools.cached_property
+    def code_fingerprint(self) -> str:
+        """
+        Fingerprint of the code of the operation function: its syntax tree without decorators and docstring, so
+        that the options of the decorator, comments and formatting do not change it.
+        """
+        return hashlib.sha256(_function_code(self.func).encode("utf-8")).hexdigest()
+
+    @property
+    def per_document(self) -> bool:
+        """
+        Whether the operation function only combines fragments of the same source document.
+        """
+        return isinstance(self.scope, str) and self.scope != "all"
+
+    def partition_key(self, fragment: Fragment) -> Any:
+        """
+        Get the key of the partition of the fragment: fragments are only combined with fragments of the same
+        partition.
+        """
+        if self.scope == "all":
+            return None
+        if self.scope == "same":
+            return fragment.source_document_ref()
+        if callable(self.scope):
+            return self.scope(fragment)
+        value = fragment.metadata.get(self._scope_metadata_key)
+        return (fragment.source_document_ref(), json.dumps(value, default=str))
+
+    @property
+    def _scope_metadata_key(self) -> str | None:
+        """The metadata key of a 'metadata:<key>' scope."""
+        if isinstance(self.scope, str) and self.scope.startswith("metadata:"):
+            return self.scope.removeprefix("metadata:") or None
+        return None
+
+    @property
+    def concurrency(self) -> int:
+        """
+        Maximum number of calls of the operation function running at the same time.
+        """
+        if self.executor == "process":
+            return self.workers or os.cpu_count() or 1
+        return self.max_concurrency
+
+    @property
+    def is_async(self) -> bool:
+        """
+        Whether the operation function is a coroutine function.
+        """
+        return inspect.iscoroutinefunction(self.func)
+
+    @property
+    def is_generator(self) -> bool:
+        """
+        Whether the operation function is a generator function, synchronous or asynchronous, yielding its outputs.
+        """
+        return inspect.isgeneratorfunction(self.func) or inspect.isasyncgenfunction(self.func)
 
     def __call__(self, *args, **kwargs):
         return self.func(*args, **kwargs)
@@ -461,6 +675,110 @@ class OperationsLogEntry(BaseModel):
     input_refs: set[str] = Field(..., description="Reference to the input fragments.")
     output_refs: list[str] = Field(..., description="Reference to the output fragments.")
     duration_ns: int = Field(description="Duration of the operation in nanoseconds.")
+    fingerprint: str | None = Field(
+        default=None,
+        description="Fingerprint of the operation name and input references, computed if not provided.",
+    )
+    memo_key: str | None = Field(
+        default=None,
+        description="Key of the input contents for memoized operations.",
+    )
+    operation_version: str | None = Field(
+        default=None,
+        description="Version of the operation that made the call.",
+    )
+    concurrency: int | None = Field(
+        default=None,
+        description="Concurrency limit of the operation when the call completed.",
+    )
+    throttle_count: int | None = Field(
+        default=None,
+        description="Number of attempts of the call rejected by throttling.",
+    )
+
+    @model_validator(mode="after")
+    def set_fingerprint(self) -> "OperationsLogEntry":
+        if self.fingerprint is None:
+            self.fingerprint = self.compute_fingerprint(self.operation_name, self.input_refs)
+        return self
+
+    @staticmethod
+    def compute_fingerprint(operation_name: str, input_refs: Iterable[str]) -> str:
+        """
+        Compute a stable fingerprint of an operation call from the operation name and the input references.
+        """
+        digest = hashlib.sha256(operation_name.encode("utf-8"))
+        for ref in sorted(set(input_refs)):
+            digest.update(b"\0")
+            digest.update(ref.encode("utf-8"))
+        return digest.hexdigest()
+
+
+class FailureLogEntry(BaseModel):
+    """
+    A class representing a failed operation call in the failure log.
+    """
+
+    model_config = ConfigDict(extra="forbid")
+
+    operation_name: str = Field(..., description="The failed operation.")
+    input_refs: set[str] = Field(..., description="Reference to the input fragments.")
+    error: str = Field(..., description="Type and message of the error of the last attempt.")
+    attempts: int = Field(default=1, ge=1, description="Number of failed attempts of the call, over all runs.")
+    runs: int = Field(default=1, ge=1, description="Number of runs in which the call failed.")
+    quarantined: bool = Field(
+        default=False,
+        description="Whether the call is skipped by the next runs, until they re-drive the failed calls.",
+    )
+    fingerprint: str | None = Field(
+        default=None,
+        description="Fingerprint of the operation name and input references, computed if not provided.",
+    )
+
+    @model_validator(mode="after")
+    def set_fingerprint(self) -> "FailureLogEntry":
+        if self.fingerprint is None:
+            self.fingerprint = OperationsLogEntry.compute_fingerprint(self.operation_name, self.input_refs)
+        return self
+
+
+class ProgressLogEntry(BaseModel):
+    """
+    A class representing the outputs already stored by an unfinished call of a generator operation, in the order
+    they were yielded. Repositories store it apart from the operations log, as it is rewritten for each output.
+    """
+
+    model_config = ConfigDict(extra="forbid")
+
+    operation_name: str = Field(..., description="The operation.")
+    input_refs: set[str] = Field(..., description="Reference to the input fragments.")
+    output_refs: list[str] = Field(default_factory=list, description="References to the stored output fragments.")
+    operation_version: str | None = Field(default=None, description="Version of the operation making the call.")
+    fingerprint: str | None = Field(
+        default=None,
+        description="Fingerprint of the operation name and input references, computed if not provided.",
+    )
+
+    @model_validator(mode="after")
+    def set_fingerprint(self) -> "ProgressLogEntry":
+        if self.fingerprint is None:
+            self.fingerprint = OperationsLogEntry.compute_fingerprint(self.operation_name, self.input_refs)
+        return self
+
+
+class Lease(BaseModel):
+    """
+    A class representing the claim of a worker on an operation call, valid until it expires.
+    """
+
+    model_config = ConfigDict(extra="forbid")
+
+    key: str = Field(..., description="Key of the claimed operation call.")
+    owner: str = Field(..., description="Identifier of the worker holding the lease.")
+    expires_at: float = Field(..., description="Expiry time of the lease, in seconds since the epoch.")
+
+    def expired(self) -> bool:
+        return self.expires_at <= time.time()
 
 
 class OperationsLog(BaseModel):
@@ -471,3 +789,89 @@ class OperationsLog(BaseModel):
     model_config = ConfigDict(extra="forbid")
 
     entries: list[OperationsLogEntry] = Field(default_factory=list, description="List of operations in the log.")
+    _by_fingerprint: dict[str, list[OperationsLogEntry]] = PrivateAttr(default_factory=dict)
+    _by_memo_key: dict[str, list[OperationsLogEntry]] = PrivateAttr(default_factory=dict)
+
+    def model_post_init(self, context) -> None:
+        for entry in self.entries:
+            self._index_entry(entry)
+
+    def add(self, entry: OperationsLogEntry) -> None:
+        """
+        Add an entry to the log.
+        """
+        self.entries.append(entry)
+        self._index_entry(entry)
+
+    def remove(self, fingerprints: Iterable[str]) -> None:
+        """
+        Remove the entries with the given fingerprints from the log.
+        """
+        fingerprints = set(fingerprints)
+        self.entries = [entry for entry in self.entries if entry.fingerprint not in fingerprints]
+        self._by_fingerprint.clear()
+        self._by_memo_key.clear()
+        for entry in self.entries:
+            self._index_entry(entry)
+
+    def _index_entry(self, entry: OperationsLogEntry) -> None:
+        self._by_fingerprint.setdefault(entry.fingerprint, []).append(entry)
+        if entry.memo_key:
+            self._by_memo_key.setdefault(entry.memo_key, []).append(entry)
+
+    def find(
+        self, operation_name: str = None, input_fragment_refs: set[str] = None, memo_key: str = None
+    ) -> list[OperationsLogEntry]:
+        """
+        Find entries by operation_name and/or input_fragment_refs, or by memo_key.
+        """
+        if memo_key:
+            return [
+                entry
+                for entry in self._by_memo_key.get(memo_key, [])
+                if not operation_name or operation_name == entry.operation_name
+            ]
+        if operation_name and input_fragment_refs:
+            fingerprint = OperationsLogEntry.compute_fingerprint(operation_name, input_fragment_refs)
+            return list(self._by_fingerprint.get(fingerprint, []))
+        return [
+            entry
+            for entry in self.entries
+            if (not operation_name or operation_name == entry.operation_name)
+            and (
+                not input_fragment_refs
+                or (
+                    len(input_fragment_refs) == len(entry.input_refs)
+                    and all(ref in entry.input_refs for ref in input_fragment_refs)
+                )
+            )
+        ]
+
+    def find_fingerprints(self, fingerprints: Iterable[str]) -> set[str]:
+        """
+        Get the fingerprints, among the given ones, having at least one entry in the log.
+        """
+        return {fingerprint for fingerprint in fingerprints if fingerprint in self._by_fingerprint}
+
+
+def _function_code(func: Callable) -> str:
+    """
+    Get a dump of the syntax tree of the function, without its decorators and docstring, or of its bytecode if
+    its source is not available.
+    """
+    try:
+        tree = ast.parse(textwrap.dedent(inspect.getsource(func)))
+    except (OSError, TypeError, SyntaxError):
+        tree = None
+    if tree and tree.body and isinstance(tree.body[0], ast.FunctionDef | ast.AsyncFunctionDef):
+        function = tree.body[0]
+        function.decorator_list = []
+        if ast.get_docstring(function) is not None:
+            function.body = function.body[1:] or [ast.Pass()]
+        return ast.dump(function)
+    return _bytecode(func.__code__)
+
+
+def _bytecode(code: types.CodeType) -> str:
+    consts = tuple(_bytecode(const) if isinstance(const, types.CodeType) else const for const in code.co_consts)
+    return repr((code.co_code, consts, code.co_names))
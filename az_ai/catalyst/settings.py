@@ -18,7 +18,10 @@ from pydantic_settings import (
 
 class CatalystSettings(BaseSettings):
     repository_url: Path | str = Field(
-        description="URL of the repository, which can be a local path or remote Azure Storage Account URL"
+        description=(
+            "URL of the repository, which can be a local path, a remote Azure Storage Account URL "
+            "or 'memory:' for an ephemeral in-memory repository"
+        )
     )
     repository_container_name: str | None = Field(
         default=None, description="Name of the blob container name within the Azure storage"
@@ -64,6 +67,29 @@ class CatalystSettings(BaseSettings):
     azure_ai_search_endpoint: str = Field(validation_alias=AliasChoices("search_endpoint", "azure_ai_search_endpoint"))
     azure_ai_endpoint: str = Field(validation_alias=AliasChoices("azure_ai_endpoint", "azure_openai_endpoint"))
 
+    azure_openai_requests_per_minute: int | None = Field(
+        default=None,
+        description="Requests per minute quota of Azure OpenAI, enforced for operations using azure_openai_client",
+    )
+    azure_openai_tokens_per_minute: int | None = Field(
+        default=None,
+        description="Tokens per minute quota of Azure OpenAI, enforced for operations using azure_openai_client",
+    )
+    azure_ai_document_intelligence_requests_per_minute: int | None = Field(
+        default=None,
+        description=(
+            "Requests per minute quota of Document Intelligence, enforced for operations using "
+            "document_intelligence_client"
+        ),
+    )
+    azure_content_understanding_requests_per_minute: int | None = Field(
+        default=None,
+        description=(
+            "Requests per minute quota of Content Understanding, enforced for operations using "
+            "content_understanding_client"
+        ),
+    )
+
     model_config = SettingsConfigDict(
         env_file=".env",
         pyproject_toml_depth=5,
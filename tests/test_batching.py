@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from az_ai.catalyst.batching import MicroBatcher
+
+
+@pytest.mark.asyncio
+async def test_items_are_processed_in_batches():
+    batches = []
+
+    async def process(items):
+        batches.append(items)
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher(process, batch_size=3)
+
+    results = await asyncio.gather(*(batcher.submit(item) for item in range(7)))
+
+    assert results == [item * 10 for item in range(7)]
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+@pytest.mark.asyncio
+async def test_items_wait_for_their_batch_to_fill():
+    batches = []
+
+    async def process(items):
+        batches.append(items)
+        return items
+
+    batcher = MicroBatcher(process, batch_size=10, batch_wait_ms=50)
+
+    async def submit_later(item, delay):
+        await asyncio.sleep(delay)
+        return await batcher.submit(item)
+
+    await asyncio.gather(submit_later(0, 0), submit_later(1, 0.01), submit_later(2, 0.2))
+
+    assert batches == [[0, 1], [2]]
+
+
+@pytest.mark.asyncio
+async def test_batch_errors_are_raised_for_all_items():
+    async def process(items):
+        raise ValueError("batch failed")
+
+    batcher = MicroBatcher(process, batch_size=2)
+
+    results = await asyncio.gather(batcher.submit(0), batcher.submit(1), return_exceptions=True)
+
+    assert [type(result) for result in results] == [ValueError, ValueError]
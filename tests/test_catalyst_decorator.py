@@ -1,3 +1,4 @@
+from collections.abc import AsyncIterator, Iterator
 from typing import Annotated
 
 import pytest
@@ -123,3 +124,49 @@ def test_multiple_input_specs(catalyst):
     assert not _op.output_spec.multiple
     assert _op.output_spec.fragment_type == "Fragment"
     assert _op.output_spec.label == "text"
+
+
+def test_generator_operation(catalyst):
+    @catalyst.operation()
+    def generator_op(document: Document) -> Annotated[Iterator[Fragment], "page"]:
+        yield Fragment.with_source(document, label="page")
+
+    @catalyst.operation()
+    async def async_generator_op(
+        page: Annotated[Fragment, {"label": "page"}],
+    ) -> Annotated[AsyncIterator[Fragment], "figure"]:
+        yield Fragment.with_source(page, label="figure")
+
+    for name in ["generator_op", "async_generator_op"]:
+        op = catalyst.operations()[name]
+        assert op.is_generator
+        assert op.output_spec.fragment_type == "Fragment"
+        assert op.output_spec.multiple is True
+
+    with pytest.raises(ValueError):
+
+        @catalyst.operation(executor="process")
+        def process_generator_op(document: Document) -> Annotated[Iterator[Fragment], "page"]:
+            yield Fragment.with_source(document, label="page")
+
+
+def test_operation_version_is_the_fingerprint_of_the_function_code(tmpdir):
+    catalysts = [az_ai.catalyst.Catalyst(repository_url=str(tmpdir / str(number))) for number in range(3)]
+
+    @catalysts[0].operation()
+    def describe(document: Document) -> Annotated[Fragment, "description"]:
+        return Fragment.with_source(document, label="description")
+
+    @catalysts[1].operation(max_concurrency=4, executor="process")
+    def describe(document: Document) -> Annotated[Fragment, "description"]:  # noqa: F811
+        """Describe the document."""
+        # the options of the decorator, comments and docstrings are not part of the code
+        return Fragment.with_source(document, label="description")
+
+    @catalysts[2].operation()
+    def describe(document: Document) -> Annotated[Fragment, "description"]:  # noqa: F811
+        return Fragment.with_source(document, label="summary")
+
+    versions = [catalyst.operations()["describe"].version for catalyst in catalysts]
+    assert versions[0] == versions[1]
+    assert versions[0] != versions[2]
@@ -0,0 +1,96 @@
+from pathlib import Path
+
+import pytest
+
+from az_ai.catalyst import Catalyst, OperationError
+from az_ai.catalyst.schema import FragmentSelector
+
+
+@pytest.fixture(scope="function")
+def catalyst(tmpdir):
+    return Catalyst(repository_url=str(tmpdir / "repository"))
+
+
+@pytest.fixture(scope="function")
+def directory(tmpdir):
+    directory = Path(tmpdir) / "documents"
+    (directory / "sub").mkdir(parents=True)
+    (directory / "a.txt").write_bytes(b"content A")
+    (directory / "b.txt").write_bytes(b"content B")
+    (directory / "sub" / "a.txt").write_bytes(b"content C")
+    (directory / "sub" / "copy_of_b.txt").write_bytes(b"content B")
+    (directory / "c.md").write_bytes(b"# content D")
+    return directory
+
+
+def test_add_documents_from_directory(catalyst, directory):
+    documents = catalyst.add_documents_from_directory(directory, workers=2, batch_size=2)
+
+    assert len(documents) == 4
+    stored = catalyst.repository.find(FragmentSelector(fragment_type="Document"))
+    assert {document.content for document in stored} == {b"content A", b"content B", b"content C", b"# content D"}
+    assert {document.metadata["file_name"] for document in stored} >= {"a.txt", "sub/a.txt", "c.md"}
+    assert all(document.content_hash == document.compute_content_hash() for document in stored)
+
+
+def test_add_documents_from_directory_copies_contents_without_loading_them(catalyst, directory, monkeypatch):
+    def load_content_from_url(fragment):
+        raise AssertionError(f"{fragment.content_url} loaded in memory")
+
+    monkeypatch.setattr(catalyst.repository, "_load_content_from_url", load_content_from_url)
+    documents = catalyst.add_documents_from_directory(directory, batch_size=2)
+
+    assert all(document.content is None for document in documents)
+    stored = catalyst.repository.find(FragmentSelector(fragment_type="Document"))
+    assert {document.content for document in stored} == {b"content A", b"content B", b"content C", b"# content D"}
+
+
+def test_add_documents_from_directory_releases_contents_per_document(directory):
+    catalyst = Catalyst(repository_url="memory:")
+    stored_contents = []
+    store = catalyst.repository.store
+
+    def store_and_count_contents(fragment):
+        # contents of the fragments of the batch still held when each fragment is stored
+        stored_contents.append(sum(document.content is not None for document in batch))
+        return store(fragment)
+
+    batch = []
+    store_many = catalyst.repository.store_many
+
+    def store_many_and_keep_batch(fragments):
+        batch[:] = fragments
+        return store_many(fragments)
+
+    catalyst.repository.store = store_and_count_contents
+    catalyst.repository.store_many = store_many_and_keep_batch
+    catalyst.add_documents_from_directory(directory, batch_size=4)
+
+    assert stored_contents == [0, 0, 0, 0]
+
+
+def test_add_documents_from_directory_with_pattern(catalyst, directory):
+    documents = catalyst.add_documents_from_directory(directory, pattern="*.txt")
+
+    assert sorted(document.metadata["file_name"] for document in documents) == ["a.txt", "b.txt"]
+
+
+def test_add_documents_from_directory_is_idempotent(catalyst, directory):
+    catalyst.add_documents_from_directory(directory, pattern="*.txt")
+    documents = catalyst.add_documents_from_directory(directory)
+
+    assert sorted(document.metadata["file_name"] for document in documents) == ["c.md", "sub/a.txt"]
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Document"), with_content=False)) == 4
+
+
+def test_add_document_from_file_deduplicates_by_content(catalyst, directory):
+    document = catalyst.add_document_from_file(directory / "b.txt")
+    duplicate = catalyst.add_document_from_file(directory / "sub" / "copy_of_b.txt")
+
+    assert duplicate.id == document.id
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Document"), with_content=False)) == 1
+
+
+def test_add_documents_from_missing_directory(catalyst, tmpdir):
+    with pytest.raises(OperationError):
+        catalyst.add_documents_from_directory(Path(tmpdir) / "does_not_exist")
@@ -0,0 +1,976 @@
+import asyncio
+import inspect
+import multiprocessing
+import os
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator
+from typing import Annotated
+
+import httpx
+import openai
+import pytest
+
+from az_ai.catalyst import (
+    Catalyst,
+    Document,
+    Fragment,
+    FragmentRelationships,
+    HedgePolicy,
+    OperationError,
+    RetryPolicy,
+)
+from az_ai.catalyst.runner import CatalystRunner
+from az_ai.catalyst.schema import FragmentSelector, OperationsLogEntry
+
+
+@pytest.fixture(scope="function")
+def catalyst():
+    return Catalyst(repository_url="memory:")
+
+
+@pytest.fixture(scope="function")
+def document(catalyst):
+    return catalyst.repository.store(Document(id="document_id", label="document_label"))
+
+
+def test_operations_run_in_dependency_order(catalyst, document):
+    # registered in reverse order of their dependencies
+    @catalyst.operation()
+    def third(input: Annotated[Fragment, {"label": "second"}]) -> Annotated[Fragment, "third"]:
+        return Fragment.with_source(input, label="third")
+
+    @catalyst.operation()
+    def second(input: Annotated[Fragment, {"label": "first"}]) -> Annotated[Fragment, "second"]:
+        return Fragment.with_source(input, label="second")
+
+    @catalyst.operation()
+    def first(input: Document) -> Annotated[Fragment, "first"]:
+        return Fragment.with_source(input, label="first")
+
+    catalyst()
+
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["third"]))) == 1
+
+
+def test_circular_dependencies_are_rejected(catalyst, document):
+    @catalyst.operation()
+    def ping(input: Annotated[Fragment, {"label": "pong"}]) -> Annotated[Fragment, "ping"]:
+        return Fragment.with_source(input, label="ping")
+
+    @catalyst.operation()
+    def pong(input: Annotated[Fragment, {"label": "ping"}]) -> Annotated[Fragment, "pong"]:
+        return Fragment.with_source(input, label="pong")
+
+    with pytest.raises(OperationError) as excinfo:
+        catalyst()
+
+    assert "Circular dependency" in str(excinfo.value)
+
+
+def test_independent_operations_run_concurrently(catalyst, document):
+    # each branch waits for the other one: they only complete if they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+
+    @catalyst.operation()
+    def left(input: Document) -> Annotated[Fragment, "left"]:
+        barrier.wait()
+        return Fragment.with_source(input, label="left")
+
+    @catalyst.operation()
+    def right(input: Document) -> Annotated[Fragment, "right"]:
+        barrier.wait()
+        return Fragment.with_source(input, label="right")
+
+    @catalyst.operation()
+    def join(
+        left: Annotated[Fragment, {"label": "left"}], right: Annotated[Fragment, {"label": "right"}]
+    ) -> Annotated[Fragment, "join"]:
+        return Fragment.with_source(left, label="join")
+
+    catalyst()
+
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["join"]))) == 1
+
+
+def test_failure_stops_dependent_operations(catalyst, document):
+    @catalyst.operation()
+    def failing(input: Document) -> Annotated[Fragment, "failing"]:
+        raise ValueError("failure")
+
+    @catalyst.operation()
+    def dependent(input: Annotated[Fragment, {"label": "failing"}]) -> Annotated[Fragment, "dependent"]:
+        raise AssertionError("should not be called")
+
+    with pytest.raises(OperationError) as excinfo:
+        catalyst()
+
+    assert isinstance(excinfo.value.__cause__, ValueError)
+
+
+def split_in_parts(catalyst):
+    @catalyst.operation()
+    def split(input: Document) -> Annotated[list[Fragment], "part"]:
+        return [Fragment.with_source(input, label="part", metadata={"number": i}) for i in range(3)]
+
+
+def test_operation_calls_run_concurrently(catalyst, document):
+    split_in_parts(catalyst)
+    # each call waits for the two others: they only complete if they run at the same time
+    barrier = threading.Barrier(3, timeout=5)
+
+    @catalyst.operation(max_concurrency=3)
+    def describe(input: Annotated[Fragment, {"label": "part"}]) -> Annotated[Fragment, "description"]:
+        barrier.wait()
+        return Fragment.with_source(input, label="description")
+
+    catalyst()
+
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["description"]))) == 3
+    assert len(catalyst.repository.find_operations_log_entry(operation_name="describe")) == 3
+
+
+def test_failed_call_keeps_completed_siblings(catalyst, document):
+    split_in_parts(catalyst)
+    barrier = threading.Barrier(3, timeout=5)
+
+    @catalyst.operation(max_concurrency=3)
+    def describe(input: Annotated[Fragment, {"label": "part"}]) -> Annotated[Fragment, "description"]:
+        barrier.wait()
+        if input.metadata["number"] == 1:
+            raise ValueError("failure")
+        return Fragment.with_source(input, label="description")
+
+    with pytest.raises(OperationError):
+        catalyst()
+
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["description"]))) == 2
+    assert len(catalyst.repository.find_operations_log_entry(operation_name="describe")) == 2
+
+
+def test_max_concurrency_must_be_positive(catalyst):
+    with pytest.raises(ValueError):
+
+        @catalyst.operation(max_concurrency=0)
+        def describe(input: Document) -> Annotated[Fragment, "description"]:
+            return Fragment.with_source(input, label="description")
+
+
+def test_async_operation_calls_run_concurrently(catalyst, document):
+    split_in_parts(catalyst)
+    started = 0
+    all_started = asyncio.Event()
+
+    @catalyst.operation(max_concurrency=3)
+    async def describe(input: Annotated[Fragment, {"label": "part"}]) -> Annotated[Fragment, "description"]:
+        nonlocal started
+        started += 1
+        if started == 3:
+            all_started.set()
+        await asyncio.wait_for(all_started.wait(), timeout=5)
+        return Fragment.with_source(input, label="description")
+
+    assert inspect.iscoroutinefunction(describe)
+
+    catalyst()
+
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["description"]))) == 3
+
+
+@pytest.mark.asyncio
+async def test_arun_from_event_loop(catalyst, document):
+    @catalyst.operation()
+    async def describe(input: Document) -> Annotated[Fragment, "description"]:
+        await asyncio.sleep(0)
+        return Fragment.with_source(input, label="description")
+
+    @catalyst.operation()
+    def summarize(input: Annotated[Fragment, {"label": "description"}]) -> Annotated[Fragment, "summary"]:
+        return Fragment.with_source(input, label="summary")
+
+    await catalyst.arun()
+
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["summary"]))) == 1
+
+
+def describe_in_process(input: Annotated[Fragment, {"label": "part"}]) -> Annotated[Fragment, "description"]:
+    return Fragment.with_source(
+        input, label="description", metadata={"pid": os.getpid(), "content": input.content_as_str()}
+    )
+
+
+@pytest.mark.parametrize("repository_url", ["memory:", "local"])
+def test_process_executor(tmpdir, repository_url):
+    catalyst = Catalyst(repository_url=str(tmpdir) if repository_url == "local" else repository_url)
+    catalyst.repository.store(Document(id="document_id", label="document_label"))
+
+    @catalyst.operation()
+    def split(input: Document) -> Annotated[list[Fragment], "part"]:
+        return [
+            Fragment.with_source(input, label="part", content=f"part {i}".encode(), human_index=i) for i in range(3)
+        ]
+
+    assert catalyst.operation(executor="process", workers=2)(describe_in_process) is describe_in_process
+
+    catalyst()
+
+    descriptions = catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["description"]))
+    assert len(descriptions) == 3
+    assert all(description.metadata["pid"] != os.getpid() for description in descriptions)
+    assert sorted(description.metadata["content"] for description in descriptions) == ["part 0", "part 1", "part 2"]
+
+
+def test_process_executor_rejects_async_operations(catalyst):
+    with pytest.raises(ValueError):
+
+        @catalyst.operation(executor="process")
+        async def describe(input: Document) -> Annotated[Fragment, "description"]:
+            return Fragment.with_source(input, label="description")
+
+
+def test_streaming_runs_documents_through_the_pipeline(catalyst):
+    for i in range(2):
+        catalyst.repository.store(Document(id=f"document_{i}", label="document"))
+    calls = []
+
+    @catalyst.operation()
+    def extract(input: Document) -> Annotated[Fragment, "extract"]:
+        calls.append(("extract", input.id))
+        return Fragment.with_source(input, label="extract")
+
+    @catalyst.operation()
+    def chunk(input: Annotated[Fragment, {"label": "extract"}]) -> Annotated[Fragment, "chunk"]:
+        calls.append(("chunk", input.source_document_ref()))
+        return Fragment.with_source(input, label="chunk")
+
+    @catalyst.operation(scope="all")
+    def summarize(inputs: Annotated[list[Fragment], {"label": "chunk"}]) -> Annotated[Fragment, "summary"]:
+        calls.append(("summarize", len(inputs)))
+        return Fragment(label="summary")
+
+    catalyst(streaming=True, max_documents_in_flight=1)
+
+    assert calls == [
+        ("extract", "document_0"),
+        ("chunk", "document_0"),
+        ("extract", "document_1"),
+        ("chunk", "document_1"),
+        ("summarize", 2),
+    ]
+
+    calls.clear()
+    catalyst(streaming=True)
+    assert calls == []
+
+
+def store_duplicated_documents(catalyst):
+    for i in range(2):
+        document = Document(
+            id=f"document_{i}",
+            label="document",
+            content=b"same content",
+            metadata={"file_name": f"file_{i}.pdf", "language": "en" if i == 0 else "fr"},
+            parent_names=[f"file_{i}.pdf"],
+        )
+        catalyst.repository.store(document)
+
+
+def test_memoized_operation_reuses_outputs_of_identical_inputs(catalyst, monkeypatch):
+    store_duplicated_documents(catalyst)
+    calls = []
+    log_lookups = []
+    find_operations_log_entry = catalyst.repository.find_operations_log_entry
+
+    def counting_find_operations_log_entry(*args, **kwargs):
+        log_lookups.append(kwargs)
+        return find_operations_log_entry(*args, **kwargs)
+
+    monkeypatch.setattr(catalyst.repository, "find_operations_log_entry", counting_find_operations_log_entry)
+
+    @catalyst.operation(memoize=True)
+    def extract(input: Document) -> Annotated[list[Fragment], "extract"]:
+        calls.append(input.id)
+        return [
+            Fragment.with_source(input, label="extract", content=f"extract {i}".encode(), human_index=i)
+            for i in range(2)
+        ]
+
+    catalyst()
+
+    assert len(calls) == 1
+    extracts = catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["extract"]))
+    assert len(extracts) == 4
+    for i in range(2):
+        document_extracts = [extract for extract in extracts if extract.source_document_ref() == f"document_{i}"]
+        assert sorted(extract.content for extract in document_extracts) == [b"extract 0", b"extract 1"]
+        assert all(extract.metadata["file_name"] == f"file_{i}.pdf" for extract in document_extracts)
+        assert all(extract.parent_names == [f"file_{i}.pdf"] for extract in document_extracts)
+    # the memoization keys are read from the operations log once per run, not once per call
+    assert [lookup for lookup in log_lookups if lookup.get("operation_name") == "extract"] == [
+        {"operation_name": "extract"}
+    ]
+    assert len(catalyst.repository.find_operations_log_entry(operation_name="extract")) == 2
+
+
+def test_memoized_operation_compares_listed_metadata(catalyst):
+    store_duplicated_documents(catalyst)
+    calls = []
+
+    @catalyst.operation(memoize=["language"])
+    def extract(input: Document) -> Annotated[Fragment, "extract"]:
+        calls.append(input.id)
+        return Fragment.with_source(input, label="extract")
+
+    catalyst()
+
+    assert sorted(calls) == ["document_0", "document_1"]
+
+
+def register_chain(catalyst, calls, chunk_version):
+    @catalyst.operation()
+    def extract(input: Document) -> Annotated[Fragment, "extract"]:
+        calls.append("extract")
+        return Fragment.with_source(input, label="extract")
+
+    @catalyst.operation(version=chunk_version)
+    def chunk(input: Annotated[Fragment, {"label": "extract"}]) -> Annotated[list[Fragment], "chunk"]:
+        calls.append("chunk")
+        return [Fragment.with_source(input, label="chunk", human_index=i) for i in range(2)]
+
+    @catalyst.operation()
+    def embed(input: Annotated[Fragment, {"label": "chunk"}]) -> Annotated[Fragment, "embedding"]:
+        calls.append("embed")
+        return Fragment.with_source(input, label="embedding")
+
+
+def test_new_operation_version_invalidates_its_calls_and_downstream(catalyst, document):
+    calls = []
+    register_chain(catalyst, calls, chunk_version="1")
+    catalyst()
+    assert calls == ["extract", "chunk", "embed", "embed"]
+
+    calls.clear()
+    register_chain(catalyst, calls, chunk_version="1")
+    catalyst()
+    assert calls == []
+
+    calls.clear()
+    register_chain(catalyst, calls, chunk_version="2")
+    catalyst()
+    assert calls == ["chunk", "embed", "embed"]
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["chunk"]))) == 2
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["embedding"]))) == 2
+    assert {entry.operation_version for entry in catalyst.repository.find_operations_log_entry("chunk")} == {"2"}
+
+
+def test_call_arguments_are_grouped_by_source_document(catalyst):
+    documents = [Document(id=f"document_{i}", label="document") for i in range(2)]
+    parts = [Fragment.with_source(document, label="part", human_index=i) for document in documents for i in range(2)]
+    notes = [Fragment.with_source(document, label="note") for document in documents]
+
+    @catalyst.operation()
+    def combine(
+        part: Annotated[Fragment, {"label": "part"}], notes: Annotated[list[Fragment], {"label": "note"}]
+    ) -> Annotated[Fragment, "combination"]:
+        return Fragment.with_source(part, label="combination")
+
+    runner = CatalystRunner(catalyst)
+    arguments = list(runner._create_call_arguments(catalyst.operations()["combine"], [parts, notes]))
+
+    assert arguments == [
+        [parts[0], [notes[0]]],
+        [parts[1], [notes[0]]],
+        [parts[2], [notes[1]]],
+        [parts[3], [notes[1]]],
+    ]
+
+
+def test_call_arguments_are_generated_lazily(catalyst):
+    fragments = [Fragment(label="part") for _ in range(10_000)]
+
+    @catalyst.operation(scope="all")
+    def compare(
+        left: Annotated[Fragment, {"label": "part"}], right: Annotated[Fragment, {"label": "part"}]
+    ) -> Annotated[Fragment, "comparison"]:
+        return Fragment(label="comparison")
+
+    runner = CatalystRunner(catalyst)
+    arguments = runner._create_call_arguments(catalyst.operations()["compare"], [fragments, fragments])
+
+    # 10^8 combinations, only the first ones are built
+    assert next(arguments) == [fragments[0], fragments[0]]
+    assert next(arguments) == [fragments[0], fragments[1]]
+
+
+def store_pages(catalyst):
+    for i in range(2):
+        document = catalyst.repository.store(Document(id=f"document_{i}", label="document"))
+        for page in range(2):
+            for paragraph in range(2):
+                catalyst.repository.store(
+                    Fragment.with_source(
+                        document,
+                        label="paragraph",
+                        human_index=page * 2 + paragraph,
+                        metadata={"page_number": page, "file_name": "same.pdf"},
+                    )
+                )
+
+
+def test_scope_metadata_key_partitions_source_documents(catalyst):
+    store_pages(catalyst)
+    calls = []
+
+    @catalyst.operation(scope="metadata:page_number")
+    def summarize_page(
+        paragraphs: Annotated[list[Fragment], {"label": "paragraph"}],
+    ) -> Annotated[Fragment, "page_summary"]:
+        calls.append({(p.source_document_ref(), p.metadata["page_number"]) for p in paragraphs})
+        return Fragment.with_source(paragraphs[0], label="page_summary")
+
+    catalyst()
+
+    assert sorted(calls, key=sorted) == [
+        {("document_0", 0)},
+        {("document_0", 1)},
+        {("document_1", 0)},
+        {("document_1", 1)},
+    ]
+    assert all(len(call) == 1 for call in calls)
+
+
+def test_unknown_scope_is_rejected(catalyst):
+    with pytest.raises(ValueError):
+
+        @catalyst.operation(scope="page_number")
+        def summarize_page(
+            paragraphs: Annotated[list[Fragment], {"label": "paragraph"}],
+        ) -> Annotated[Fragment, "page_summary"]:
+            return Fragment.with_source(paragraphs[0], label="page_summary")
+
+
+def test_scope_function_partitions_across_source_documents(catalyst):
+    store_pages(catalyst)
+    calls = []
+
+    @catalyst.operation(scope=lambda fragment: fragment.metadata["file_name"])
+    def summarize_file(
+        paragraphs: Annotated[list[Fragment], {"label": "paragraph"}],
+    ) -> Annotated[Fragment, "file_summary"]:
+        calls.append(len(paragraphs))
+        return Fragment.with_source(paragraphs[0], label="file_summary")
+
+    catalyst()
+
+    assert calls == [8]
+
+
+def test_operation_calls_respect_client_rate_limits(monkeypatch):
+    monkeypatch.setenv("AZURE_OPENAI_REQUESTS_PER_MINUTE", "600")
+    catalyst = Catalyst(repository_url="memory:")
+    catalyst.repository.store(Document(id="document_id", label="document_label"))
+    acquired = []
+
+    limiter = catalyst.rate_limiter("azure_openai_client")
+    assert limiter.requests.rate == 10
+    assert catalyst.rate_limiter("document_intelligence_client") is None
+
+    async def acquire(tokens=0):
+        acquired.append(tokens)
+
+    monkeypatch.setattr(limiter, "acquire", acquire)
+
+    @catalyst.operation(client="azure_openai_client", estimated_tokens=500)
+    def describe(input: Document) -> Annotated[Fragment, "description"]:
+        return Fragment.with_source(input, label="description")
+
+    catalyst()
+
+    assert acquired == [500]
+
+
+def rate_limit_error(retry_after_ms: str = "1") -> openai.RateLimitError:
+    response = httpx.Response(
+        429,
+        headers={"retry-after-ms": retry_after_ms},
+        request=httpx.Request("POST", "https://example.openai.azure.com/openai/deployments/gpt/chat/completions"),
+    )
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def test_throttled_calls_lower_concurrency_and_are_retried(catalyst, document):
+    split_in_parts(catalyst)
+    throttled = set()
+    lock = threading.Lock()
+
+    @catalyst.operation(max_concurrency=4)
+    def describe(input: Annotated[Fragment, {"label": "part"}]) -> Annotated[Fragment, "description"]:
+        with lock:
+            if input.id not in throttled:
+                throttled.add(input.id)
+                raise rate_limit_error()
+        return Fragment.with_source(input, label="description")
+
+    catalyst()
+
+    entries = catalyst.repository.find_operations_log_entry(operation_name="describe")
+    assert len(entries) == 3
+    assert all(entry.throttle_count == 1 for entry in entries)
+    assert all(entry.concurrency < 4 for entry in entries)
+
+
+def test_throttled_calls_are_retried_a_bounded_number_of_times(catalyst, document):
+    calls = []
+
+    @catalyst.operation(retry=RetryPolicy(max_attempts=3))
+    def describe(input: Document) -> Annotated[Fragment, "description"]:
+        calls.append(input.id)
+        raise rate_limit_error(retry_after_ms="0")
+
+    with pytest.raises(OperationError) as excinfo:
+        catalyst()
+
+    assert isinstance(excinfo.value.__cause__, openai.RateLimitError)
+
+    assert len(calls) == 3
+
+
+def test_transient_failures_are_retried(catalyst, document, monkeypatch):
+    monkeypatch.setattr("az_ai.catalyst.runner.CIRCUIT_BREAKER_FAILURE_THRESHOLD", 10)
+    split_in_parts(catalyst)
+    attempts = []
+
+    @catalyst.operation(retry=RetryPolicy(initial_delay=0.01, jitter=0))
+    def describe(input: Annotated[Fragment, {"label": "part"}]) -> Annotated[Fragment, "description"]:
+        attempts.append(input.metadata["number"])
+        if attempts.count(input.metadata["number"]) < 3:
+            raise ConnectionError("connection reset")
+        return Fragment.with_source(input, label="description")
+
+    catalyst()
+
+    assert sorted(attempts) == [0, 0, 0, 1, 1, 1, 2, 2, 2]
+    assert len(catalyst.repository.find_operations_log_entry(operation_name="describe")) == 3
+
+
+def test_other_failures_are_not_retried_by_default(catalyst, document):
+    attempts = []
+
+    @catalyst.operation()
+    def describe(input: Document) -> Annotated[Fragment, "description"]:
+        attempts.append(input.id)
+        raise ValueError("malformed document")
+
+    with pytest.raises(OperationError):
+        catalyst()
+
+    assert attempts == ["document_id"]
+
+
+def test_failing_endpoint_pauses_calls(catalyst, document, monkeypatch):
+    monkeypatch.setattr("az_ai.catalyst.runner.CIRCUIT_BREAKER_FAILURE_THRESHOLD", 2)
+    monkeypatch.setattr("az_ai.catalyst.runner.CIRCUIT_BREAKER_RESET_TIMEOUT", 0.2)
+    attempts = []
+
+    @catalyst.operation(client="document_intelligence_client", retry=RetryPolicy(initial_delay=0, max_attempts=3))
+    def analyze(input: Document) -> Annotated[Fragment, "analysis"]:
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise TimeoutError("endpoint down")
+        return Fragment.with_source(input, label="analysis")
+
+    catalyst()
+
+    # the circuit opened after the second failure, the third attempt is the trial call
+    assert attempts[2] - attempts[1] >= 0.2
+    assert len(catalyst.repository.find_operations_log_entry(operation_name="analyze")) == 1
+
+
+def test_failed_calls_are_logged_and_other_calls_go_on(catalyst, document):
+    split_in_parts(catalyst)
+
+    @catalyst.operation()
+    def describe(input: Annotated[Fragment, {"label": "part"}]) -> Annotated[Fragment, "description"]:
+        if input.metadata["number"] == 1:
+            raise ValueError("malformed part")
+        return Fragment.with_source(input, label="description")
+
+    @catalyst.operation()
+    def summarize(input: Annotated[Fragment, {"label": "description"}]) -> Annotated[Fragment, "summary"]:
+        return Fragment.with_source(input, label="summary")
+
+    with pytest.raises(OperationError) as excinfo:
+        catalyst()
+
+    assert "1 operation calls failed" in str(excinfo.value)
+    assert "ValueError: malformed part" in str(excinfo.value)
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["summary"]))) == 2
+    failures = catalyst.repository.find_failure_log_entries()
+    assert [(failure.operation_name, failure.attempts, failure.error) for failure in failures] == [
+        ("describe", 1, "ValueError: malformed part")
+    ]
+
+
+def test_failed_calls_are_quarantined_then_retried_on_demand(catalyst, document):
+    split_in_parts(catalyst)
+    calls = []
+    broken = True
+
+    @catalyst.operation()
+    def describe(input: Annotated[Fragment, {"label": "part"}]) -> Annotated[Fragment, "description"]:
+        calls.append(input.metadata["number"])
+        if broken and input.metadata["number"] == 1:
+            raise ValueError("malformed part")
+        return Fragment.with_source(input, label="description")
+
+    for _ in range(2):
+        with pytest.raises(OperationError):
+            catalyst(quarantine_after=2)
+    assert catalyst.repository.find_failure_log_entries()[0].quarantined
+
+    catalyst(quarantine_after=2)
+    assert sorted(calls) == [0, 1, 1, 2]
+
+    broken = False
+    catalyst(retry_failed=True)
+    assert sorted(calls) == [0, 1, 1, 1, 2]
+    assert catalyst.repository.find_failure_log_entries() == []
+    assert len(catalyst.repository.find_operations_log_entry(operation_name="describe")) == 3
+
+
+def test_failure_log_is_read_once_per_run(catalyst, monkeypatch):
+    for number in range(3):
+        catalyst.repository.store(Document(id=f"document_{number}", label="document"))
+    split_in_parts(catalyst)
+    lookups = []
+    find_failure_log_entries = catalyst.repository.find_failure_log_entries
+
+    def counting_find_failure_log_entries(*args, **kwargs):
+        lookups.append(kwargs)
+        return find_failure_log_entries(*args, **kwargs)
+
+    monkeypatch.setattr(catalyst.repository, "find_failure_log_entries", counting_find_failure_log_entries)
+
+    @catalyst.operation()
+    def describe(input: Annotated[Fragment, {"label": "part"}]) -> Annotated[Fragment, "description"]:
+        if input.metadata["number"] == 1:
+            raise ValueError("malformed part")
+        return Fragment.with_source(input, label="description")
+
+    with pytest.raises(OperationError):
+        catalyst(streaming=True)
+    assert len(lookups) == 1
+    assert len(catalyst.repository.find_failure_log_entries()) == 3
+
+
+def test_retries_within_a_run_count_as_one_failure(catalyst, document, capsys):
+    split_in_parts(catalyst)
+
+    @catalyst.operation(retry=RetryPolicy(initial_delay=0, jitter=0))
+    def describe(input: Annotated[Fragment, {"label": "part"}]) -> Annotated[Fragment, "description"]:
+        if input.metadata["number"] == 1:
+            raise ConnectionError("connection reset")
+        return Fragment.with_source(input, label="description")
+
+    with pytest.raises(OperationError):
+        catalyst(quarantine_after=2)
+    failure = catalyst.repository.find_failure_log_entries()[0]
+    assert (failure.attempts, failure.runs, failure.quarantined) == (5, 1, False)
+
+    with pytest.raises(OperationError):
+        catalyst(quarantine_after=2)
+    assert catalyst.repository.find_failure_log_entries()[0].quarantined
+
+    capsys.readouterr()
+    catalyst(quarantine_after=2)
+    assert "1 quarantined operation calls skipped" in capsys.readouterr().out
+
+
+def test_batched_operation_calls_are_logged_per_input(catalyst):
+    for number in range(2):
+        catalyst.repository.store(Document(id=f"document_{number}", label="document"))
+    split_in_parts(catalyst)
+    batches = []
+
+    @catalyst.operation(batch_size=4)
+    def embed(parts: Annotated[list[Fragment], {"label": "part"}]) -> Annotated[list[Fragment], "embedding"]:
+        batches.append(len(parts))
+        return [Fragment.with_source(part, label="embedding") for part in parts]
+
+    catalyst()
+
+    assert sorted(batches) == [2, 4]
+    entries = catalyst.repository.find_operations_log_entry(operation_name="embed")
+    assert len(entries) == 6
+    assert all(len(entry.input_refs) == 1 and len(entry.output_refs) == 1 for entry in entries)
+    for entry in entries:
+        output = catalyst.repository.get(entry.output_refs[0])
+        assert output.relationships[FragmentRelationships.SOURCE] in entry.input_refs
+
+    catalyst()
+
+    assert sorted(batches) == [2, 4]
+
+
+def test_batched_operation_outputs_must_have_a_source_in_the_batch(catalyst, document):
+    split_in_parts(catalyst)
+
+    @catalyst.operation(batch_size=3)
+    def embed(parts: Annotated[list[Fragment], {"label": "part"}]) -> Annotated[list[Fragment], "embedding"]:
+        return [Fragment.with_source(document, label="embedding")]
+
+    with pytest.raises(OperationError) as excinfo:
+        catalyst()
+
+    assert "source is not in the batch" in str(excinfo.value)
+    assert len(catalyst.repository.find_failure_log_entries(operation_name="embed")) == 3
+
+
+def test_batched_operation_must_take_a_list(catalyst):
+    with pytest.raises(ValueError):
+
+        @catalyst.operation(batch_size=10)
+        def embed(part: Annotated[Fragment, {"label": "part"}]) -> Annotated[list[Fragment], "embedding"]:
+            return [Fragment.with_source(part, label="embedding")]
+
+
+def test_slow_calls_are_hedged(catalyst, document):
+    for number in range(6):
+        catalyst.repository.store(Fragment.with_source(document, label="part", metadata={"number": number}))
+    cancelled = []
+    calls = []
+
+    @catalyst.operation(hedge=HedgePolicy(min_samples=5))
+    async def describe(input: Annotated[Fragment, {"label": "part"}]) -> Annotated[Fragment, "description"]:
+        calls.append(input.metadata["number"])
+        # the first call of the last part is stuck
+        if input.metadata["number"] == 5 and calls.count(5) == 1:
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cancelled.append(input.metadata["number"])
+                raise
+        await asyncio.sleep(0.01)
+        return Fragment.with_source(input, label="description")
+
+    start = time.monotonic()
+    catalyst()
+
+    assert time.monotonic() - start < 10
+    assert calls.count(5) == 2
+    assert cancelled == [5]
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["description"]))) == 6
+    assert len(catalyst.repository.find_operations_log_entry(operation_name="describe")) == 6
+
+
+def test_distributed_run_waits_for_expired_claims(catalyst, document):
+    split_in_parts(catalyst)
+    # a crashed worker claimed the call and never ran it
+    fingerprint = OperationsLogEntry.compute_fingerprint("split", [document.id])
+    catalyst.repository.acquire_lease(fingerprint, "crashed_worker", ttl=0.5)
+
+    start = time.monotonic()
+    catalyst(distributed=True, lease_ttl=1)
+
+    assert time.monotonic() - start >= 0.5
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["part"]))) == 3
+    assert catalyst.repository.acquire_lease(fingerprint, "other_worker", ttl=60)
+
+
+def run_distributed_worker(repository_path: str, calls_path: str):
+    catalyst = Catalyst(repository_url=repository_path)
+
+    @catalyst.operation()
+    def split(input: Document) -> Annotated[list[Fragment], "part"]:
+        return [Fragment.with_source(input, label="part", human_index=i) for i in range(12)]
+
+    @catalyst.operation(max_concurrency=2)
+    def describe(input: Annotated[Fragment, {"label": "part"}]) -> Annotated[Fragment, "description"]:
+        with open(calls_path, "a") as f:
+            f.write(f"{input.id}\n")
+        time.sleep(0.05)
+        return Fragment.with_source(input, label="description")
+
+    catalyst(distributed=True, lease_ttl=2)
+
+
+def test_distributed_workers_share_the_calls(tmpdir):
+    repository_path = str(tmpdir / "repository")
+    calls_path = str(tmpdir / "calls.txt")
+    catalyst = Catalyst(repository_url=repository_path)
+    catalyst.repository.store(Document(id="document_id", label="document_label"))
+
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_distributed_worker, args=(repository_path, calls_path)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+    assert [worker.exitcode for worker in workers] == [0, 0]
+
+    with open(calls_path) as f:
+        calls = f.read().split()
+    assert len(calls) == 12
+    assert len(set(calls)) == 12
+    assert len(catalyst.repository.find_operations_log_entry(operation_name="split")) == 1
+    assert len(catalyst.repository.find_operations_log_entry(operation_name="describe")) == 12
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["description"]))) == 12
+
+
+def test_memory_budget_limits_calls_in_flight(catalyst, document):
+    for number in range(6):
+        catalyst.repository.store(
+            Fragment.with_source(document, label="page", content=bytes(100), metadata={"number": number})
+        )
+    in_flight = []
+    sizes = []
+
+    @catalyst.operation(max_concurrency=6)
+    async def describe(input: Annotated[Fragment, {"label": "page"}]) -> Annotated[Fragment, "description"]:
+        in_flight.append(input.id)
+        sizes.append((len(in_flight), len(input.content)))
+        await asyncio.sleep(0.01)
+        in_flight.remove(input.id)
+        return Fragment.with_source(input, label="description", content=b"description")
+
+    catalyst(memory_budget=250)
+
+    assert max(count for count, _ in sizes) == 2
+    assert all(size == 100 for _, size in sizes)
+    descriptions = catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["description"]))
+    assert [description.content for description in descriptions] == [b"description"] * 6
+
+
+def test_selected_operations_and_documents(catalyst):
+    for number in range(3):
+        catalyst.repository.store(Document(id=f"document_{number}", label="document"))
+    split_in_parts(catalyst)
+    calls = []
+
+    @catalyst.operation()
+    def describe(input: Annotated[Fragment, {"label": "part"}]) -> Annotated[Fragment, "description"]:
+        calls.append(input.source_document_ref())
+        return Fragment.with_source(input, label="description")
+
+    catalyst(operations=["split"], documents=["document_0", "document_1"])
+    assert calls == []
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["part"]))) == 6
+
+    catalyst(operations=["describe"], documents=["document_1"])
+    assert calls == ["document_1"] * 3
+
+    with pytest.raises(OperationError):
+        catalyst(operations=["unknown"])
+
+
+def test_sampled_runs_are_deterministic(catalyst):
+    for number in range(40):
+        catalyst.repository.store(Document(id=f"document_{number}", label="document"))
+    calls = []
+
+    @catalyst.operation()
+    def extract(input: Document) -> Annotated[Fragment, "extract"]:
+        calls.append(input.id)
+        return Fragment.with_source(input, label="extract")
+
+    catalyst(sample=0.25)
+    sampled = set(calls)
+    assert 0 < len(sampled) < 40
+
+    other = Catalyst(repository_url="memory:")
+    for number in reversed(range(40)):
+        other.repository.store(Document(id=f"document_{number}", label="document"))
+    other.operation()(extract)
+    calls.clear()
+    other(sample=0.5)
+    assert sampled < set(calls)
+
+    calls.clear()
+    catalyst(max_calls_per_operation=5)
+    assert len(calls) == 5
+    assert sampled.isdisjoint(calls)
+
+    with pytest.raises(ValueError):
+        catalyst(sample=0)
+
+
+def test_generator_operation_outputs_are_stored_incrementally_and_resumed(catalyst, document):
+    broken = True
+    yielded = []
+
+    @catalyst.operation()
+    def split(input: Document) -> Annotated[Iterator[Fragment], "page"]:
+        for number in range(5):
+            if broken and number == 3:
+                raise ValueError("interrupted")
+            yielded.append(number)
+            yield Fragment.with_source(input, label="page", content=f"page {number}".encode(), human_index=number)
+
+    with pytest.raises(OperationError):
+        catalyst()
+
+    pages = catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["page"]))
+    assert sorted(page.content for page in pages) == [b"page 0", b"page 1", b"page 2"]
+    [progress] = catalyst.repository.find_progress_log_entries(operation_name="split")
+    assert len(progress.output_refs) == 3
+
+    broken = False
+    yielded.clear()
+    catalyst()
+
+    assert yielded == [0, 1, 2, 3, 4]
+    pages = catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["page"]))
+    assert sorted(page.content for page in pages) == [f"page {number}".encode() for number in range(5)]
+    [entry] = catalyst.repository.find_operations_log_entry(operation_name="split")
+    assert entry.output_refs[:3] == progress.output_refs
+    assert catalyst.repository.find_progress_log_entries() == []
+
+
+def test_outputs_of_unfinished_generator_calls_are_hidden(catalyst, document):
+    broken = True
+    summaries = []
+
+    @catalyst.operation()
+    def split(input: Document) -> Annotated[Iterator[Fragment], "page"]:
+        for number in range(3):
+            if broken and number == 2:
+                raise ValueError("interrupted")
+            yield Fragment.with_source(input, label="page", metadata={"number": number})
+
+    @catalyst.operation()
+    def describe(input: Annotated[Fragment, {"label": "page"}]) -> Annotated[Fragment, "description"]:
+        return Fragment.with_source(input, label="description")
+
+    @catalyst.operation(scope="all")
+    def summarize(pages: Annotated[list[Fragment], {"label": "page"}]) -> Annotated[Fragment, "summary"]:
+        summaries.append(sorted(page.metadata["number"] for page in pages))
+        return Fragment(label="summary")
+
+    with pytest.raises(OperationError):
+        catalyst()
+    assert summaries == []
+    assert catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["description"])) == []
+
+    broken = False
+    catalyst()
+    assert summaries == [[0, 1, 2]]
+    assert len(catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["description"]))) == 3
+
+
+def test_async_generator_operation_is_retried_from_its_progress(catalyst, document):
+    attempts = []
+
+    @catalyst.operation(retry=RetryPolicy(initial_delay=0, jitter=0))
+    async def split(input: Document) -> Annotated[AsyncIterator[Fragment], "page"]:
+        attempts.append(1)
+        for number in range(4):
+            if len(attempts) == 1 and number == 2:
+                raise ConnectionError("connection reset")
+            await asyncio.sleep(0)
+            yield Fragment.with_source(input, label="page", metadata={"number": number})
+
+    catalyst()
+
+    assert len(attempts) == 2
+    pages = catalyst.repository.find(FragmentSelector(fragment_type="Fragment", labels=["page"]))
+    assert sorted(page.metadata["number"] for page in pages) == [0, 1, 2, 3]
@@ -91,3 +91,12 @@ def test_selector_matching():
     assert not document_with_labels.matches(generic_document)
     assert document_with_labels.matches(document_with_label)
     assert document_with_labels.matches(document_with_labels)
+
+
+def test_fragment_selector_match_source_document_refs():
+    document = Document(id="document_id", label="label1")
+    selector = FragmentSelector(fragment_type="Fragment", source_document_refs=[document.id])
+
+    assert selector.matches(document)
+    assert selector.matches(Fragment.with_source(document, label="label1"))
+    assert not selector.matches(Fragment(label="label1"))
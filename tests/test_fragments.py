@@ -117,6 +117,16 @@ def test_with_source(fragment):
     assert new_document.metadata == fragment.metadata
 
 
+def test_with_source_does_not_copy_the_content_fields(fragment):
+    fragment.content_ref = fragment.id
+    fragment.content_hash = "0" * 64
+    fragment.content_size = 1000
+
+    new_fragment = Fragment.with_source(fragment, label="derived")
+
+    assert (new_fragment.content_ref, new_fragment.content_hash, new_fragment.content_size) == (None, None, None)
+
+
 def test_with_source_with_extra_metadata(fragment):
     new_fragment = Fragment.with_source(fragment, update_metadata={"extra_key": "extra_value"})
 
@@ -0,0 +1,272 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+import requests
+from azure.core.exceptions import HttpResponseError
+from azure.core.pipeline.transport import RequestsTransportResponse
+from azure.core.utils import CaseInsensitiveDict
+
+from az_ai.catalyst.policies import (
+    AdaptiveConcurrency,
+    CircuitBreaker,
+    LatencyHistory,
+    MemoryBudget,
+    RateLimiter,
+    RetryPolicy,
+    TokenBucket,
+    retry_after,
+    throttling_error,
+    transient_error,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_over_time():
+    clock = FakeClock()
+    bucket = TokenBucket(rate_per_minute=60, capacity=2, clock=clock)
+
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(1.0)
+
+    clock.now = 0.5
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+    clock.now = 1.0
+    assert bucket.try_acquire() == 0
+
+
+def test_token_bucket_capacity_is_bounded():
+    clock = FakeClock()
+    bucket = TokenBucket(rate_per_minute=600, clock=clock)
+
+    clock.now = 3600
+    assert bucket.tokens == 100  # 10 seconds of tokens
+
+    # larger requests wait for a full bucket instead of forever
+    assert bucket.try_acquire(1000) == 0
+    assert bucket.tokens == 0
+
+
+def test_token_bucket_rejects_invalid_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(rate_per_minute=0)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_waits_for_requests_and_tokens(monkeypatch):
+    clock = FakeClock()
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+        clock.now += delay
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=6000, clock=clock)
+
+    await limiter.acquire(tokens=1000)
+    await limiter.acquire(tokens=1000)
+
+    # 10 requests but only 1000 tokens per 10 seconds
+    assert delays == [pytest.approx(10.0)]
+
+
+def test_adaptive_concurrency_halves_on_throttle_and_grows_on_success():
+    clock = FakeClock()
+    concurrency = AdaptiveConcurrency(max_concurrency=8, cooldown=1.0, clock=clock)
+
+    concurrency.on_throttle()
+    concurrency.on_throttle()  # same cooldown window
+    assert concurrency.limit == 4
+    assert concurrency.throttle_count == 2
+
+    clock.now = 1.0
+    concurrency.on_throttle()
+    assert concurrency.limit == 2
+
+    for _ in range(3):  # about one per slot
+        concurrency.on_success()
+    assert concurrency.limit == 3
+
+    for _ in range(100):
+        concurrency.on_success()
+    assert concurrency.limit == 8
+
+
+@pytest.mark.asyncio
+async def test_adaptive_concurrency_limits_calls_in_flight():
+    concurrency = AdaptiveConcurrency(max_concurrency=2)
+    await concurrency.acquire()
+    await concurrency.acquire()
+    concurrency.on_throttle()
+
+    waiting = asyncio.create_task(concurrency.acquire())
+    concurrency.release()
+    await asyncio.sleep(0)
+    assert not waiting.done()  # 1 call in flight, the limit is now 1
+
+    concurrency.release()
+    await asyncio.wait_for(waiting, timeout=1)
+    assert concurrency.in_flight == 1
+
+
+@pytest.mark.asyncio
+async def test_memory_budget_admits_calls_in_order():
+    budget = MemoryBudget(max_bytes=100)
+    await budget.acquire(60)
+
+    large = asyncio.create_task(budget.acquire(50))
+    await asyncio.sleep(0)
+    small = asyncio.create_task(budget.acquire(10))
+    await asyncio.sleep(0)
+    assert not large.done()
+    assert not small.done()  # fits, but does not overtake the larger call
+
+    budget.release(60)
+    await asyncio.wait_for(asyncio.gather(large, small), timeout=1)
+    assert (budget.in_use, budget.in_flight) == (60, 2)
+
+
+@pytest.mark.asyncio
+async def test_memory_budget_runs_oversized_calls_alone():
+    budget = MemoryBudget(max_bytes=100)
+    await budget.acquire(10)
+
+    oversized = asyncio.create_task(budget.acquire(500))
+    await asyncio.sleep(0)
+    assert not oversized.done()
+
+    cancelled = asyncio.create_task(budget.acquire(500))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    budget.release(10)
+    await asyncio.wait_for(oversized, timeout=1)
+    assert (budget.in_use, budget.in_flight) == (500, 1)
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    assert (budget.in_use, budget.in_flight) == (500, 1)
+
+
+def test_throttling_errors_of_openai_and_azure_core():
+    request = httpx.Request("POST", "https://example.openai.azure.com")
+    openai_error = openai.RateLimitError(
+        "Rate limit reached",
+        response=httpx.Response(429, headers={"retry-after-ms": "1500"}, request=request),
+        body=None,
+    )
+    assert throttling_error(openai_error) is openai_error
+    assert retry_after(openai_error) == 1.5
+
+    response = RequestsTransportResponse(None, requests.Response())
+    response.status_code = 503
+    response.headers = CaseInsensitiveDict({"Retry-After": "20"})
+    azure_error = HttpResponseError(response=response)
+    try:
+        try:
+            raise azure_error
+        except HttpResponseError as e:
+            raise ValueError("analysis failed") from e
+    except ValueError as e:
+        assert throttling_error(e) is azure_error
+    assert retry_after(azure_error) == 20
+
+    server_error = openai.InternalServerError("Server error", response=httpx.Response(500, request=request), body=None)
+    assert throttling_error(server_error) is None
+    assert throttling_error(ValueError()) is None
+    assert retry_after(server_error) is None
+
+
+def test_transient_errors():
+    request = httpx.Request("POST", "https://example.openai.azure.com")
+
+    assert transient_error(ConnectionError()) is not None
+    assert transient_error(openai.APITimeoutError(request=request)) is not None
+    assert (
+        transient_error(openai.InternalServerError("error", response=httpx.Response(500, request=request), body=None))
+        is not None
+    )
+    assert (
+        transient_error(openai.BadRequestError("error", response=httpx.Response(400, request=request), body=None))
+        is None
+    )
+    assert transient_error(ValueError()) is None
+
+
+def test_retry_policy_backs_off_exponentially():
+    policy = RetryPolicy(max_attempts=4, initial_delay=1, max_delay=3, jitter=0)
+
+    assert [policy.delay(ConnectionError(), attempt) for attempt in (1, 2, 3)] == [1, 2, 3]
+    assert policy.should_retry(ConnectionError(), 3)
+    assert not policy.should_retry(ConnectionError(), 4)
+    assert not policy.should_retry(ValueError(), 1)
+    assert RetryPolicy(retry_on=(ValueError,)).should_retry(ValueError(), 1)
+
+
+def test_retry_policy_jitter_and_retry_after():
+    policy = RetryPolicy(initial_delay=10)
+    delays = [policy.delay(ConnectionError(), 1) for _ in range(100)]
+    assert all(0 <= delay <= 10 for delay in delays)
+    assert len(set(delays)) > 1
+
+    request = httpx.Request("POST", "https://example.openai.azure.com")
+    error = openai.RateLimitError(
+        "Rate limit reached", response=httpx.Response(429, headers={"retry-after": "7"}, request=request), body=None
+    )
+    assert policy.delay(error, 1) == 7
+
+
+def test_circuit_breaker_opens_and_lets_a_trial_call_through():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+
+    breaker.on_failure()
+    assert breaker.try_acquire() == 0
+    breaker.on_failure()
+    assert breaker.state == "open"
+    assert breaker.try_acquire() == 30
+
+    clock.now = 30
+    assert breaker.try_acquire() == 0  # trial call
+    assert breaker.try_acquire() > 0
+    breaker.on_failure()
+    assert breaker.state == "open"
+
+    clock.now = 60
+    assert breaker.try_acquire() == 0
+    breaker.on_success()
+    assert breaker.state == "closed"
+    assert breaker.try_acquire() == 0
+
+
+def test_latency_history_quantiles():
+    history = LatencyHistory(int(duration * 1e9) for duration in range(1, 101))
+
+    assert history.quantile(0.95) == 95
+    assert history.quantile(0.5) == 50
+    assert LatencyHistory().quantile(0.95) is None
+
+    history = LatencyHistory(window=10)
+    for duration in range(100):
+        history.add(int(duration * 1e9))
+    assert len(history) == 10
+    assert history.quantile(0.01) == 90
+
+
+def test_rate_limiter_try_acquire_does_not_wait():
+    clock = FakeClock()
+    limiter = RateLimiter(requests_per_minute=6, clock=clock)
+
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    clock.now = 10
+    assert limiter.try_acquire()
@@ -1,3 +1,5 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pytest
@@ -8,7 +10,7 @@ from az_ai.catalyst.repository import (
     FragmentNotFoundError,
     LocalRepository,
 )
-from az_ai.catalyst.schema import OperationsLogEntry
+from az_ai.catalyst.schema import FailureLogEntry, OperationsLogEntry, ProgressLogEntry
 
 
 @pytest.fixture
@@ -135,6 +137,13 @@ def test_document_store(empty_repository, document):
     assert retrieved_document == document
 
 
+def test_content_size(empty_repository, fragment):
+    fragment.content = b"FRAGMENT CONTENT"
+    empty_repository.store(fragment)
+
+    assert empty_repository.find(with_content=False)[0].content_size == len(b"FRAGMENT CONTENT")
+
+
 def test_document_content_from_content_url(empty_repository, document):
     empty_repository.store(document)
 
@@ -174,3 +183,203 @@ def test_add_operations_log_entry(empty_repository):
 
     entries = empty_repository.find_operations_log_entry(operation_name="does_not_exist")
     assert entries == []
+
+
+def test_find_operations_log_fingerprints(empty_repository):
+    entry = OperationsLogEntry(operation_name="operation", input_refs=["foo", "bar"], output_refs=[], duration_ns=1)
+    empty_repository.add_operations_log_entry(entry)
+
+    done = OperationsLogEntry.compute_fingerprint("operation", ["bar", "foo"])
+    not_done = [
+        OperationsLogEntry.compute_fingerprint("operation", ["foo"]),
+        OperationsLogEntry.compute_fingerprint("other_operation", ["foo", "bar"]),
+    ]
+    assert entry.fingerprint == done
+    assert empty_repository.find_operations_log_fingerprints([done, *not_done]) == {done}
+
+
+def test_operations_log_without_fingerprints(empty_repository, tmpdir):
+    # logs written before fingerprints were recorded
+    (Path(tmpdir) / "_operations_log.json").write_text(
+        '{"entries": [{"operation_name": "operation", "input_refs": ["foo"], "output_refs": [], "duration_ns": 1}]}'
+    )
+
+    fingerprint = OperationsLogEntry.compute_fingerprint("operation", ["foo"])
+    assert empty_repository.find_operations_log_fingerprints([fingerprint]) == {fingerprint}
+
+
+def test_operations_log_fingerprints_across_repositories(empty_repository, tmpdir):
+    other_repository = LocalRepository(path=Path(tmpdir))
+    first, second = (
+        OperationsLogEntry(operation_name="operation", input_refs=[ref], output_refs=[], duration_ns=1)
+        for ref in ["foo", "bar"]
+    )
+    empty_repository.add_operations_log_entry(first)
+    assert other_repository.find_operations_log_fingerprints([first.fingerprint, second.fingerprint]) == {
+        first.fingerprint
+    }
+
+    # appended entries are read incrementally, deleted ones by reading the rewritten index again
+    empty_repository.add_operations_log_entry(second)
+    assert other_repository.find_operations_log_fingerprints([first.fingerprint, second.fingerprint]) == {
+        first.fingerprint,
+        second.fingerprint,
+    }
+    empty_repository.delete_operations_log_entries([first.fingerprint])
+    assert other_repository.find_operations_log_fingerprints([first.fingerprint, second.fingerprint]) == {
+        second.fingerprint
+    }
+
+
+def test_failure_log(empty_repository, tmpdir):
+    failure = FailureLogEntry(operation_name="operation", input_refs={"foo"}, error="ValueError: bad input")
+    operations_log = (Path(tmpdir) / "_operations_log.json").read_bytes()
+    empty_repository.add_failure_log_entry(failure)
+    # the failure of each call is stored apart from the operations log
+    assert (Path(tmpdir) / "_failures" / f"{failure.fingerprint}.json").exists()
+    assert (Path(tmpdir) / "_operations_log.json").read_bytes() == operations_log
+    empty_repository.add_failure_log_entry(
+        FailureLogEntry(operation_name="other_operation", input_refs={"foo"}, error="ValueError: bad input")
+    )
+    empty_repository.add_failure_log_entry(failure.model_copy(update={"attempts": 2, "quarantined": True}))
+
+    failures = empty_repository.find_failure_log_entries(operation_name="operation")
+    assert [(failure.attempts, failure.quarantined) for failure in failures] == [(2, True)]
+    assert failures[0].fingerprint == OperationsLogEntry.compute_fingerprint("operation", ["foo"])
+    assert empty_repository.find_failure_log_entries(fingerprints=[failure.fingerprint]) == failures
+
+    empty_repository.delete_failure_log_entries([failure.fingerprint])
+    assert [failure.operation_name for failure in empty_repository.find_failure_log_entries()] == ["other_operation"]
+
+
+def test_progress_log(empty_repository, tmpdir):
+    progress = ProgressLogEntry(operation_name="operation", input_refs={"foo"}, output_refs=["bar"])
+    operations_log = (Path(tmpdir) / "_operations_log.json").read_bytes()
+    empty_repository.add_progress_log_entry(progress)
+    # the progress of each call is stored apart from the operations log
+    assert (Path(tmpdir) / "_progress" / f"{progress.fingerprint}.json").exists()
+    assert (Path(tmpdir) / "_operations_log.json").read_bytes() == operations_log
+    empty_repository.add_progress_log_entry(progress.model_copy(update={"output_refs": ["bar", "baz"]}))
+
+    entries = empty_repository.find_progress_log_entries(fingerprints=[progress.fingerprint])
+    assert [entry.output_refs for entry in entries] == [["bar", "baz"]]
+    assert empty_repository.find_progress_log_entries(operation_name="other_operation") == []
+
+    empty_repository.delete_progress_log_entries([progress.fingerprint])
+    assert empty_repository.find_progress_log_entries() == []
+
+
+def test_leases(empty_repository):
+    assert empty_repository.acquire_lease("call", "worker_1", ttl=60)
+    assert not empty_repository.acquire_lease("call", "worker_2", ttl=60)
+    assert empty_repository.acquire_lease("call", "worker_1", ttl=60)
+    assert empty_repository.renew_lease("call", "worker_1", ttl=60)
+    assert not empty_repository.renew_lease("call", "worker_2", ttl=60)
+
+    empty_repository.release_lease("call", "worker_2")
+    assert not empty_repository.acquire_lease("call", "worker_2", ttl=60)
+    empty_repository.release_lease("call", "worker_1")
+    assert not empty_repository.renew_lease("call", "worker_1", ttl=60)
+    assert empty_repository.acquire_lease("call", "worker_2", ttl=60)
+
+
+def test_expired_lease(empty_repository, tmpdir):
+    assert empty_repository.acquire_lease("call", "worker_1", ttl=-1)
+
+    assert LocalRepository(path=Path(tmpdir)).acquire_lease("call", "worker_2", ttl=60)
+    assert not empty_repository.renew_lease("call", "worker_1", ttl=60)
+
+
+def test_update_metadata(empty_repository, fragment):
+    fragment.content = b"FRAGMENT CONTENT"
+    empty_repository.store(fragment)
+
+    updated = empty_repository.update_metadata(fragment.id, {"new_key": "new_value", "key": None})
+
+    assert updated.metadata == {"new_key": "new_value"}
+    retrieved_fragment = empty_repository.get(fragment.id)
+    assert retrieved_fragment.metadata == {"new_key": "new_value"}
+    assert retrieved_fragment.content == b"FRAGMENT CONTENT"
+
+
+def test_concurrent_metadata_updates_are_not_lost(empty_repository, fragment):
+    empty_repository.store(fragment)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda i: empty_repository.update_metadata(fragment.id, {f"key_{i}": i}), range(32)))
+
+    metadata = empty_repository.get(fragment.id).metadata
+    assert {key: value for key, value in metadata.items() if key.startswith("key_")} == {
+        f"key_{i}": i for i in range(32)
+    }
+
+
+def test_update_does_not_rewrite_unchanged_content(empty_repository, fragment):
+    fragment.content = b"FRAGMENT CONTENT"
+    empty_repository.store(fragment)
+    content_path = empty_repository._content_path(fragment)
+    content_path.write_bytes(b"MARKER")  # would be overwritten if the content was rewritten
+
+    fragment.metadata["key"] = "updated_value"
+    empty_repository.update(fragment)
+    assert content_path.read_bytes() == b"MARKER"
+
+    empty_repository.update(fragment, content_changed=True)
+    assert content_path.read_bytes() == b"FRAGMENT CONTENT"
+
+    fragment.content = b"NEW CONTENT"
+    empty_repository.update(fragment)
+    retrieved_fragment = empty_repository.get(fragment.id)
+    assert retrieved_fragment.content == b"NEW CONTENT"
+    assert retrieved_fragment.content_hash == fragment.compute_content_hash()
+
+
+def test_find_headers(repository, fragment, document):
+    headers = repository.find_headers(FragmentSelector(fragment_type="Document"))
+
+    assert [header.ref for header in headers] == [document.id]
+    assert headers[0].types == {"Document", "Fragment"}
+    assert headers[0].content_hash == document.content_hash
+    assert headers[0].source_document_ref == document.id
+
+
+def test_find_by_source_document(repository, document):
+    chunk = repository.store(Fragment.with_source(document, label="chunk"))
+
+    selector = FragmentSelector(fragment_type="Fragment", source_document_refs=[document.id])
+    assert sorted(fragment.id for fragment in repository.find(selector)) == sorted([document.id, chunk.id])
+    assert repository.find(FragmentSelector(fragment_type="Fragment", source_document_refs=["other_id"])) == []
+
+
+def test_index_without_source_documents(repository, document, tmpdir):
+    chunk = repository.store(Fragment.with_source(document, label="chunk", content=b"CHUNK"))
+    # indexes written before content hashes and source documents were indexed
+    index_path = Path(tmpdir) / "_fragments" / "_index.json"
+    index = json.loads(index_path.read_text())
+    for entry in index["fragments"]:
+        del entry["content_hash"], entry["source_document_ref"]
+    index_path.write_text(json.dumps(index))
+
+    repository = LocalRepository(path=Path(tmpdir))
+    selector = FragmentSelector(fragment_type="Fragment", source_document_refs=[document.id])
+    assert sorted(fragment.id for fragment in repository.find(selector)) == sorted([document.id, chunk.id])
+    assert repository.find_content_hashes(FragmentSelector(fragment_type="Fragment", labels=["chunk"])) == {
+        chunk.content_hash: chunk.id
+    }
+
+
+def test_delete(repository, document):
+    chunk = repository.store(Fragment.with_source(document, label="chunk", content=b"CHUNK"))
+    human_paths = [path for path in repository.human_path().rglob("*") if path.is_symlink()]
+
+    repository.delete(chunk.id)
+
+    with pytest.raises(FragmentNotFoundError):
+        repository.get(chunk.id)
+    assert repository.find(FragmentSelector(fragment_type="Fragment", labels=["chunk"])) == []
+    assert len([path for path in repository.human_path().rglob("*") if path.is_symlink()]) == len(human_paths) - 2
+    assert repository.get(document.id).content == Path("README.md").read_bytes()
+
+    with pytest.raises(FragmentNotFoundError):
+        repository.delete(chunk.id)
+    repository.delete_many([chunk.id])
@@ -1,17 +1,25 @@
 import os
+import pickle
+import re
+import time
 import uuid
+from unittest.mock import MagicMock
 
 import pytest
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
 from azure.identity import DefaultAzureCredential
-from azure.storage.blob import BlobServiceClient
+from azure.storage.blob import BlobProperties, BlobServiceClient
 
 from az_ai.catalyst import Document, Fragment, FragmentSelector
+from az_ai.catalyst import azure_repository as azure_repository_module
 from az_ai.catalyst.azure_repository import AzureRepository
 from az_ai.catalyst.repository import (
     DuplicateFragmentError,
+    FragmentIndexEntry,
     FragmentNotFoundError,
 )
-from az_ai.catalyst.schema import OperationsLogEntry
+from az_ai.catalyst.schema import Lease, OperationsLog, OperationsLogEntry, ProgressLogEntry
 
 
 @pytest.fixture(scope="module")
@@ -96,6 +104,32 @@ def test_add_operations_log_entry(azure_repository):
     # No direct retrieval API, but ensure no exception is raised
 
 
+def test_progress_log(azure_repository):
+    progress = ProgressLogEntry(operation_name="operation", input_refs={uuid.uuid4().hex}, output_refs=["bar"])
+    azure_repository.add_progress_log_entry(progress)
+    azure_repository.add_progress_log_entry(progress.model_copy(update={"output_refs": ["bar", "baz"]}))
+
+    entries = azure_repository.find_progress_log_entries(fingerprints=[progress.fingerprint])
+    assert [entry.output_refs for entry in entries] == [["bar", "baz"]]
+    assert progress.fingerprint in {entry.fingerprint for entry in azure_repository.find_progress_log_entries()}
+
+    azure_repository.delete_progress_log_entries([progress.fingerprint])
+    assert azure_repository.find_progress_log_entries(fingerprints=[progress.fingerprint]) == []
+
+
+def test_leases(azure_repository):
+    key = f"call-{uuid.uuid4().hex}"
+    assert azure_repository.acquire_lease(key, "worker_1", ttl=-1)
+    assert azure_repository.acquire_lease(key, "worker_2", ttl=60)
+    assert not azure_repository.acquire_lease(key, "worker_1", ttl=60)
+    assert not azure_repository.renew_lease(key, "worker_1", ttl=60)
+    assert azure_repository.renew_lease(key, "worker_2", ttl=60)
+
+    azure_repository.release_lease(key, "worker_2")
+    assert azure_repository.acquire_lease(key, "worker_1", ttl=60)
+    azure_repository.release_lease(key, "worker_1")
+
+
 def test_find_all(azure_repository, fragment, document):
     azure_repository.store(fragment)
     azure_repository.store(document)
@@ -103,3 +137,200 @@ def test_find_all(azure_repository, fragment, document):
     ids = [f.id for f in results]
     assert fragment.id in ids
     assert document.id in ids
+
+
+def test_update_metadata(azure_repository, document):
+    azure_repository.store(document)
+    azure_repository.update_metadata(document.id, {"extra": "value", "key": None})
+    retrieved = azure_repository.get(document.id)
+    assert retrieved.metadata == {"extra": "value"}
+    assert retrieved.content == document.content
+
+
+def test_find_headers(azure_repository, document):
+    azure_repository.store(document)
+    fragment = Fragment.with_source(document, label="fragment_label")
+    azure_repository.store(fragment)
+
+    headers = azure_repository.find_headers(FragmentSelector(fragment_type="Fragment", labels=["fragment_label"]))
+    header = next(header for header in headers if header.ref == fragment.id)
+    assert header.types == {"Fragment"}
+    assert header.source_document_ref == document.id
+
+    content_hashes = azure_repository.find_content_hashes(FragmentSelector(fragment_type="Document"))
+    assert content_hashes[document.content_hash] == document.id
+
+
+def test_duplicate_insert_from_another_instance(azure_repository, fragment):
+    azure_repository.store(fragment)
+    other_repository = AzureRepository(
+        os.environ["AZURE_STORAGE_ACCOUNT_URL"],
+        azure_repository.container_client.container_name,
+        DefaultAzureCredential(),
+    )
+    other_repository._known_ids = set()  # force the service-side duplicate detection
+    with pytest.raises(DuplicateFragmentError):
+        other_repository.store(fragment)
+
+
+def test_update_unknown_fragment(azure_repository, fragment):
+    with pytest.raises(FragmentNotFoundError):
+        azure_repository.update(fragment)
+
+
+def test_pickled_repository(azure_repository, fragment):
+    azure_repository.store(fragment)
+    unpickled_repository = pickle.loads(pickle.dumps(azure_repository))
+
+    assert unpickled_repository.get(fragment.id).content == fragment.content
+
+
+def test_delete(azure_repository, fragment):
+    fragment.content = b"FRAGMENT CONTENT"
+    azure_repository.store(fragment)
+
+    azure_repository.delete(fragment.id)
+
+    with pytest.raises(FragmentNotFoundError):
+        azure_repository.get(fragment.id)
+
+
+# Unit tests against a mocked container client
+
+
+@pytest.fixture
+def mocked_repository(monkeypatch):
+    """An AzureRepository whose container client is a mock returning one blob client mock per blob name."""
+    service_client = MagicMock()
+    monkeypatch.setattr(azure_repository_module, "BlobServiceClient", MagicMock(return_value=service_client))
+    repository = AzureRepository("https://account.blob.core.windows.net", "container", credential=None)
+
+    container_client = MagicMock()
+    container_client.list_blobs.return_value = []
+    container_client.find_blobs_by_tags.return_value = []
+    blob_clients = {}
+    container_client.get_blob_client.side_effect = lambda name: blob_clients.setdefault(name, MagicMock())
+    repository.container_client = container_client
+    return repository
+
+
+def _downloader(data: str, etag: str) -> MagicMock:
+    downloader = MagicMock()
+    downloader.readall.return_value = data.encode("utf-8")
+    downloader.properties.etag = etag
+    return downloader
+
+
+def test_store_writes_valid_tags_and_ascii_metadata_if_missing(mocked_repository):
+    fragment = Fragment(id="fragment-1", label="résumé & notes", metadata={})
+    mocked_repository.store(fragment)
+
+    upload = mocked_repository.container_client.get_blob_client("_fragments/Fragment/fragment-1.json").upload_blob
+    kwargs = upload.call_args.kwargs
+    assert kwargs["match_condition"] == MatchConditions.IfMissing
+    assert kwargs["overwrite"] is False
+
+    tags = kwargs["tags"]
+    assert tags["id"] == "fragment-1"
+    assert tags["type"] == "Fragment"
+    assert tags["label"].startswith("b64:")
+    assert all(re.fullmatch(r"[A-Za-z0-9 +\-./:=_]{0,256}", value) for value in tags.values())
+
+    metadata = kwargs["metadata"]
+    assert all(value.isascii() for value in metadata.values())
+    header = mocked_repository._header(BlobProperties(name="_fragments/Fragment/fragment-1.json", metadata=metadata))
+    assert header == FragmentIndexEntry.from_fragment(fragment)
+
+
+def test_store_hashes_tag_values_too_long_to_encode(mocked_repository):
+    mocked_repository.store(Fragment(id="fragment-1", label="é" * 200, metadata={}))
+
+    upload = mocked_repository.container_client.get_blob_client("_fragments/Fragment/fragment-1.json").upload_blob
+    label_tag = upload.call_args.kwargs["tags"]["label"]
+    assert label_tag.startswith("sha256:")
+    assert len(label_tag) <= 256
+
+
+def test_store_duplicate_detected_by_conditional_write(mocked_repository):
+    fragment = Fragment(id="fragment-1", label="label", metadata={})
+    upload = mocked_repository.container_client.get_blob_client("_fragments/Fragment/fragment-1.json").upload_blob
+    upload.side_effect = ResourceExistsError("exists")
+
+    with pytest.raises(DuplicateFragmentError):
+        mocked_repository.store(fragment)
+    # The id is now known, the second attempt is rejected without a request
+    with pytest.raises(DuplicateFragmentError):
+        mocked_repository.store(fragment)
+    assert upload.call_count == 1
+
+
+def test_update_writes_only_if_present(mocked_repository):
+    fragment = Fragment(id="fragment-1", label="label", metadata={})
+    upload = mocked_repository.container_client.get_blob_client("_fragments/Fragment/fragment-1.json").upload_blob
+    upload.side_effect = ResourceModifiedError("missing")
+
+    with pytest.raises(FragmentNotFoundError):
+        mocked_repository.update(fragment)
+    assert upload.call_args.kwargs["match_condition"] == MatchConditions.IfPresent
+    assert upload.call_args.kwargs["overwrite"] is True
+
+
+def test_operations_log_update_is_retried_when_the_etag_changed(mocked_repository):
+    log_client = mocked_repository.container_client.get_blob_client("_operations_log.json")
+    log_client.download_blob.side_effect = [
+        _downloader(OperationsLog().model_dump_json(), "etag-1"),
+        _downloader(OperationsLog().model_dump_json(), "etag-2"),
+    ]
+    log_client.upload_blob.side_effect = [ResourceModifiedError("modified"), None]
+
+    entry = OperationsLogEntry(operation_name="op", input_refs=["foo"], output_refs=["bar"], duration_ns=1)
+    mocked_repository.add_operations_log_entry(entry)
+
+    calls = log_client.upload_blob.call_args_list
+    assert [call.kwargs["etag"] for call in calls] == ["etag-1", "etag-2"]
+    assert all(call.kwargs["match_condition"] == MatchConditions.IfNotModified for call in calls)
+    assert OperationsLog.model_validate_json(calls[-1].args[0]).entries == [entry]
+
+
+def test_expired_lease_is_taken_over_only_if_not_modified(mocked_repository):
+    lease_client = mocked_repository.container_client.get_blob_client("_leases/key.json")
+    expired = Lease(key="key", owner="other", expires_at=time.time() - 1)
+    lease_client.download_blob.return_value = _downloader(expired.model_dump_json(), "etag-1")
+    lease_client.upload_blob.side_effect = [ResourceExistsError("exists"), None]
+
+    assert mocked_repository.acquire_lease("key", "owner", ttl=10)
+
+    first, second = lease_client.upload_blob.call_args_list
+    assert first.kwargs["match_condition"] == MatchConditions.IfMissing
+    assert second.kwargs["etag"] == "etag-1"
+    assert second.kwargs["match_condition"] == MatchConditions.IfNotModified
+
+
+def test_find_headers_of_source_documents_queries_blob_index_tags(mocked_repository):
+    container_client = mocked_repository.container_client
+    document = Document(id="doc-1", label="document", metadata={})
+    fragment = Fragment.with_source(document, label="part")
+    mocked_repository.store(fragment)
+    fragment_path = f"_fragments/Fragment/{fragment.id}.json"
+    other_path = "_fragments/Fragment/other.json"
+    uploaded_metadata = container_client.get_blob_client(fragment_path).upload_blob.call_args.kwargs["metadata"]
+    container_client.get_blob_client(fragment_path).get_blob_properties.return_value = BlobProperties(
+        name=fragment_path, metadata=uploaded_metadata
+    )
+    other = Fragment.with_source(document, label="part")
+    container_client.get_blob_client(other_path).get_blob_properties.return_value = BlobProperties(
+        name=other_path, metadata=AzureRepository._header_metadata(other)
+    )
+    # The blob index returns a fragment stored by another instance, not yet the one just stored
+    container_client.find_blobs_by_tags.return_value = [BlobProperties(name=other_path)]
+    container_client.list_blobs.reset_mock()
+
+    headers = mocked_repository.find_headers(FragmentSelector(fragment_type="Fragment", source_document_refs=["doc-1"]))
+
+    assert {header.ref for header in headers} == {fragment.id, other.id}
+    container_client.find_blobs_by_tags.assert_called_once_with("\"source_document\"='doc-1'")
+    container_client.list_blobs.assert_not_called()
+
+    mocked_repository.tag_index_lag = 0
+    headers = mocked_repository.find_headers(FragmentSelector(fragment_type="Fragment", source_document_refs=["doc-1"]))
+    assert {header.ref for header in headers} == {other.id}
@@ -0,0 +1,161 @@
+from pathlib import Path
+
+import pytest
+
+from az_ai.catalyst import Catalyst, Document, Fragment, FragmentSelector
+from az_ai.catalyst.repository import (
+    DuplicateFragmentError,
+    FragmentNotFoundError,
+    InMemoryRepository,
+)
+from az_ai.catalyst.schema import OperationsLogEntry, ProgressLogEntry
+
+
+@pytest.fixture
+def fragment():
+    return Fragment(
+        id="fragment_id",
+        label="fragment_label",
+        metadata={"key": "fragment_value"},
+    )
+
+
+@pytest.fixture
+def document():
+    return Document(
+        id="doc_id",
+        label="doc_label",
+        metadata={"key": "document_value"},
+        content_url="file:README.md",
+    )
+
+
+@pytest.fixture
+def repository(fragment, document):
+    repository = InMemoryRepository()
+
+    repository.store(fragment)
+    repository.store(document)
+
+    return repository
+
+
+def test_store(fragment):
+    repository = InMemoryRepository()
+    repository.store(fragment)
+
+    assert repository.get(fragment.id) == fragment
+
+
+def test_stored_fragment_is_a_copy(repository, fragment):
+    fragment.metadata["key"] = "changed"
+
+    assert repository.get(fragment.id).metadata["key"] == "fragment_value"
+
+
+def test_update(repository, fragment):
+    fragment.label = "updated_label"
+    repository.update(fragment)
+
+    assert repository.get(fragment.id).label == "updated_label"
+    assert len(repository.find(FragmentSelector(fragment_type="Fragment", labels=["updated_label"]))) == 1
+
+
+def test_update_unknown_fragment(repository):
+    with pytest.raises(FragmentNotFoundError):
+        repository.update(Fragment(label="unknown"))
+
+
+def test_find(repository, fragment, document):
+    assert repository.find(FragmentSelector(fragment_type="Fragment", labels=["fragment_label"])) == [fragment]
+    assert repository.find(FragmentSelector(fragment_type="Document")) == [document]
+    assert len(repository.find()) == 2
+
+
+def test_find_without_content(repository, document):
+    (found,) = repository.find(FragmentSelector(fragment_type="Document"), with_content=False)
+
+    assert found.content is None
+    assert found.content_hash == document.content_hash
+
+
+def test_document_content_from_content_url(repository, document):
+    assert repository.get(document.id).content == Path("README.md").read_bytes()
+
+
+def test_duplicate_insert(repository, fragment):
+    with pytest.raises(DuplicateFragmentError):
+        repository.store(fragment)
+
+
+def test_fragment_not_found(repository):
+    with pytest.raises(FragmentNotFoundError):
+        repository.get("non_existent_id")
+
+
+def test_size_accounting(fragment):
+    repository = InMemoryRepository(track_size=True)
+    fragment.content = b"12345"
+    repository.store(fragment)
+    size = repository.size_bytes
+
+    assert size == len(fragment.model_dump_json()) + 5
+
+    fragment.content = b"1234567890"
+    repository.update(fragment)
+
+    assert repository.size_bytes == len(fragment.model_dump_json()) + 10
+
+    repository.delete(fragment.id)
+
+    assert repository.size_bytes == 0
+
+
+def test_operations_log(repository):
+    entry = OperationsLogEntry(operation_name="op", input_refs=["foo"], output_refs=["bar"], duration_ns=1)
+    repository.add_operations_log_entry(entry)
+
+    assert repository.find_operations_log_entry(operation_name="op", input_fragment_refs={"foo"}) == [entry]
+    assert repository.find_operations_log_entry(operation_name="other") == []
+
+    repository.delete_operations_log_entries([entry.fingerprint])
+
+    assert repository.find_operations_log_entry() == []
+
+
+def test_progress_log(repository):
+    progress = ProgressLogEntry(operation_name="operation", input_refs={"foo"}, output_refs=["bar"])
+    repository.add_progress_log_entry(progress)
+    repository.add_progress_log_entry(progress.model_copy(update={"output_refs": ["bar", "baz"]}))
+
+    assert [entry.output_refs for entry in repository.find_progress_log_entries()] == [["bar", "baz"]]
+    assert repository.find_progress_log_entries(operation_name="other_operation") == []
+
+    repository.delete_progress_log_entries([progress.fingerprint])
+    assert repository.find_progress_log_entries(fingerprints=[progress.fingerprint]) == []
+
+
+def test_leases(repository):
+    assert repository.acquire_lease("call", "worker_1", ttl=60)
+    assert not repository.acquire_lease("call", "worker_2", ttl=60)
+    assert repository.renew_lease("call", "worker_1", ttl=60)
+
+    repository.release_lease("call", "worker_1")
+    assert repository.acquire_lease("call", "worker_2", ttl=-1)
+    assert repository.acquire_lease("call", "worker_1", ttl=60)
+    assert not repository.renew_lease("call", "worker_2", ttl=60)
+
+
+def test_catalyst_memory_repository():
+    catalyst = Catalyst(repository_url="memory:")
+
+    assert isinstance(catalyst.repository, InMemoryRepository)
+
+
+def test_update_metadata(repository, document):
+    updated = repository.update_metadata(document.id, {"extra": 1, "key": None})
+
+    assert updated.content is None
+    retrieved = repository.get(document.id)
+    assert retrieved.metadata == {"extra": 1}
+    assert retrieved.content == document.content